@@ -0,0 +1,150 @@
+""" 此文件用于批量写入帖子与图片记录，替代逐行的 Model.create() """
+import sqlite3
+
+from peewee import fn
+
+from filePathConfig import Config
+from SyncMetrics import metrics
+
+
+class BatchInserter:
+    """
+    按艺术家收集帖子行（以及对应的子图片行），在 flush() 时用 insert_many 分块写入。
+
+    postModel 为帖子表模型；imageModel 为图片表模型，没有子表时传入 None（例如 Twitter）。
+    imagePostFieldName 为图片表中指向帖子的外键字段名。
+    postsInsertedCallbacks 中的每一项 callback(postIds, postRows, extras) 在每次写入帖子后依次调用，
+    extras 为 addPost() 传入的 extra，用于写入其他依赖帖子主键的行（例如标签、全文索引），返回写入的行数。
+    transaction 可设置为当前的 BoundedTransaction，每次 flush() 后向其报告写入的行数。
+    imageProber 为 ImageProber 时，flush() 在写入前等待已提交的文件头探测完成。
+
+    postKeyFieldNames 为帖子表唯一约束的字段名，给出时帖子以 INSERT OR IGNORE 写入：唯一键已存在的帖子连同其图片行、
+    extra 一起跳过，因此对任意范围的目录重复同步都不会产生重复行。图片行总是以 INSERT OR IGNORE 写入。
+    """
+
+    def __init__(self, postModel, imageModel=None, imagePostFieldName: str = 'post', batchSize: int = None,
+                 postsInsertedCallbacks=(), imageProber=None, postKeyFieldNames=None):
+        self.postModel = postModel
+        self.imageModel = imageModel
+        self.imagePostFieldName = imagePostFieldName
+        self.batchSize = batchSize or Config.BULK_INSERT_BATCH_SIZE
+        self.postsInsertedCallbacks = list(postsInsertedCallbacks)
+        self.imageProber = imageProber
+        self.postKeyFieldNames = postKeyFieldNames
+
+        self.pendingPosts = []
+        self.pendingImages = []
+        self.pendingExtras = []
+        self.transaction = None
+
+    @staticmethod
+    def getMaxVariableNumber():
+        """ SQLite 单条语句允许的最大参数个数，3.32.0 之前默认为 999 """
+        if sqlite3.sqlite_version_info >= (3, 32, 0):
+            return 32766
+        return 999
+
+    def getChunkSize(self, model):
+        columnNumber = len(model._meta.sorted_fields) - 1  # 主键由 SQLite 自动分配
+        return max(1, min(self.batchSize, self.getMaxVariableNumber() // max(1, columnNumber)))
+
+    def addPost(self, postRow: dict, imageRows=None, extra=None):
+        """ 添加一条帖子行及其图片行（图片行中不需要包含外键字段） """
+        self.pendingPosts.append(postRow)
+        self.pendingImages.append(list(imageRows or []))
+        self.pendingExtras.append(extra)
+
+        if len(self.pendingPosts) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        """ 写入所有待处理的行，返回写入的帖子数 """
+        if not self.pendingPosts:
+            return 0
+
+        postRows, self.pendingPosts = self.pendingPosts, []
+        imageRowsOfPosts, self.pendingImages = self.pendingImages, []
+        extras, self.pendingExtras = self.pendingExtras, []
+
+        if self.imageProber is not None:
+            with metrics.stage('probe'):
+                self.imageProber.wait()
+
+        extraRowNumber = 0
+        with metrics.stage('insert'):
+            postIds = self.insertRows(self.postModel, postRows, self.postKeyFieldNames)
+            if None in postIds:
+                # 已存在的帖子不再写入图片与 extra
+                insertedPositions = [i for i, postId in enumerate(postIds) if postId is not None]
+                metrics.count('ignored_posts', len(postIds) - len(insertedPositions))
+                postIds = [postIds[i] for i in insertedPositions]
+                postRows = [postRows[i] for i in insertedPositions]
+                imageRowsOfPosts = [imageRowsOfPosts[i] for i in insertedPositions]
+                extras = [extras[i] for i in insertedPositions]
+
+            imageRows = []
+            if self.imageModel is not None:
+                for postId, rows in zip(postIds, imageRowsOfPosts):
+                    for row in rows:
+                        imageRows.append({**row, self.imagePostFieldName: postId})
+                self.insertRows(self.imageModel, imageRows, ignoreConflicts=True)
+
+            for callback in self.postsInsertedCallbacks:
+                extraRowNumber += callback(postIds, postRows, extras)
+        metrics.count('posts', len(postRows))
+        if self.imageModel is not None:
+            metrics.count('images', len(imageRows))
+
+        if self.transaction is not None:
+            self.transaction.addRows(len(postRows) + len(imageRows) + extraRowNumber)
+
+        return len(postRows)
+
+    def discard(self):
+        """ 丢弃尚未写入的行（事务回滚后调用） """
+        self.pendingPosts = []
+        self.pendingImages = []
+        self.pendingExtras = []
+        if self.imageProber is not None:
+            self.imageProber.discard()
+
+    def insertRows(self, model, rows, keyFieldNames=None, ignoreConflicts: bool = False):
+        """
+        分块执行 insert_many，并返回每一行对应的主键。
+
+        主键表为 INTEGER PRIMARY KEY（无 AUTOINCREMENT），同一条多行 INSERT 中 SQLite 会为新行
+        依次分配 max(rowid)+1，因此可以由 last_insert_rowid 反推出整块的主键。
+        keyFieldNames 不为 None 时以 INSERT OR IGNORE 写入，被忽略的行主键为 None；
+        ignoreConflicts 为 True 时同样以 INSERT OR IGNORE 写入，但不计算主键（返回空列表）。
+        """
+        insertedIds = []
+        chunkSize = self.getChunkSize(model)
+        for start in range(0, len(rows), chunkSize):
+            chunk = rows[start:start + chunkSize]
+            if keyFieldNames is not None:
+                insertedIds.extend(self.insertRowsOrIgnore(model, chunk, keyFieldNames))
+            elif ignoreConflicts:
+                model.insert_many(chunk).on_conflict_ignore().execute()
+            else:
+                lastRowId = model.insert_many(chunk).execute()
+                insertedIds.extend(range(lastRowId - len(chunk) + 1, lastRowId + 1))
+        return insertedIds
+
+    @staticmethod
+    def insertRowsOrIgnore(model, rows, keyFieldNames):
+        """
+        以 INSERT OR IGNORE 写入一块。没有行被忽略时新行的主键从写入前的最大主键起连续分配；
+        否则一次查询取出主键大于写入前最大主键的行，按唯一键对应回每一行。
+        """
+        primaryKey = model._meta.primary_key
+        maxIdBefore = model.select(fn.MAX(primaryKey)).scalar() or 0
+        model.insert_many(rows).on_conflict_ignore().execute()
+        insertedNumber = model._meta.database.execute_sql('SELECT changes()').fetchone()[0]
+        if insertedNumber == len(rows):
+            return list(range(maxIdBefore + 1, maxIdBefore + 1 + len(rows)))
+
+        keyFields = [model._meta.fields[fieldName] for fieldName in keyFieldNames]
+        idOfKey = {tuple(row[1:]): row[0] for row in model.select(primaryKey, *keyFields).where(primaryKey > maxIdBefore).tuples()}
+        # 同一块中唯一键重复的行只有第一行被写入；唯一键按列类型转换后再比较（例如整数形式的帖子 ID）
+        return [idOfKey.pop(tuple(field.python_value(field.db_value(row[field.name])) for field in keyFields), None)
+                for row in rows]
@@ -0,0 +1,54 @@
+""" 此文件用于把一次长时间的写入拆成多个有界的事务 """
+import time
+
+from filePathConfig import Config
+from SyncMetrics import metrics
+
+
+class BoundedTransaction:
+    """
+    db.atomic() 的包装。通过 addRows() 报告写入的行数，累计行数或事务持续时间超过上限时
+    提交当前事务并立即开始新事务；离开 with 块时与 db.atomic() 一样提交或回滚剩余部分。
+
+    中途提交意味着进程中断时一位艺术家可能只写入了一部分，扫描清单与 CSV 检查点仍只在艺术家处理完后记录，
+    下次同步会重新检查该艺术家并只补上缺少的帖子。
+    """
+
+    def __init__(self, db, maxRows: int = None, maxSeconds: float = None):
+        self.db = db
+        self.maxRows = maxRows or Config.TRANSACTION_MAX_ROWS
+        self.maxSeconds = maxSeconds or Config.TRANSACTION_MAX_SECONDS
+
+        self.atomicContext = None
+        self.transaction = None
+        self.rowNumber = 0
+        self.startTime = 0.0
+        self.commitNumber = 0
+
+    def __enter__(self):
+        self.atomicContext = self.db.atomic()
+        self.transaction = self.atomicContext.__enter__()
+        self.rowNumber = 0
+        self.startTime = time.monotonic()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        try:
+            with metrics.stage('commit'):
+                return self.atomicContext.__exit__(excType, excValue, traceback)
+        finally:
+            self.atomicContext = None
+            self.transaction = None
+
+    def addRows(self, rowNumber: int):
+        self.rowNumber += rowNumber
+        if self.rowNumber >= self.maxRows or time.monotonic() - self.startTime >= self.maxSeconds:
+            self.commit()
+
+    def commit(self):
+        """ 提交已写入的部分并开始新事务 """
+        with metrics.stage('commit'):
+            self.transaction.commit()
+        self.commitNumber += 1
+        self.rowNumber = 0
+        self.startTime = time.monotonic()
@@ -0,0 +1,262 @@
+""" 此文件用于维护三个来源共用的文件哈希表，并在其中查找内容相同或相似的文件 """
+import importlib
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from peewee import *
+
+from Util import Util
+from filePathConfig import Config
+from SyncMetrics import metrics
+
+# Pillow 为可选依赖，只有计算感知哈希时需要
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+db = SqliteDatabase(Config.DEDUP_DB_PATH, pragmas=Util.getSqlitePragmas())
+
+# 来源名 -> (模块名, 图片模型名)
+SOURCES = {
+    'kemono': ('kemono_sync', 'KemonoImage'),
+    'pixiv': ('pixiv_sync', 'PixivImage'),
+    'twitter': ('twitter_sync', 'TwitterPost'),
+}
+
+# 可以计算感知哈希的扩展名
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+UINT64_MASK = (1 << 64) - 1
+
+
+class FileHash(Model):
+    id = AutoField(column_name='id')
+    path = TextField(column_name='path', unique=True)
+    source = TextField(column_name='source')
+    size = IntegerField(column_name='size')
+    mtime_ns = IntegerField(column_name='mtime_ns')
+    sha1 = TextField(column_name='sha1', index=True)  # 与缩略图缓存的键相同
+    phash = IntegerField(column_name='phash', null=True)  # 64 位差值哈希（dHash），按有符号整数保存；NULL 为未计算、不是图片或无法解码
+    phash_checked = BooleanField(column_name='phash_checked', default=False)  # 是否已尝试计算感知哈希，无法解码的图片不再重复尝试
+
+    class Meta:
+        database = db
+        table_name = 'fileHash'
+
+
+def hashFile(filePath: str, withPerceptualHash: bool):
+    """ 在进程池中执行：返回 (sha1, 感知哈希, 错误信息) """
+    try:
+        sha1 = Util.computeFileSha1(filePath)
+    except (OSError, ValueError) as e:
+        return None, None, str(e)
+
+    perceptualHash = None
+    if withPerceptualHash and os.path.splitext(filePath)[1].lower() in IMAGE_EXTENSIONS:
+        perceptualHash = computeDifferenceHash(filePath)
+    return sha1, perceptualHash, None
+
+
+def computeDifferenceHash(filePath: str):
+    """ 缩小为 9x8 的灰度图，逐行比较相邻像素得到 64 位哈希；无法解码时返回 None """
+    try:
+        with Image.open(filePath) as image:
+            image.draft('L', (64, 64))  # JPEG 在解码时直接缩小
+            pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | (pixels[row * 9 + column] < pixels[row * 9 + column + 1])
+    # SQLite 的整数为有符号 64 位
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class DuplicateIndex:
+    """
+    以 (路径, 文件大小, mtime) 判断文件是否变化：未变化的文件不重新读取，只有新文件与被修改的文件在进程池中计算哈希。
+    文件列表取自各来源数据库中的图片行，因此应在同步之后运行；数据库中已不存在的路径从哈希表中删除。
+    计算感知哈希时，未变化的图片只有从未尝试过感知哈希才重新计算，无法解码的图片不会每次都重新读取。
+    """
+    BATCH_SIZE = 2000
+    CHUNK_SIZE = 8
+    WRITE_BATCH_SIZE = 500
+    # 查找相似图片时单个候选桶的文件数上限，桶内两两比较，过大的桶（多为纯色或空白图片）跳过
+    MAX_BUCKET_SIZE = 1000
+
+    def __init__(self, workerNumber: int = None, withPerceptualHash: bool = False):
+        self.workerNumber = workerNumber or Config.DEDUP_WORKER_NUMBER
+        self.withPerceptualHash = withPerceptualHash
+        db.connect(reuse_if_open=True)
+        db.create_tables([FileHash], safe=True)
+        Util.addMissingColumns(db, [FileHash])
+
+    def update(self, sources):
+        """ 更新哈希表，返回 Counter：hashed、unchanged、missing、removed """
+        counters = Counter()
+        with metrics.stage('query'):
+            # 补建 phash_checked 列之前已算出感知哈希的行同样视为已尝试
+            knownFiles = {path: (size, mtimeNs, phashChecked or phash is not None, source)
+                          for path, size, mtimeNs, phash, phashChecked, source in
+                          FileHash.select(FileHash.path, FileHash.size, FileHash.mtime_ns, FileHash.phash,
+                                          FileHash.phash_checked, FileHash.source).where(
+                              FileHash.source.in_(list(sources))
+                          ).tuples()}
+
+        executor = ProcessPoolExecutor(max_workers=self.workerNumber) if self.workerNumber > 1 else None
+        try:
+            for source in sources:
+                # 直接使用同步模块的 db 与模型，不构造同步类，因此不会创建来源数据库或执行迁移
+                moduleName, modelName = SOURCES[source]
+                module = importlib.import_module(moduleName)
+                model = getattr(module, modelName)
+                if not Util.isSchemaReady(module.db, [model]):
+                    # 不删除该来源已有的哈希行，数据库恢复后可继续使用
+                    print(f"[{source}] 数据库尚未创建或需要升级，请先执行同步脚本")
+                    continue
+                print(f"[{source}] 计算文件哈希")
+                seenPaths = set()
+                for batch in module.iterImageFiles(model._meta.primary_key.is_null(False), self.BATCH_SIZE):
+                    changedFiles = self.findChangedFiles(batch, knownFiles, seenPaths, counters)
+                    self.hashFiles(executor, source, changedFiles, counters)
+                counters['removed'] += self.removeStalePaths(source, seenPaths, knownFiles)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        for name, number in counters.items():
+            metrics.count(f'files_{name}', number)
+        Util.checkpointDatabase(db)
+        return counters
+
+    def findChangedFiles(self, batch, knownFiles: dict, seenPaths: set, counters: Counter):
+        """ 返回需要重新计算哈希的 [(路径, 文件大小, mtime)] """
+        changedFiles = []
+        with metrics.stage('stat'):
+            for _, filePath in batch:
+                if filePath in seenPaths:
+                    continue
+                try:
+                    stat = os.stat(filePath)
+                except OSError:
+                    # 不加入 seenPaths，已不存在的文件的旧哈希随后被删除
+                    counters['missing'] += 1
+                    continue
+                seenPaths.add(filePath)
+                knownFile = knownFiles.get(filePath)
+                if knownFile is not None and knownFile[:2] == (stat.st_size, stat.st_mtime_ns) and (
+                    knownFile[2] or not self.withPerceptualHash
+                    or os.path.splitext(filePath)[1].lower() not in IMAGE_EXTENSIONS
+                ):
+                    counters['unchanged'] += 1
+                    continue
+                changedFiles.append((filePath, stat.st_size, stat.st_mtime_ns))
+        return changedFiles
+
+    def hashFiles(self, executor, source: str, changedFiles, counters: Counter):
+        if not changedFiles:
+            return
+        filePaths = [filePath for filePath, _, _ in changedFiles]
+        flags = [self.withPerceptualHash] * len(filePaths)
+        with metrics.stage('hash'):
+            if executor is None:
+                results = list(map(hashFile, filePaths, flags))
+            else:
+                results = list(executor.map(hashFile, filePaths, flags, chunksize=self.CHUNK_SIZE))
+
+        rows = []
+        for (filePath, fileSize, mtimeNs), (sha1, perceptualHash, error) in zip(changedFiles, results):
+            if error is not None:
+                print(f"读取文件失败: {filePath} - {error}")
+                counters['missing'] += 1
+                continue
+            rows.append(dict(path=filePath, source=source, size=fileSize, mtime_ns=mtimeNs, sha1=sha1, phash=perceptualHash,
+                             phash_checked=self.withPerceptualHash))
+        with metrics.stage('write'), db.atomic():
+            for start in range(0, len(rows), self.WRITE_BATCH_SIZE):
+                FileHash.insert_many(rows[start:start + self.WRITE_BATCH_SIZE]).on_conflict(
+                    conflict_target=[FileHash.path],
+                    preserve=[FileHash.source, FileHash.size, FileHash.mtime_ns, FileHash.sha1, FileHash.phash, FileHash.phash_checked]
+                ).execute()
+        counters['hashed'] += len(rows)
+        print(f"[{source}] 已计算 {counters['hashed']} 个文件")
+
+    def removeStalePaths(self, source: str, seenPaths: set, knownFiles: dict):
+        """ 删除该来源中本次没有列出的路径（行已被删除或目录已改名），返回删除的行数 """
+        stalePaths = [path for path, knownFile in knownFiles.items() if knownFile[3] == source and path not in seenPaths]
+        with db.atomic():
+            for start in range(0, len(stalePaths), self.WRITE_BATCH_SIZE):
+                FileHash.delete().where(
+                    (FileHash.source == source) & FileHash.path.in_(stalePaths[start:start + self.WRITE_BATCH_SIZE])
+                ).execute()
+        return len(stalePaths)
+
+    @staticmethod
+    def findDuplicates(sources, crossSourceOnly: bool = True):
+        """ 返回 [(sha1, [(来源, 路径, 文件大小)])]；crossSourceOnly 为 True 时只返回出现在多个来源中的内容 """
+        sources = list(sources)
+        groupQuery = FileHash.select(FileHash.sha1).where(FileHash.source.in_(sources)).group_by(FileHash.sha1)
+        if crossSourceOnly:
+            groupQuery = groupQuery.having(fn.COUNT(FileHash.source.distinct()) > 1)
+        else:
+            groupQuery = groupQuery.having(fn.COUNT(FileHash.id) > 1)
+
+        filesOfHash = defaultdict(list)
+        for sha1, source, path, size in FileHash.select(FileHash.sha1, FileHash.source, FileHash.path, FileHash.size).where(
+            FileHash.sha1.in_(groupQuery) & FileHash.source.in_(sources)
+        ).order_by(FileHash.sha1, FileHash.source, FileHash.path).tuples():
+            filesOfHash[sha1].append((source, path, size))
+        return list(filesOfHash.items())
+
+    @staticmethod
+    def findNearDuplicates(sources, maxDistance: int = 4):
+        """
+        返回感知哈希的汉明距离不超过 maxDistance、但内容不完全相同的文件组 [[(来源, 路径)]]。
+
+        将 64 位哈希分为 maxDistance + 1 段，距离不超过 maxDistance 的两个哈希至少有一段完全相同，
+        因此只比较某一段相同的文件，不需要两两比较全部文件。
+        某一段相同的文件超过 MAX_BUCKET_SIZE 个时跳过该桶并输出提示，这些文件仍可能通过其他段的桶被分组。
+        """
+        files = list(FileHash.select(FileHash.source, FileHash.path, FileHash.sha1, FileHash.phash).where(
+            FileHash.phash.is_null(False) & FileHash.source.in_(list(sources))
+        ).tuples())
+        bandNumber = maxDistance + 1
+        bandBits = 64 // bandNumber
+        bandMask = (1 << bandBits) - 1
+        hashes = [phash & UINT64_MASK for _, _, _, phash in files]
+
+        candidates = defaultdict(list)
+        for i, value in enumerate(hashes):
+            for band in range(bandNumber):
+                candidates[(band, (value >> (band * bandBits)) & bandMask)].append(i)
+
+        # 并查集，把相似的文件合并为一组
+        parents = list(range(len(files)))
+
+        def findRoot(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        skippedBuckets = []
+        for (band, bandValue), indexes in candidates.items():
+            if len(indexes) > DuplicateIndex.MAX_BUCKET_SIZE:
+                skippedBuckets.append((band, bandValue, len(indexes)))
+                continue
+            for position, i in enumerate(indexes):
+                for j in indexes[position + 1:]:
+                    if files[i][2] != files[j][2] and (hashes[i] ^ hashes[j]).bit_count() <= maxDistance:
+                        parents[findRoot(i)] = findRoot(j)
+
+        for band, bandValue, fileNumber in skippedBuckets:
+            print(f"跳过过大的相似图片候选桶: 第 {band} 段 = {bandValue:#x}，{fileNumber} 个文件")
+        metrics.count('skipped_phash_buckets', len(skippedBuckets))
+
+        groups = defaultdict(list)
+        for i in range(len(files)):
+            groups[findRoot(i)].append(i)
+        return [[files[i][:2] for i in indexes] for indexes in groups.values()
+                if len({files[i][2] for i in indexes}) > 1]
@@ -0,0 +1,109 @@
+""" 此文件用于维护帖子标题、正文等文本的 SQLite FTS5 全文索引 """
+import sqlite3
+
+from filePathConfig import Config
+from SyncMetrics import metrics
+
+
+class FullTextIndex:
+    """
+    model 对应的 FTS5 虚拟表 {表名}Fts，rowid 与帖子主键相同，列为 fieldNames 对应的列。
+
+    作为 BatchInserter 的 postsInsertedCallbacks 之一，与帖子在同一事务中写入。
+    索引保存文本的副本（不使用 external content），删除帖子时需调用 deleteRows()/deleteRowsIn()。
+    trigram 分词按每 3 个字符建立索引，适用于不以空格分词的中日文；少于 3 个字符的关键词无法使用索引，
+    search() 对其改为扫描 FTS 表（仍比扫描主表小）。
+
+    groupFieldName 用于一条内容对应多行的表（Twitter 每个媒体文件一行，同一推文的文本重复）：
+    search() 对该字段相同的行只返回主键最小的一行，避免同一推文占用多个结果。
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, db, model, fieldNames, groupFieldName: str = None):
+        self.db = db
+        self.model = model
+        self.tableName = f"{model._meta.table_name}Fts"
+        self.fieldNames = list(fieldNames)
+        self.columnNames = [model._meta.fields[fieldName].column_name for fieldName in self.fieldNames]
+        self.groupColumnName = model._meta.fields[groupFieldName].column_name if groupFieldName else None
+        self.tokenizer = Config.FTS_TOKENIZER
+
+    def getColumnsSql(self):
+        return ', '.join(f'"{columnName}"' for columnName in self.columnNames)
+
+    def exists(self):
+        return self.db.execute_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.tableName,)).fetchone() is not None
+
+    def createIfNotExists(self):
+        """ 表不存在时创建并由主表填充（旧数据库首次升级），返回是否新建 """
+        if self.exists():
+            return False
+        try:
+            self.createTable(self.tokenizer)
+        except sqlite3.OperationalError as e:
+            # SQLite 3.34.0 之前没有 trigram 分词器
+            print(f"创建全文索引失败（{self.tokenizer}）: {e}，改用 unicode61 分词，中日文需按整词搜索")
+            self.createTable('unicode61')
+        self.rebuild()
+        return True
+
+    def createTable(self, tokenizer: str):
+        self.db.execute_sql(f"CREATE VIRTUAL TABLE \"{self.tableName}\" USING fts5({self.getColumnsSql()}, tokenize = '{tokenizer}')")
+
+    def rebuild(self):
+        """ 清空后由主表重新填充 """
+        with self.db.atomic():
+            self.db.execute_sql(f'DELETE FROM "{self.tableName}"')
+            self.db.execute_sql(
+                f'INSERT INTO "{self.tableName}" (rowid, {self.getColumnsSql()}) '
+                f'SELECT "{self.model._meta.primary_key.column_name}", {self.getColumnsSql()} FROM "{self.model._meta.table_name}"'
+            )
+        return self.db.execute_sql(f'SELECT COUNT(*) FROM "{self.tableName}"').fetchone()[0]
+
+    def __call__(self, postIds, postRows, extras):
+        """ postRows 与 postIds 一一对应，返回写入的行数 """
+        placeholders = ', '.join('?' * (len(self.columnNames) + 1))
+        with metrics.stage('fts'):
+            self.db.cursor().executemany(
+                f'INSERT INTO "{self.tableName}" (rowid, {self.getColumnsSql()}) VALUES ({placeholders})',
+                [(postId, *(postRow.get(fieldName) or '' for fieldName in self.fieldNames))
+                 for postId, postRow in zip(postIds, postRows)]
+            )
+        return len(postIds)
+
+    def deleteRows(self, postIds):
+        postIds = list(postIds)
+        for i in range(0, len(postIds), self.BATCH_SIZE):
+            chunk = postIds[i:i + self.BATCH_SIZE]
+            self.db.execute_sql(f'DELETE FROM "{self.tableName}" WHERE rowid IN ({", ".join("?" * len(chunk))})', chunk)
+
+    def deleteRowsIn(self, postIdsQuery):
+        """ postIdsQuery 为只选出帖子主键的 peewee 查询 """
+        sql, params = postIdsQuery.sql()
+        self.db.execute_sql(f'DELETE FROM "{self.tableName}" WHERE rowid IN ({sql})', params)
+
+    def search(self, keyword: str, limit: int = 100):
+        """
+        返回包含 keyword 的帖子主键，最近入库的在前。
+
+        不按相关度（rank）排序：常见关键词可能匹配数十万行，计算全部行的 rank 需要数百毫秒，
+        而按 rowid 倒序可以在取到 limit 行后立即停止。
+        """
+        if len(keyword) >= 3:
+            condition = f'"{self.tableName}" MATCH ?'
+            params = ['"' + keyword.replace('"', '""') + '"']
+        else:
+            pattern = '%' + keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            condition = ' OR '.join(f'"{columnName}" LIKE ? ESCAPE \'\\\'' for columnName in self.columnNames)
+            params = [pattern] * len(self.columnNames)
+
+        if self.groupColumnName is None:
+            sql = f'SELECT rowid FROM "{self.tableName}" WHERE {condition} ORDER BY rowid DESC LIMIT ?'
+        else:
+            # 分组需要先取出全部匹配的行，无法在取到 limit 行后提前停止
+            primaryKeyColumnName = self.model._meta.primary_key.column_name
+            sql = (f'SELECT MIN("{primaryKeyColumnName}") FROM "{self.model._meta.table_name}" '
+                   f'WHERE "{primaryKeyColumnName}" IN (SELECT rowid FROM "{self.tableName}" WHERE {condition}) '
+                   f'GROUP BY "{self.groupColumnName}" ORDER BY 1 DESC LIMIT ?')
+        cursor = self.db.execute_sql(sql, (*params, limit))
+        return [row[0] for row in cursor.fetchall()]
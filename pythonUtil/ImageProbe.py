@@ -0,0 +1,160 @@
+""" 此文件用于只读取文件头获取图片的宽高、格式与文件大小，不解码图片 """
+import os
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from filePathConfig import Config
+from SyncMetrics import metrics
+
+# width、height 在无法识别格式时为 None；宽高为文件中保存的像素尺寸，不考虑 EXIF 方向
+ImageInfo = namedtuple('ImageInfo', ['width', 'height', 'byteSize', 'format'])
+
+# 不带尺寸的 JPEG 标记：RST0~RST7、SOI、EOI、TEM
+JPEG_STANDALONE_MARKERS = {*range(0xD0, 0xDA), 0x01}
+# SOF0~SOF15 中除 DHT(C4)、JPG(C8)、DAC(CC) 外的帧头标记
+JPEG_SOF_MARKERS = {*range(0xC0, 0xD0)} - {0xC4, 0xC8, 0xCC}
+
+
+def probeImageFile(filePath: str):
+    """ 返回 ImageInfo；文件无法打开时返回 None，格式无法识别时只有 byteSize """
+    try:
+        with open(filePath, 'rb') as f:
+            byteSize = os.fstat(f.fileno()).st_size
+            head = f.read(32)
+            try:
+                size = parseImageHeader(head, f)
+            except (struct.error, ValueError):
+                size = None
+    except OSError:
+        return None
+    if size is None:
+        return ImageInfo(None, None, byteSize, None)
+    return ImageInfo(size[1], size[2], byteSize, size[0])
+
+
+def parseImageHeader(head: bytes, f):
+    """ head 为文件开头的 32 字节，f 已读到 head 之后；返回 (格式, 宽, 高) 或 None """
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', head[16:24])
+        return 'png', width, height
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', head[6:10])
+        return 'gif', width, height
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return parseWebpHeader(head)
+    if head[:2] == b'BM':
+        width, height = struct.unpack('<ii', head[18:26])
+        return 'bmp', width, abs(height)
+    if head[:2] == b'\xff\xd8':
+        return parseJpegHeader(f)
+    return None
+
+
+def parseWebpHeader(head: bytes):
+    chunkType = head[12:16]
+    if chunkType == b'VP8 ':
+        # 有损：帧标记 3 字节与起始码 9d 01 2a 之后为 14 位的宽、高
+        width, height = struct.unpack('<HH', head[26:30])
+        return 'webp', width & 0x3FFF, height & 0x3FFF
+    if chunkType == b'VP8L':
+        # 无损：签名 0x2f 之后为 14 位的宽 - 1 与 14 位的高 - 1
+        bits = struct.unpack('<I', head[21:25])[0]
+        return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunkType == b'VP8X':
+        # 扩展格式（动图、透明度）：24 位的画布宽 - 1 与高 - 1
+        return 'webp', int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+    return None
+
+
+def parseJpegHeader(f):
+    """ 从 SOI 之后逐个跳过段，直到帧头（SOF）；只读取段头，EXIF 等段用 seek 跳过 """
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            raise ValueError('无效的 JPEG 段')
+        marker = f.read(1)
+        while marker == b'\xff':  # 段之间允许填充 0xFF
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        segmentLength = struct.unpack('>H', f.read(2))[0]
+        if marker in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', f.read(5))
+            return 'jpeg', width, height
+        if marker == 0xDA:  # 图像数据开始前仍未遇到帧头
+            return None
+        f.seek(segmentLength - 2, os.SEEK_CUR)
+
+
+class ImageProber:
+    """
+    在线程池中探测图片文件头，填入即将写入的行（图片行，Twitter 为推文行）。
+
+    fields 为 (宽, 高, 文件大小, 格式) 对应的模型字段。submit() 立即返回，探测与后续帖子的解析重叠进行；
+    BatchInserter 在写入前调用 wait() 将结果填入行中，discard() 在事务回滚后丢弃未完成的探测。
+    文件不存在时四个字段都为 NULL，之后可由 backfill() 补写；文件大小为 NULL 即表示尚未探测。
+    threadNumber 为 1 时在当前线程中串行读取。
+    """
+
+    def __init__(self, fields, threadNumber: int = None):
+        self.widthField, self.heightField, self.byteSizeField, self.formatField = fields
+        self.fieldNames = [field.name for field in fields]
+        self.threadNumber = threadNumber or Config.IMAGE_PROBE_THREAD_NUMBER
+        self.executor = ThreadPoolExecutor(max_workers=self.threadNumber) if self.threadNumber > 1 else None
+        self.pending = []
+
+    def submit(self, row: dict, filePath: str):
+        """ 为 row 安排探测并返回 row；结果在 wait() 时写入 row """
+        for fieldName in self.fieldNames:
+            row[fieldName] = None
+        if self.executor is None:
+            self.fill(row, probeImageFile(filePath))
+        else:
+            self.pending.append((row, self.executor.submit(probeImageFile, filePath)))
+        return row
+
+    def fill(self, row: dict, imageInfo):
+        if imageInfo is None:
+            metrics.count('probe_missing')
+            return
+        row.update(zip(self.fieldNames, imageInfo))
+
+    def wait(self):
+        pending, self.pending = self.pending, []
+        for row, future in pending:
+            self.fill(row, future.result())
+
+    def discard(self):
+        pending, self.pending = self.pending, []
+        for _, future in pending:
+            future.cancel()
+
+    def backfill(self, db, iterImageFiles):
+        """ 为文件大小为 NULL 的行探测并写入，iterImageFiles 为同步模块的同名函数；返回写入的行数 """
+        model = self.byteSizeField.model
+        columnsSql = ', '.join(f'"{field.column_name}" = ?' for field in
+                               (self.widthField, self.heightField, self.byteSizeField, self.formatField))
+        updateSql = f'UPDATE "{model._meta.table_name}" SET {columnsSql} WHERE "{model._meta.primary_key.column_name}" = ?'
+        executor = self.executor or ThreadPoolExecutor(max_workers=1)
+        updatedNumber = 0
+        try:
+            for batch in iterImageFiles(self.byteSizeField.is_null()):
+                with metrics.stage('probe'):
+                    imageInfos = list(executor.map(probeImageFile, [filePath for _, filePath in batch]))
+                rows = [(*imageInfo, imageId) for (imageId, _), imageInfo in zip(batch, imageInfos) if imageInfo is not None]
+                with metrics.stage('write'), db.atomic():
+                    db.cursor().executemany(updateSql, rows)
+                updatedNumber += len(rows)
+                metrics.count('probe_missing', len(batch) - len(rows))
+                print(f"已补写 {updatedNumber} 张图片的尺寸")
+        finally:
+            if executor is not self.executor:
+                executor.shutdown()
+        return updatedNumber
@@ -1,79 +1,335 @@
 """ 此文件用于规范化post文件夹名 """
 import os
+import re
 import json
+import argparse
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor
+from peewee import Case
 from filePathConfig import Config
 from Util import Util
+from SyncMetrics import SyncMetrics, metrics
+from ParsedPostCache import ParsedPostCache
+from kemono_sync import db, KemonoArtist, KemonoPost, KemonoSyncer, parseKemonoPost
 from pathvalidate import sanitize_filename
 
+# 已规范化的目录名形如 [service][YYYY-MM-DD]title，只凭目录名即可判断，无需读取 post.json
+NORMALIZED_FOLDER_NAME_PATTERN = re.compile(r'^\[[^\[\]]+\]\[\d{4}-\d{2}-\d{2}\]')
+
+RenamePlanItem = namedtuple('RenamePlanItem', ['artistName', 'sourceName', 'targetName'])
+
+
 class PostRenamer:
-    def __init__(self):
-        pass
+    """
+    先生成完整的重命名计划再执行：
+
+    1. 列出所有帖子目录，跳过目录名已规范化的帖子；
+    2. 在线程池中读取其余帖子的 post.json，得到目标目录名；
+    3. 执行前检查冲突（多个目录得到同一目标名，或目标目录已存在），冲突的帖子不重命名；
+    4. 在线程池中执行重命名，并在一个事务中批量更新 kemonoPost.post_folder_name。
+
+    dryRun 为 True 时只输出计划，不改动磁盘与数据库。
+    renameAndIngest() 把重命名与 KemonoSyncer 的入库合并为一次遍历，每个 post.json 只解析一次。
+    """
+
+    def __init__(self, workerNumber: int = None, dryRun: bool = False):
+        self.workerNumber = workerNumber or Config.RENAME_WORKER_NUMBER
+        self.dryRun = dryRun
+        # 读取 post.json 与重命名共用的线程池，只在 doRename()/renameAndIngest() 执行期间存在
+        self.executor = None
 
-    def getTargetNameFromJsonFile(self, jsonFilePath: str):
+    @staticmethod
+    def isNormalizedFolderName(postName: str):
+        return NORMALIZED_FOLDER_NAME_PATTERN.match(postName) is not None
+
+    @staticmethod
+    def getTargetName(parsedPost):
+        """ 由 post.json 中的 service、published 与 title 生成规范化的目录名 """
+        published = parsedPost.published.split("T")[0]
+        title = sanitize_filename(parsedPost.title)
+        service = parsedPost.service
+
+        return '[{}][{}]{}'.format(service, published, title)
+
+    def parseCandidate(self, artistName: str, postName: str):
+        """ 线程池中执行：返回解析结果，失败时返回 None """
+        postDirPath = os.path.join(Config.KEMONO_BASEPATH, artistName, postName)
+        postJsonFilePath = os.path.join(postDirPath, "post.json")
         try:
-            with open(jsonFilePath, 'r', encoding='utf-8') as f:
-                jsonData = json.load(f)
+            with metrics.stage('scan'):
+                hasPostJson = 'post.json' in Util.scanDirectory(postDirPath).filesName
+        except OSError as e:
+            print(f"获取帖子目录内容失败: {postDirPath} - {e}")
+            return None
+        if not hasPostJson:
+            print(f"跳过没有 post.json 的帖子: {postDirPath}")
+            return None
+        try:
+            return parseKemonoPost(postDirPath)
         except Exception as e:
-            print(f"打开或解析 JSON 文件失败: {jsonFilePath} - {e}")
+            print(f"打开或解析 JSON 文件失败: {postJsonFilePath} - {e}")
             return None
 
-        published = jsonData['published'].split("T")[0]
-        title = sanitize_filename(jsonData['title'])
-        service = jsonData['service']
+    def buildPlan(self, artistName: str, postsName):
+        """ 为一位艺术家生成计划，返回 (重命名计划, 冲突的计划项, 已规范化而跳过的目录数, {帖子目录名: 解析结果}) """
+        candidates = [postName for postName in postsName if not self.isNormalizedFolderName(postName)]
+        skippedNumber = len(postsName) - len(candidates)
 
-        return '[{}][{}]{}'.format(service, published, title)
+        # 线程池中 parseKemonoPost 的耗时记入 read、parse 阶段
+        parsedResults = list(self.executor.map(lambda postName: self.parseCandidate(artistName, postName), candidates))
+
+        plan = []
+        parsedCandidates = {}
+        for postName, parsedResult in zip(candidates, parsedResults):
+            if parsedResult is None:
+                metrics.count('errors')
+                continue
+            parsedCandidates[postName] = parsedResult
+            try:
+                with metrics.stage('parse'):
+                    targetName = self.getTargetName(parsedResult)
+            except Exception as e:
+                print(f"获取重命名后的文件夹名失败: {os.path.join(Config.KEMONO_BASEPATH, artistName, postName)} - {e}")
+                metrics.count('errors')
+                continue
+            if targetName != postName:
+                plan.append(RenamePlanItem(artistName, postName, targetName))
+
+        plan, collisions = self.splitCollisions(plan, {artistName: postsName})
+        metrics.count('skipped_normalized', skippedNumber)
+        return plan, collisions, skippedNumber, parsedCandidates
+
+    @staticmethod
+    def splitCollisions(plan, postsNameOfArtists):
+        """
+        目标名相同的多个帖子，以及目标目录已存在的帖子都视为冲突。
+        比较时忽略大小写，因为 macOS 与 Windows 的文件系统默认不区分大小写。
+        """
+        targetCounts = Counter((item.artistName, item.targetName.casefold()) for item in plan)
+        existingNames = {
+            artistName: {postName.casefold() for postName in postsName}
+            for artistName, postsName in postsNameOfArtists.items()
+        }
+
+        validPlan = []
+        collisions = []
+        for item in plan:
+            targetKey = item.targetName.casefold()
+            isDuplicateTarget = targetCounts[(item.artistName, targetKey)] > 1
+            isExistingTarget = targetKey != item.sourceName.casefold() and targetKey in existingNames[item.artistName]
+            if isDuplicateTarget or isExistingTarget:
+                collisions.append(item)
+            else:
+                validPlan.append(item)
+        return validPlan, collisions
+
+    def renameOne(self, item: RenamePlanItem):
+        """ 线程池中执行，返回错误信息，成功时返回 None """
+        artistPath = os.path.join(Config.KEMONO_BASEPATH, item.artistName)
+        try:
+            os.rename(os.path.join(artistPath, item.sourceName), os.path.join(artistPath, item.targetName))
+        except Exception as e:
+            return str(e)
+        return None
+
+    def executePlan(self, plan):
+        """ 返回 (成功的计划项, 失败的 (计划项, 错误信息)) """
+        with metrics.stage('rename'):
+            errors = list(self.executor.map(self.renameOne, plan))
+
+        renamed = []
+        failed = []
+        for item, error in zip(plan, errors):
+            if error is None:
+                renamed.append(item)
+            else:
+                failed.append((item, error))
+        return renamed, failed
+
+    def updateDatabase(self, renamed):
+        """ 在一个事务中把已入库帖子的 post_folder_name 改为新目录名，返回更新的行数 """
+        if not renamed:
+            return 0
+        if not os.path.isfile(Config.KEMONO_DB_PATH):
+            print("数据库不存在，跳过更新 post_folder_name")
+            return 0
+
+        renamedOfArtists = {}
+        for item in renamed:
+            renamedOfArtists.setdefault(item.artistName, []).append((item.sourceName, item.targetName))
+
+        updatedNumber = 0
+        with metrics.stage('update'), db.atomic():
+            for artistName, pairs in renamedOfArtists.items():
+                # 同一艺术家目录下的不同 service 在数据库中是不同的艺术家记录
+                artistIds = [artist.id for artist in KemonoArtist.select(KemonoArtist.id).where(KemonoArtist.name == artistName)]
+                if not artistIds:
+                    continue
+                for start in range(0, len(pairs), 200):
+                    chunk = pairs[start:start + 200]
+                    updatedNumber += KemonoPost.update(
+                        post_folder_name=Case(KemonoPost.post_folder_name, chunk)
+                    ).where(
+                        (KemonoPost.artist.in_(artistIds)) &
+                        (KemonoPost.post_folder_name.in_([sourceName for sourceName, _ in chunk]))
+                    ).execute()
+        return updatedNumber
 
     def doRename(self):
-        artistsName = Util.getSubdirectoryNames(Config.KEMONO_BASEPATH)
+        with metrics.stage('scan'):
+            artistsName = Util.getSubdirectoryNames(Config.KEMONO_BASEPATH)
         if not artistsName:
             print("未找到艺术家目录")
             return
         print(f"发现 {len(artistsName)} 位艺术家")
 
-        failedPaths = []
+        # 逐位艺术家生成计划并执行（冲突只可能发生在同一艺术家目录内），数据库最后在一个事务中更新
+        planNumber = 0
+        skippedNumber = 0
+        renamed = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workerNumber) as self.executor:
+            for artistName in artistsName:
+                with metrics.artist(artistName):
+                    with metrics.stage('scan'):
+                        postsName = Util.getSubdirectoryNames(os.path.join(Config.KEMONO_BASEPATH, artistName))
+                    if not postsName:
+                        continue
+                    plan, collisions, artistSkippedNumber, _ = self.buildPlan(artistName, postsName)
+                    planNumber += len(plan)
+                    skippedNumber += artistSkippedNumber
+                    self.reportCollisions(collisions)
 
-        for artistName in artistsName:
-            artistPath = os.path.join(Config.KEMONO_BASEPATH, artistName)
-            postNames = Util.getSubdirectoryNames(artistPath)
-            if not postNames:
-                print(f"艺术家 {artistName} 没有帖子，跳过")
-                continue
+                    if self.dryRun:
+                        for item in plan:
+                            print(f"{item.artistName}: {item.sourceName} -> {item.targetName}")
+                        continue
 
-            print(f'{artistName}: ', flush=True, end='')
+                    artistRenamed, artistFailed = self.executePlan(plan)
+                    metrics.count('renamed', len(artistRenamed))
+                    metrics.count('errors', len(artistFailed))
+                    renamed.extend(artistRenamed)
+                    failed.extend(artistFailed)
+        self.executor = None
 
-            for postName in postNames:
-                postDirPath = os.path.join(artistPath, postName)
+        print(f"需要重命名 {planNumber} 个帖子目录，跳过 {skippedNumber} 个已规范化的目录")
+        if self.dryRun:
+            return
 
-                # 检查是否有 post.json 文件
-                postJsonFilePath = os.path.join(postDirPath, "post.json")
-                if not os.path.isfile(postJsonFilePath):
-                    print(f"\n跳过没有 post.json 的帖子: {postDirPath}")
-                    continue
+        updatedNumber = self.updateDatabase(renamed)
+        print(f"已重命名 {len(renamed)} 个帖子目录，更新数据库中 {updatedNumber} 条帖子记录")
+        self.reportFailures(failed)
 
-                folderNameAfterRename = self.getTargetNameFromJsonFile(postJsonFilePath)
-                if not folderNameAfterRename:
-                    print(f"获取重命名后的文件夹名失败: {postJsonFilePath}")
-                    continue
+    def renameAndIngest(self, fullScan: bool = False):
+        """
+        逐位艺术家先按计划重命名，再由 KemonoSyncer 入库。
 
-                folderPathAfterRename = os.path.join(artistPath, folderNameAfterRename)
+        艺术家目录只列出一次：同一次列举既用于计算扫描清单的快照，也用于生成计划；重命名后的帖子目录名
+        与计划中解析过的 post.json 以新路径作为预解析结果交给同步器，因此同步器不再列出该目录，
+        这些 post.json 也不会被再次读取。目录名已规范化的帖子在同步器需要时才读取。
+        fullScan 为 False 时跳过扫描清单中未变化的艺术家（目录 mtime 未变化时只需一次 stat）。
+        """
+        with metrics.stage('scan'):
+            artistsName = Util.getSubdirectoryNames(Config.KEMONO_BASEPATH)
+        if not artistsName:
+            print("未找到艺术家目录")
+            return
+        print(f"发现 {len(artistsName)} 位艺术家")
+
+        syncer = KemonoSyncer()
+        syncer.parsedPostCache = ParsedPostCache()
 
-                try:
-                    os.rename(postDirPath, folderPathAfterRename)
-                except Exception as e:
-                    print(f"重命名失败: {e}")
-                    failedPaths.append(postDirPath)
+        skippedArtistNumber = 0
+        renamedNumber = 0
+        with ThreadPoolExecutor(max_workers=self.workerNumber) as self.executor:
+            for artistName in artistsName:
+                artistDirPath = os.path.join(Config.KEMONO_BASEPATH, artistName)
+                with metrics.stage('scan'):
+                    manifestRecord = None if fullScan else syncer.scanManifest.getRecord(artistName)
+                    if manifestRecord is not None and syncer.scanManifest.isMtimeUnchanged(manifestRecord, artistDirPath):
+                        skippedArtistNumber += 1
+                        continue
+                    try:
+                        artistListing = Util.scanDirectory(artistDirPath)
+                    except OSError as e:
+                        print(f"获取子目录失败: {e}")
+                        continue
+                    dirSnapshot = syncer.scanManifest.takeSnapshot(artistDirPath, artistListing)
+                    if not fullScan:
+                        unchanged, _ = syncer.scanManifest.compareSnapshot(artistName, manifestRecord, dirSnapshot)
+                        if unchanged:
+                            skippedArtistNumber += 1
+                            continue
 
-                print('.', flush=True, end='')
-            print('', flush=True)
+                # 同步类中的 metrics.artist() 嵌套在这里，重命名与入库记为同一位艺术家
+                with metrics.artist(artistName):
+                    postsName = artistListing.subdirectoriesName
+                    plan, collisions, _, parsedCandidates = self.buildPlan(artistName, postsName)
+                    self.reportCollisions(collisions)
+                    renamed, failed = self.executePlan(plan)
+                    metrics.count('renamed', len(renamed))
+                    metrics.count('errors', len(failed))
+                    self.reportFailures(failed)
+                    self.updateDatabase(renamed)
+                    renamedNumber += len(renamed)
 
-        if failedPaths:
-            print("以下路径重命名失败，请手动检查:")
-            for path in failedPaths:
-                print(path)
+                    # 解析结果以重命名后的路径交给同步器，入库时 post_folder_name 使用新目录名
+                    targetsName = {item.sourceName: item.targetName for item in renamed}
+                    parsedPosts = {}
+                    for postName, parsedPost in parsedCandidates.items():
+                        postName = targetsName.get(postName, postName)
+                        if parsedPost.postRow is not None:
+                            parsedPost = parsedPost._replace(postRow={**parsedPost.postRow, 'post_folder_name': postName})
+                        parsedPosts[os.path.join(artistDirPath, postName)] = parsedPost
+                    postsName = sorted(targetsName.get(postName, postName) for postName in postsName)
+
+                    # 记录的指纹按重命名后的目录内容计算；mtime 仍为列举前的值，下次只需重新列举一次即可确认未变化
+                    if renamed:
+                        dirSnapshot = (dirSnapshot[0], *syncer.scanManifest.fingerprintOfNames(
+                            postsName + artistListing.filesName))
+                    syncer.syncOneArtist(artistName, dirSnapshot, (postsName, parsedPosts))
+        self.executor = None
+
+        if skippedArtistNumber:
+            print(f"跳过 {skippedArtistNumber} 位目录未变化的艺术家")
+        print(f"已重命名 {renamedNumber} 个帖子目录")
+        print(syncer.parsedPostCache.summary())
+        Util.checkpointDatabase(db)
+
+    @staticmethod
+    def reportCollisions(collisions):
+        if not collisions:
+            return
+        metrics.count('collisions', len(collisions))
+        print("以下帖子的目标目录名冲突，未重命名，请手动检查:")
+        for item in collisions:
+            print(f"{os.path.join(Config.KEMONO_BASEPATH, item.artistName, item.sourceName)} -> {item.targetName}")
+
+    @staticmethod
+    def reportFailures(failed):
+        if not failed:
+            return
+        print("以下路径重命名失败，请手动检查:")
+        for item, error in failed:
+            print(f"{os.path.join(Config.KEMONO_BASEPATH, item.artistName, item.sourceName)} - {error}")
 
 
 if __name__ == "__main__":
-    renamer = PostRenamer()
-    renamer.doRename()
-    print("重命名完成")
+    parser = argparse.ArgumentParser(description='规范化 Kemono 帖子文件夹名')
+    parser.add_argument('--dry-run', action='store_true', help='只输出重命名计划，不改动磁盘与数据库')
+    parser.add_argument('--workers', type=int, default=None, help='读取 post.json 与重命名的线程数，默认使用 Config 中的设置')
+    parser.add_argument('--ingest', action='store_true', help='重命名的同时将帖子同步到数据库（代替随后运行 kemono_sync.py）')
+    parser.add_argument('--full', action='store_true', help='与 --ingest 一起使用：忽略扫描清单，重新检查所有艺术家目录')
+    SyncMetrics.addArguments(parser)
+    args = parser.parse_args()
+    if args.ingest and args.dry_run:
+        parser.error('--ingest 不能与 --dry-run 一起使用')
 
+    metrics.startFromArgs('renamer', args)
+    renamer = PostRenamer(workerNumber=args.workers, dryRun=args.dry_run)
+    if args.ingest:
+        renamer.renameAndIngest(fullScan=args.full)
+    else:
+        renamer.doRename()
+    metrics.finish()
+    print("重命名完成")
@@ -0,0 +1,46 @@
+""" 此文件用于在进程池中并行解析艺术家目录，结果按提交顺序交给唯一的 SQLite 写入者 """
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from SyncMetrics import metrics
+
+
+def runTaskWithMetrics(workerFunc, task):
+    """ 在子进程中执行一个任务，连同这次任务中记录的阶段耗时与计数一起返回，由写入进程合并 """
+    metrics.reset()
+    result = workerFunc(*task)
+    return result, (dict(metrics.stageSeconds), dict(metrics.counters))
+
+
+class ParsePipeline:
+    """
+    workerFunc 必须是模块级函数（以便子进程导入），参数与返回值只应包含可 pickle 的普通数据。
+
+    workerNumber 小于等于 1 时不启动进程池，run() 对每个任务产出 None，由调用方自行从磁盘读取。
+    子进程中的 metrics 不会输出，其阶段耗时与计数随结果一起返回，由调用方在对应艺术家的 metrics.artist() 块内
+    以 metrics.merge() 合并；各进程的耗时累加，此时各阶段之和可能超过总耗时。
+    """
+
+    def __init__(self, workerFunc, workerNumber: int):
+        self.workerFunc = workerFunc
+        self.workerNumber = workerNumber
+        # 最多预取的任务数，避免解析结果在内存中无限堆积
+        self.maxPending = max(1, workerNumber) * 2
+
+    def run(self, tasks):
+        """ 依次产出 (task, result, workerMetrics)，顺序与 tasks 一致；串行时 result 与 workerMetrics 均为 None """
+        if self.workerNumber <= 1:
+            for task in tasks:
+                yield task, None, None
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workerNumber) as executor:
+            pending = deque()
+            for task in tasks:
+                pending.append((task, executor.submit(runTaskWithMetrics, self.workerFunc, task)))
+                if len(pending) >= self.maxPending:
+                    doneTask, future = pending.popleft()
+                    yield (doneTask, *future.result())
+            while pending:
+                doneTask, future = pending.popleft()
+                yield (doneTask, *future.result())
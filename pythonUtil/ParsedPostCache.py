@@ -0,0 +1,65 @@
+""" 此文件用于在一次同步中缓存帖子元数据的解析结果，使每个 JSON 文件最多只被读取和解析一次 """
+import os
+from collections import OrderedDict
+
+from filePathConfig import Config
+
+
+class ParsedPostCache:
+    """
+    以 (文件路径, mtime) 为键的 LRU 缓存。
+
+    内存占用按 JSON 文件大小估算（解析后的行数据通常比原文件小），
+    总和超过 maxBytes 时淘汰最久未使用的条目。解析失败的结果（错误信息字符串）同样会被缓存。
+    """
+
+    def __init__(self, maxBytes: int = None):
+        self.maxBytes = maxBytes or Config.PARSED_CACHE_MAX_BYTES
+        self.entries = OrderedDict()  # filePath -> (mtime_ns, size, result)
+        self.currentBytes = 0
+
+        self.hitNumber = 0
+        self.missNumber = 0
+        self.evictedNumber = 0
+
+    def get(self, filePath: str, parseFunc, *args):
+        """ 返回 parseFunc(*args) 的结果；parseFunc 抛出的异常以错误信息字符串返回 """
+        try:
+            stat = os.stat(filePath)
+        except OSError as e:
+            self.missNumber += 1
+            return str(e)
+
+        cached = self.entries.get(filePath)
+        if cached is not None and cached[0] == stat.st_mtime_ns:
+            self.entries.move_to_end(filePath)
+            self.hitNumber += 1
+            return cached[2]
+
+        self.missNumber += 1
+        try:
+            result = parseFunc(*args)
+        except Exception as e:
+            result = str(e)
+        self.put(filePath, stat.st_mtime_ns, stat.st_size, result)
+        return result
+
+    def put(self, filePath: str, mtime: int, size: int, result):
+        if filePath in self.entries:
+            self.currentBytes -= self.entries.pop(filePath)[1]
+
+        self.entries[filePath] = (mtime, size, result)
+        self.currentBytes += size
+
+        while self.currentBytes > self.maxBytes and len(self.entries) > 1:
+            _, (_, evictedSize, _) = self.entries.popitem(last=False)
+            self.currentBytes -= evictedSize
+            self.evictedNumber += 1
+
+    def clear(self):
+        """ 丢弃全部条目，命中统计保留 """
+        self.entries.clear()
+        self.currentBytes = 0
+
+    def summary(self):
+        return f"解析缓存: 命中 {self.hitNumber} 次, 未命中 {self.missNumber} 次, 淘汰 {self.evictedNumber} 条"
@@ -0,0 +1,212 @@
+""" 此文件用于清理数据库中磁盘上已不存在的艺术家、帖子与图片对应的行 """
+import os
+from collections import Counter, defaultdict
+
+from BoundedTransaction import BoundedTransaction
+from SyncMetrics import metrics
+from Util import Util
+
+# 每条 DELETE ... WHERE id IN (...) 的最大参数个数
+DELETE_BATCH_SIZE = 500
+
+
+class Reconciler:
+    """
+    以目录列举为准清理一个来源的数据库。
+
+    artistDirField 为艺术家表中保存艺术家目录名的字段，postNameField 为帖子表中保存帖子目录名（或文件名）的字段，
+    imageNameField 为图片表中保存文件名的字段；帖子表通过 artist 外键、图片表通过 post 外键关联。
+    imageNameField 为 None 时（Twitter）帖子对应艺术家目录中的文件，否则对应艺术家目录中的子目录。
+
+    每个艺术家目录只列举一次，与一次查询取出的目录名求差集；目录已不存在的帖子连同其图片行一并删除。
+    磁盘上不存在的单个文件（图片行，以及 Twitter 的推文行）可能是同步时有意记录的未下载附件，
+    同步不会为已入库的帖子重新写入这些行，因此只在 checkFiles 为 True 时清理：再列举每个保留的帖子目录，
+    与该艺术家全部图片行（一次查询）求差集。
+
+    删除按批进行，图片、帖子、艺术家表先删子表再删父表，不依赖表结构中的 ON DELETE CASCADE（viewer 创建的旧表可能没有）；
+    同步脚本自己建立的辅助表（如 pixivPostTag）依赖其外键的 ON DELETE CASCADE 随帖子删除（连接参数开启了 foreign_keys）。
+    dryRun 为 True 时只统计与报告，不修改数据库。
+    被清理的艺术家目录的扫描清单一并删除，目录恢复后下次同步会重新入库；fullTextIndex 中对应的行也一并删除。
+    """
+
+    def __init__(self, db, basePath: str, artistDirField, postNameField, imageNameField=None, manifestModel=None,
+                 fullTextIndex=None):
+        self.db = db
+        self.basePath = basePath
+        self.artistModel = artistDirField.model
+        self.artistDirField = artistDirField
+        self.postModel = postNameField.model
+        self.postNameField = postNameField
+        self.imageModel = imageNameField.model if imageNameField is not None else None
+        self.imageNameField = imageNameField
+        self.manifestModel = manifestModel
+        self.fullTextIndex = fullTextIndex
+
+        self.dryRun = False
+        self.reportFile = None
+        self.transaction = None
+        self.counters = Counter()
+
+    def run(self, dryRun: bool = False, checkFiles: bool = False, reportFile=None):
+        """ 返回 Counter：artists、posts、images 为清理的行数（含级联） """
+        self.dryRun = dryRun
+        self.reportFile = reportFile
+        self.counters = Counter()
+
+        if not self.artistModel.table_exists():
+            print("数据库中没有数据表，跳过")
+            return self.counters
+
+        with metrics.stage('scan'):
+            artistDirsName = Util.getSubdirectoryNames(self.basePath)
+        # 下载目录未挂载或为空时，差集会是整个数据库
+        if not artistDirsName:
+            print(f"未找到艺术家目录，为避免误删全部数据跳过清理: {self.basePath}")
+            return self.counters
+        artistDirsName = set(artistDirsName)
+
+        artistIdsOfDir = defaultdict(list)
+        with metrics.stage('query'):
+            for artistId, artistDirName in self.artistModel.select(self.artistModel.id, self.artistDirField).tuples():
+                artistIdsOfDir[artistDirName].append(artistId)
+
+        try:
+            with BoundedTransaction(self.db) as self.transaction:
+                removedArtistDirsName = sorted(name for name in artistIdsOfDir if name not in artistDirsName)
+                for artistDirName in removedArtistDirsName:
+                    self.report('artist', os.path.join(self.basePath, artistDirName))
+                self.pruneArtists([artistId for name in removedArtistDirsName for artistId in artistIdsOfDir[name]])
+                self.forgetRemovedArtistDirs(removedArtistDirsName)
+
+                for artistDirName in sorted(artistDirsName & artistIdsOfDir.keys()):
+                    with metrics.artist(artistDirName):
+                        self.reconcileArtist(artistDirName, artistIdsOfDir[artistDirName], checkFiles)
+        finally:
+            self.transaction = None
+
+        if not self.dryRun:
+            Util.checkpointDatabase(self.db)
+        return self.counters
+
+    def reconcileArtist(self, artistDirName: str, artistIds, checkFiles: bool):
+        # Twitter 的推文行对应艺术家目录中的文件，与图片行一样只在 checkFiles 时清理
+        if self.imageModel is None and not checkFiles:
+            return
+        artistDirPath = os.path.join(self.basePath, artistDirName)
+        try:
+            with metrics.stage('scan'):
+                dirListing = Util.scanDirectory(artistDirPath)
+        except OSError as e:
+            print(f"列举目录失败，跳过: {artistDirPath} - {e}")
+            metrics.count('errors')
+            return
+        existingNames = set(dirListing.filesName if self.imageModel is None else dirListing.subdirectoriesName)
+
+        postNames = {}
+        with metrics.stage('query'):
+            for postId, postName in self.postModel.select(self.postModel.id, self.postNameField).where(
+                self.postModel.artist.in_(artistIds)
+            ).tuples():
+                postNames[postId] = postName
+
+        # 文件名为空的行无法与磁盘对应，保留
+        orphanPostIds = [postId for postId, postName in postNames.items() if postName and postName not in existingNames]
+        for postId in orphanPostIds:
+            self.report('post', os.path.join(artistDirPath, postNames[postId]))
+        postNumber, imageNumber = self.counters['posts'], self.counters['images']
+        self.prunePosts(orphanPostIds)
+
+        if checkFiles and self.imageModel is not None:
+            orphanPostIds = set(orphanPostIds)
+            self.reconcileImages(artistDirPath, artistIds, {postId: postName for postId, postName in postNames.items()
+                                                            if postId not in orphanPostIds})
+
+        prunedPostNumber = self.counters['posts'] - postNumber
+        prunedImageNumber = self.counters['images'] - imageNumber
+        if prunedPostNumber or prunedImageNumber:
+            print(f"{artistDirName}: 帖子 -{prunedPostNumber}, 图片 -{prunedImageNumber}")
+            # 目录被移走又移回时 mtime 可能不变，删除扫描清单保证下次同步重新检查
+            self.forgetArtistDirs([artistDirName])
+
+    def reconcileImages(self, artistDirPath: str, artistIds, postNames: dict):
+        """ postNames 为 {帖子 id: 帖子目录名}，只列举其中有图片行的帖子目录 """
+        if not postNames:
+            return
+        imagesOfPost = defaultdict(list)
+        postForeignKey = self.imageModel.post
+        with metrics.stage('query'):
+            for imageId, postId, imageName in self.imageModel.select(
+                self.imageModel.id, postForeignKey, self.imageNameField
+            ).join(self.postModel, on=(postForeignKey == self.postModel.id)).where(
+                self.postModel.artist.in_(artistIds)
+            ).tuples():
+                if postId in postNames:
+                    imagesOfPost[postId].append((imageId, imageName))
+
+        orphanImageIds = []
+        for postId, images in imagesOfPost.items():
+            postDirPath = os.path.join(artistDirPath, postNames[postId])
+            try:
+                with metrics.stage('scan'):
+                    filesName = set(Util.scanDirectory(postDirPath).filesName)
+            except OSError as e:
+                print(f"列举目录失败，跳过: {postDirPath} - {e}")
+                metrics.count('errors')
+                continue
+            for imageId, imageName in images:
+                if imageName and imageName not in filesName:
+                    orphanImageIds.append(imageId)
+                    self.report('image', os.path.join(postDirPath, imageName))
+        self.pruneImages(orphanImageIds)
+
+    def pruneArtists(self, artistIds):
+        for chunk in self.iterChunks(artistIds):
+            postIdsQuery = self.postModel.select(self.postModel.id).where(self.postModel.artist.in_(chunk))
+            if self.imageModel is not None:
+                self.deleteRows('images', self.imageModel, self.imageModel.post.in_(postIdsQuery))
+            if self.fullTextIndex is not None and not self.dryRun:
+                self.fullTextIndex.deleteRowsIn(postIdsQuery)
+            self.deleteRows('posts', self.postModel, self.postModel.artist.in_(chunk))
+            self.deleteRows('artists', self.artistModel, self.artistModel.id.in_(chunk))
+
+    def prunePosts(self, postIds):
+        for chunk in self.iterChunks(postIds):
+            if self.imageModel is not None:
+                self.deleteRows('images', self.imageModel, self.imageModel.post.in_(chunk))
+            if self.fullTextIndex is not None and not self.dryRun:
+                self.fullTextIndex.deleteRows(chunk)
+            self.deleteRows('posts', self.postModel, self.postModel.id.in_(chunk))
+
+    def pruneImages(self, imageIds):
+        for chunk in self.iterChunks(imageIds):
+            self.deleteRows('images', self.imageModel, self.imageModel.id.in_(chunk))
+
+    def deleteRows(self, name: str, model, condition):
+        with metrics.stage('delete'):
+            if self.dryRun:
+                rowNumber = model.select().where(condition).count()
+            else:
+                rowNumber = model.delete().where(condition).execute()
+                self.transaction.addRows(rowNumber)
+        self.counters[name] += rowNumber
+        metrics.count(f'pruned_{name}', rowNumber)
+
+    def forgetRemovedArtistDirs(self, artistDirsName):
+        """ 艺术家目录整个不存在时调用；子类可以在此删除按目录记录的其他状态 """
+        self.forgetArtistDirs(artistDirsName)
+
+    def forgetArtistDirs(self, artistDirsName):
+        if self.manifestModel is None or self.dryRun:
+            return
+        for chunk in self.iterChunks(artistDirsName):
+            self.manifestModel.delete().where(self.manifestModel.dir_name.in_(chunk)).execute()
+
+    def report(self, kind: str, path: str):
+        if self.reportFile is not None:
+            self.reportFile.write(f"{kind}\t{path}\n")
+
+    @staticmethod
+    def iterChunks(items):
+        items = list(items)
+        for i in range(0, len(items), DELETE_BATCH_SIZE):
+            yield items[i:i + DELETE_BATCH_SIZE]
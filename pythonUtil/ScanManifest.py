@@ -0,0 +1,110 @@
+""" 此文件用于记录每个艺术家目录上次同步时的指纹，使未变化的目录在增量同步时被直接跳过 """
+import datetime
+import hashlib
+import os
+
+from peewee import *
+
+
+class ScanManifestBase(Model):
+    """
+    各同步脚本继承此模型并绑定到自己的数据库。peewee 不把 Meta.table_name 传给子类，子类需各自指定表名；
+    SQLite 的表名不区分大小写，旧版本按类名建立的小写表名（如 kemonoscanmanifest）仍然对应同一张表。
+    """
+    id = AutoField(column_name='id')
+    dir_name = TextField(column_name='dir_name', unique=True)
+    dir_mtime = IntegerField(column_name='dir_mtime')
+    entry_count = IntegerField(column_name='entry_count')
+    fingerprint = TextField(column_name='fingerprint')
+    synced_at = TextField(column_name='synced_at')
+
+
+class ScanManifest:
+    """
+    manifestModel 为继承自 ScanManifestBase 的模型。
+
+    trustDirMtime 为 True 时，目录 mtime 未变化即视为未变化，不再列出目录内容；
+    新帖子以子目录形式出现时（Kemono、Pixiv）目录 mtime 一定会变化。
+    includeFileStats 为 True 时指纹包含文件大小与 mtime，用于原地追加内容的文件（Twitter 的 CSV）。
+    """
+
+    def __init__(self, manifestModel, trustDirMtime: bool = True, includeFileStats: bool = False):
+        self.manifestModel = manifestModel
+        self.trustDirMtime = trustDirMtime
+        self.includeFileStats = includeFileStats
+
+    def getRecord(self, dirName: str):
+        return self.manifestModel.get_or_none(self.manifestModel.dir_name == dirName)
+
+    def computeFingerprint(self, dirPath: str):
+        """ 只列出目录本身（不深入子目录），返回 (条目数, 指纹) """
+        items = []
+        with os.scandir(dirPath) as it:
+            for entry in it:
+                if self.includeFileStats and entry.is_file():
+                    stat = entry.stat()
+                    items.append(f"{entry.name}\t{stat.st_size}\t{stat.st_mtime_ns}")
+                else:
+                    items.append(entry.name)
+        return self.fingerprintOfNames(items)
+
+    @staticmethod
+    def fingerprintOfNames(entriesName):
+        """ 返回 (条目数, 指纹) """
+        items = sorted(entriesName)
+        return len(items), hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()
+
+    def takeSnapshot(self, dirPath: str, listing=None):
+        """
+        返回 (目录 mtime, 条目数, 指纹)。
+
+        listing 为调用方已取得的 Util.DirListing 时由其计算指纹，不再列出目录（不能与 includeFileStats 一起使用）。
+        """
+        dirMtime = os.stat(dirPath).st_mtime_ns
+        if listing is None:
+            entryCount, fingerprint = self.computeFingerprint(dirPath)
+        else:
+            assert not self.includeFileStats
+            entryCount, fingerprint = self.fingerprintOfNames(listing.subdirectoriesName + listing.filesName)
+        return dirMtime, entryCount, fingerprint
+
+    def check(self, dirName: str, dirPath: str):
+        """
+        判断目录自上次同步后是否没有变化，返回 (是否未变化, 快照)。
+
+        快照在同步开始前获取，同步完成后交给 record()，这样同步期间新增的内容会在下次被发现。
+        """
+        record = self.getRecord(dirName)
+        if self.isMtimeUnchanged(record, dirPath):
+            return True, None
+        return self.compareSnapshot(dirName, record, self.takeSnapshot(dirPath))
+
+    def isMtimeUnchanged(self, record, dirPath: str):
+        """ record 为 getRecord() 的结果；只 stat 目录，不列出目录内容 """
+        return record is not None and self.trustDirMtime and record.dir_mtime == os.stat(dirPath).st_mtime_ns
+
+    def compareSnapshot(self, dirName: str, record, snapshot):
+        """ 与 check() 相同，但使用调用方已获取的快照，返回 (是否未变化, 快照) """
+        dirMtime, entryCount, fingerprint = snapshot
+        if record is None or record.entry_count != entryCount or record.fingerprint != fingerprint:
+            return False, snapshot
+
+        # 仅 mtime 变化（例如被 touch），更新后下次可直接跳过
+        if record.dir_mtime != dirMtime:
+            self.record(dirName, snapshot)
+        return True, snapshot
+
+    def record(self, dirName: str, snapshot):
+        """ 在目录同步完成后记录同步前获取的快照 """
+        dirMtime, entryCount, fingerprint = snapshot
+        self.manifestModel.insert(
+            dir_name=dirName,
+            dir_mtime=dirMtime,
+            entry_count=entryCount,
+            fingerprint=fingerprint,
+            synced_at=datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        ).on_conflict(
+            conflict_target=[self.manifestModel.dir_name],
+            preserve=[self.manifestModel.dir_mtime, self.manifestModel.entry_count,
+                      self.manifestModel.fingerprint, self.manifestModel.synced_at]
+        ).execute()
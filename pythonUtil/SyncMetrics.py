@@ -0,0 +1,213 @@
+""" 此文件用于记录同步过程中各阶段的耗时与计数，并输出为 JSON 行 """
+import cProfile
+import heapq
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+
+class SyncMetrics:
+    """
+    按阶段（scan、read、parse、insert、commit 等）累计耗时，按名称累计计数（posts、images、errors 等）。
+
+    阶段可以嵌套，耗时只计入最内层的阶段。可以在多个线程中调用，线程池中各线程的耗时会累加，
+    此时各阶段之和可能超过总耗时；解析子进程中记录的数据由 merge() 合并，同样累加。
+    在 artist() 块内的数据同时记入该艺术家与整次运行；块结束时若设置了 outputPath，写出一行 JSON。artist() 可以嵌套，只有最外层生效。
+
+    profileSlowest 大于 0 时对每位艺术家启用 cProfile，只保留最慢的若干位并在 finish() 时写出 .prof 文件；
+    traceMemory 为 True 时记录每位艺术家的内存峰值，并为保留的艺术家写出内存分配最多的代码行。
+    """
+
+    def __init__(self):
+        self.source = None
+        self.outputFile = None
+        self.profileSlowest = 0
+        self.profileDirPath = '.'
+        self.traceMemory = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.runStartTime = time.perf_counter()
+        self.stageSeconds = Counter()
+        self.counters = Counter()
+        self.artistNumber = 0
+        self.threadLocal = threading.local()
+
+        self.artistName = None
+        self.artistStartTime = 0.0
+        self.artistStageSeconds = Counter()
+        self.artistCounters = Counter()
+        self.artistProfile = None
+        # (耗时, 序号, 艺术家名, cProfile, tracemalloc 快照) 的最小堆
+        self.slowestArtists = []
+
+    @staticmethod
+    def addArguments(parser):
+        """ 为同步脚本的命令行添加统计相关的参数 """
+        parser.add_argument('--metrics', default=None, metavar='PATH', help='将每位艺术家的阶段耗时与计数以 JSON 行追加到该文件')
+        parser.add_argument('--profile-slowest', type=int, default=0, metavar='N', help='对最慢的 N 位艺术家输出 cProfile 结果')
+        parser.add_argument('--profile-dir', default='.', help='cProfile 与内存分配结果的输出目录')
+        parser.add_argument('--trace-memory', action='store_true', help='使用 tracemalloc 记录每位艺术家的内存峰值')
+
+    def start(self, source: str, outputPath: str = None, profileSlowest: int = 0, profileDirPath: str = '.',
+              traceMemory: bool = False):
+        self.source = source
+        self.outputFile = open(outputPath, 'a', encoding='utf-8') if outputPath else None
+        self.profileSlowest = profileSlowest
+        self.profileDirPath = profileDirPath
+        self.traceMemory = traceMemory
+        if traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.reset()
+
+    def startFromArgs(self, source: str, args):
+        self.start(source, args.metrics, args.profile_slowest, args.profile_dir, args.trace_memory)
+
+    @contextmanager
+    def stage(self, name: str):
+        # 每个线程各自维护嵌套阶段的栈
+        childSecondsStack = getattr(self.threadLocal, 'childSecondsStack', None)
+        if childSecondsStack is None:
+            childSecondsStack = self.threadLocal.childSecondsStack = []
+
+        startTime = time.perf_counter()
+        childSecondsStack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - startTime
+            childSeconds = childSecondsStack.pop()
+            if childSecondsStack:
+                childSecondsStack[-1] += elapsed
+            with self.lock:
+                self.stageSeconds[name] += elapsed - childSeconds
+                if self.artistName is not None:
+                    self.artistStageSeconds[name] += elapsed - childSeconds
+
+    def merge(self, workerMetrics):
+        """ 合并解析子进程返回的 (阶段耗时, 计数)，为 None 时不做任何事 """
+        if workerMetrics is None:
+            return
+        stageSeconds, counters = workerMetrics
+        with self.lock:
+            self.stageSeconds.update(stageSeconds)
+            self.counters.update(counters)
+            if self.artistName is not None:
+                self.artistStageSeconds.update(stageSeconds)
+                self.artistCounters.update(counters)
+
+    def count(self, name: str, number: int = 1):
+        with self.lock:
+            self.counters[name] += number
+            if self.artistName is not None:
+                self.artistCounters[name] += number
+
+    @contextmanager
+    def artist(self, artistName: str):
+        # 嵌套调用（例如重命名后在同一块内入库）不另起一条记录，由最外层统一记录
+        if self.artistName is not None:
+            yield
+            return
+        self.artistName = artistName
+        self.artistStageSeconds = Counter()
+        self.artistCounters = Counter()
+        if self.traceMemory:
+            tracemalloc.reset_peak()
+        if self.profileSlowest > 0:
+            self.artistProfile = cProfile.Profile()
+            self.artistProfile.enable()
+        self.artistStartTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - self.artistStartTime
+            if self.artistProfile is not None:
+                self.artistProfile.disable()
+            self.endArtist(elapsed)
+
+    def endArtist(self, elapsed: float):
+        record = {
+            'event': 'artist',
+            'source': self.source,
+            'artist': self.artistName,
+            'seconds': round(elapsed, 4),
+            'stages': {name: round(seconds, 4) for name, seconds in self.artistStageSeconds.items()},
+            'counters': dict(self.artistCounters),
+        }
+        snapshot = None
+        if self.traceMemory:
+            record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        self.writeRecord(record)
+
+        if self.profileSlowest > 0:
+            isSlowEnough = len(self.slowestArtists) < self.profileSlowest or elapsed > self.slowestArtists[0][0]
+            if isSlowEnough:
+                if self.traceMemory:
+                    snapshot = tracemalloc.take_snapshot()
+                entry = (elapsed, self.artistNumber, self.artistName, self.artistProfile, snapshot)
+                if len(self.slowestArtists) < self.profileSlowest:
+                    heapq.heappush(self.slowestArtists, entry)
+                else:
+                    heapq.heapreplace(self.slowestArtists, entry)
+
+        self.artistNumber += 1
+        self.artistName = None
+        self.artistProfile = None
+
+    def writeRecord(self, record: dict):
+        if self.outputFile is not None:
+            self.outputFile.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.outputFile.flush()
+
+    def finish(self):
+        """ 输出整次运行的汇总，并写出最慢艺术家的 profile """
+        elapsed = time.perf_counter() - self.runStartTime
+        record = {
+            'event': 'summary',
+            'source': self.source,
+            'seconds': round(elapsed, 4),
+            'artists': self.artistNumber,
+            'stages': {name: round(seconds, 4) for name, seconds in self.stageSeconds.items()},
+            'counters': dict(self.counters),
+        }
+        self.writeRecord(record)
+
+        stagesText = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.stageSeconds.most_common())
+        countersText = ', '.join(f"{name} {number}" for name, number in sorted(self.counters.items()))
+        print(f"耗时 {elapsed:.2f}s, 处理 {self.artistNumber} 位艺术家")
+        if stagesText:
+            print(f"各阶段耗时: {stagesText}")
+        if countersText:
+            print(f"计数: {countersText}")
+
+        self.dumpSlowestArtists()
+
+        if self.outputFile is not None:
+            self.outputFile.close()
+            self.outputFile = None
+        if self.traceMemory:
+            tracemalloc.stop()
+
+    def dumpSlowestArtists(self):
+        if not self.slowestArtists:
+            return
+        os.makedirs(self.profileDirPath, exist_ok=True)
+        for rank, (elapsed, _, artistName, profile, snapshot) in enumerate(sorted(self.slowestArtists, reverse=True), 1):
+            filePathStem = os.path.join(self.profileDirPath, f"{self.source}_slowest{rank}")
+            profile.dump_stats(filePathStem + '.prof')
+            if snapshot is not None:
+                with open(filePathStem + '_memory.txt', 'w', encoding='utf-8') as f:
+                    f.write(f"{artistName}: {elapsed:.2f}s\n")
+                    for stat in snapshot.statistics('lineno')[:20]:
+                        f.write(f"{stat}\n")
+            print(f"最慢的艺术家 #{rank}: {artistName} ({elapsed:.2f}s) -> {filePathStem}.prof")
+        self.slowestArtists = []
+
+
+# 进程内共享的实例；解析子进程中没有调用 start()，记录的数据由 ParsePipeline 返回给写入进程合并
+metrics = SyncMetrics()
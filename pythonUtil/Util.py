@@ -1,16 +1,172 @@
 import datetime
+import hashlib
+import itertools
+import mmap
 import os
+from collections import namedtuple
+from pathlib import Path
+
+from peewee import Tuple, fn
+from playhouse.migrate import SqliteMigrator, migrate
+
+from filePathConfig import Config
+
+# 每次交给 hashlib 的映射区长度；hashlib 在计算时释放 GIL，分块避免大文件（视频）一次占用过多页缓存
+HASH_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+class DirListing(namedtuple('DirListing', ['subdirectoriesName', 'filesName'])):
+    """ 单个目录的一次列举结果，子目录名与文件名均已排序 """
+    __slots__ = ()
+
+    def filesNameWithExtension(self, extension: str):
+        return [f for f in self.filesName if f.endswith(extension)]
+
+    def filesNameWithStem(self, stem: str):
+        """ 例如 stem 为 'avatar' 时返回 avatar.jpg、avatar.png 等 """
+        return [f for f in self.filesName if Path(f).stem == stem]
+
 
 class Util:
+    @staticmethod
+    def scanDirectory(inputDirPath: str):
+        """
+        用 os.scandir 列举目录，一次遍历同时得到子目录与文件。
+
+        DirEntry 自带文件类型信息，除符号链接外不会为每个条目额外调用 stat，
+        这在 SMB/NFS 等网络挂载上能省下大量往返。
+        """
+        subdirectoriesName = []
+        filesName = []
+        with os.scandir(inputDirPath) as it:
+            for entry in it:
+                if entry.is_dir():
+                    subdirectoriesName.append(entry.name)
+                elif entry.is_file():
+                    filesName.append(entry.name)
+        subdirectoriesName.sort()
+        filesName.sort()
+        return DirListing(subdirectoriesName, filesName)
+
     @staticmethod
     def getSubdirectoryNames(inputDirPath: str):
         """获取指定路径下的所有子目录名称"""
         try:
-            return sorted([d for d in os.listdir(inputDirPath) if os.path.isdir(os.path.join(inputDirPath, d))])
+            return Util.scanDirectory(inputDirPath).subdirectoriesName
         except Exception as e:
             print(f"获取子目录失败: {e}")
             return None
 
+    @staticmethod
+    def createMissingIndexes(db, models):
+        """ 为已存在的表补建模型中声明的索引（CREATE INDEX IF NOT EXISTS，可重复执行） """
+        indexCountBefore = sum(len(db.get_indexes(model._meta.table_name)) for model in models)
+        for model in models:
+            model._schema.create_indexes(safe=True)
+        indexCountAfter = sum(len(db.get_indexes(model._meta.table_name)) for model in models)
+        if indexCountAfter > indexCountBefore:
+            print(f"已补建 {indexCountAfter - indexCountBefore} 个索引")
+
+    @staticmethod
+    def addMissingColumns(db, models):
+        """ 为已存在的表补建模型中新增的列（新增的列必须允许 NULL 或有默认值） """
+        migrator = SqliteMigrator(db)
+        operations = []
+        for model in models:
+            columnNames = {column.name for column in db.get_columns(model._meta.table_name)}
+            for field in model._meta.sorted_fields:
+                if field.column_name not in columnNames:
+                    operations.append(migrator.add_column(model._meta.table_name, field.column_name, field))
+        if operations:
+            migrate(*operations)
+            print(f"已补建 {len(operations)} 个列")
+
+    @staticmethod
+    def isSchemaReady(db, models):
+        """
+        只读检查：数据库文件存在且 models 的表与列都已建好（同步脚本已执行过且已升级）。
+        供同步之后运行的工具使用，它们不构造同步类，因此不会创建数据库文件或执行迁移。
+        """
+        if not os.path.isfile(db.database):
+            return False
+        for model in models:
+            if not db.table_exists(model._meta.table_name):
+                return False
+            columnNames = {column.name for column in db.get_columns(model._meta.table_name)}
+            if any(field.column_name not in columnNames for field in model._meta.sorted_fields):
+                return False
+        return True
+
+    @staticmethod
+    def mergeDuplicateRows(db, model, fieldNames, deleteRows, mergedFieldNames=()):
+        """
+        在 fieldNames 上建立唯一索引之前合并旧数据库中的重复行（中断的同步可能重复写入），返回合并掉的行数。
+
+        每组重复行保留主键最小的一行；mergedFieldNames 中的布尔列（如 viewed）任一重复行为真时保留的行也设为真。
+        deleteRows(ids) 负责删除其余的行及其子表、全文索引中的行。随后删除这些列上的普通索引，
+        由 createMissingIndexes 建立唯一索引。这些列上已有唯一索引时不做任何事。
+        """
+        keyFields = [model._meta.fields[fieldName] for fieldName in fieldNames]
+        keyIndexes = [index for index in db.get_indexes(model._meta.table_name)
+                      if index.columns == [field.column_name for field in keyFields]]
+        if any(index.unique for index in keyIndexes):
+            return 0
+
+        primaryKey = model._meta.primary_key
+        mergedFields = [model._meta.fields[fieldName] for fieldName in mergedFieldNames]
+        duplicateKeys = model.select(*keyFields).group_by(*keyFields).having(fn.COUNT(primaryKey) > 1)
+        rows = model.select(primaryKey, *keyFields, *mergedFields).where(
+            Tuple(*keyFields).in_(duplicateKeys)
+        ).order_by(*keyFields, primaryKey).tuples()
+
+        removedIds = []
+        flaggedIdsOfField = {field: [] for field in mergedFields}
+        for _, group in itertools.groupby(rows, key=lambda row: row[1:1 + len(keyFields)]):
+            keptRow, *removedRows = group
+            removedIds.extend(row[0] for row in removedRows)
+            for i, field in enumerate(mergedFields, 1 + len(keyFields)):
+                if not keptRow[i] and any(row[i] for row in removedRows):
+                    flaggedIdsOfField[field].append(keptRow[0])
+
+        with db.atomic():
+            for start in range(0, len(removedIds), 500):
+                deleteRows(removedIds[start:start + 500])
+            for field, flaggedIds in flaggedIdsOfField.items():
+                for start in range(0, len(flaggedIds), 500):
+                    model.update({field: True}).where(primaryKey.in_(flaggedIds[start:start + 500])).execute()
+            for index in keyIndexes:
+                db.execute_sql(f'DROP INDEX "{index.name}"')
+        if removedIds:
+            print(f"{model._meta.table_name}: 已合并 {len(removedIds)} 个重复行")
+        return len(removedIds)
+
+    @staticmethod
+    def computeFileSha1(filePath: str):
+        """ 以 mmap 分块计算文件内容的 SHA-1，不把整个文件读入内存；读取失败时抛出 OSError 或 ValueError """
+        digest = hashlib.sha1()
+        with open(filePath, 'rb') as f:
+            fileSize = os.fstat(f.fileno()).st_size
+            # 空文件无法映射
+            if fileSize:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    for start in range(0, fileSize, HASH_CHUNK_BYTES):
+                        digest.update(view[start:start + HASH_CHUNK_BYTES])
+        return digest.hexdigest()
+
+    @staticmethod
+    def getSqlitePragmas():
+        """ 返回 Config.SQLITE_PROFILE 对应的 SQLite 参数 """
+        return dict(Config.SQLITE_PROFILES[Config.SQLITE_PROFILE])
+
+    @staticmethod
+    def checkpointDatabase(db):
+        """ 同步结束时把 WAL 中的内容写回主数据库并截断 -wal 文件；非 WAL 模式下不做任何事 """
+        if db.execute_sql('PRAGMA journal_mode').fetchone()[0].lower() != 'wal':
+            return
+        busy, walPageNumber, checkpointedPageNumber = db.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        if busy:
+            print(f"WAL 检查点未完成（有读取者占用），已写回 {checkpointedPageNumber}/{walPageNumber} 页")
+
     @staticmethod
     def checkYMDSmall(currentDateTime, latestDateTimeInDb):
         """ 检查当前日期是否小于数据库中的最新日期 """
@@ -0,0 +1,69 @@
+""" 此文件用于对比逐行 Model.create() 与 BatchInserter 批量写入的耗时 """
+import argparse
+import os
+import tempfile
+import time
+
+from peewee import SqliteDatabase
+
+from BatchInserter import BatchInserter
+from kemono_sync import KemonoArtist, KemonoPost, KemonoImage
+
+MODELS = [KemonoArtist, KemonoPost, KemonoImage]
+
+
+def makePostRow(artistId: int, i: int):
+    return dict(
+        kemono_post_id=str(i),
+        artist=artistId,
+        name=f"title {i}",
+        post_date='2024-01-01T00:00:00.000',
+        cover_img_file_name=f"{i}_cover.jpg",
+        post_folder_name=f"[fanbox][2024-01-01]title {i}",
+        attachment_number=0
+    )
+
+
+def writeByCreate(artist, postNumber: int, imageNumber: int):
+    for i in range(postNumber):
+        post = KemonoPost.create(**makePostRow(artist.id, i))
+        for j in range(imageNumber):
+            KemonoImage.create(post=post, image_name=f"{j + 1}.png")
+
+
+def writeByBatchInserter(artist, postNumber: int, imageNumber: int, batchSize: int):
+    inserter = BatchInserter(KemonoPost, KemonoImage, batchSize=batchSize)
+    for i in range(postNumber):
+        inserter.addPost(makePostRow(artist.id, i), [dict(image_name=f"{j + 1}.png") for j in range(imageNumber)])
+    inserter.flush()
+
+
+def runOnce(writer, *args):
+    with tempfile.TemporaryDirectory() as tempDir:
+        benchDb = SqliteDatabase(os.path.join(tempDir, 'bench.sqlite3'), pragmas={'foreign_keys': 1})
+        with benchDb.bind_ctx(MODELS):
+            benchDb.create_tables(MODELS)
+            start = time.perf_counter()
+            with benchDb.atomic():
+                artist = KemonoArtist.create(kemono_artist_id='1', name='bench', service='fanbox')
+                writer(artist, *args)
+            elapsed = time.perf_counter() - start
+            rowNumber = KemonoPost.select().count() + KemonoImage.select().count()
+        benchDb.close()
+    return elapsed, rowNumber
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='逐行写入与批量写入的耗时对比')
+    parser.add_argument('--posts', type=int, default=5000, help='帖子数量')
+    parser.add_argument('--images', type=int, default=10, help='每个帖子的图片数量')
+    parser.add_argument('--batch-size', type=int, default=None, help='批量写入的分块大小，默认使用 Config 中的设置')
+    args = parser.parse_args()
+
+    before, beforeRows = runOnce(writeByCreate, args.posts, args.images)
+    after, afterRows = runOnce(writeByBatchInserter, args.posts, args.images, args.batch_size)
+    assert beforeRows == afterRows
+
+    print(f"写入 {beforeRows} 行")
+    print(f"Model.create(): {before:.3f}s")
+    print(f"BatchInserter:  {after:.3f}s  ({before / after:.1f}x)")
@@ -0,0 +1,83 @@
+""" 此文件用于对比 listdir + isdir/isfile 与 scandir 列举目录时的系统调用次数和耗时 """
+import argparse
+import os
+import tempfile
+import time
+from collections import Counter
+
+from Util import Util
+
+
+def buildSyntheticTree(rootPath: str, artistNumber: int, postNumber: int, fileNumber: int):
+    """ 生成类似 Pixiv 下载目录的结构：艺术家/帖子/{json, 图片}，以及艺术家目录下的 avatar 与 background """
+    for a in range(artistNumber):
+        artistDirPath = os.path.join(rootPath, f"artist{a} ({a})")
+        os.makedirs(artistDirPath)
+        for stem in ('avatar', 'background'):
+            open(os.path.join(artistDirPath, f"{stem}.jpg"), 'wb').close()
+        for p in range(postNumber):
+            postDirPath = os.path.join(artistDirPath, f"[2024-01-01]post {p}")
+            os.makedirs(postDirPath)
+            open(os.path.join(postDirPath, f"{p}.json"), 'wb').close()
+            for i in range(fileNumber):
+                open(os.path.join(postDirPath, f"{p}_p{i}.png"), 'wb').close()
+
+
+def walkByListdir(rootPath: str):
+    """ 旧实现：listdir 之后对每个条目调用 isdir/isfile """
+    for artistName in sorted([d for d in os.listdir(rootPath) if os.path.isdir(os.path.join(rootPath, d))]):
+        artistDirPath = os.path.join(rootPath, artistName)
+        for stem in ('avatar', 'background'):
+            sorted([f for f in os.listdir(artistDirPath) if os.path.isfile(os.path.join(artistDirPath, f)) and f.startswith(stem)])
+        for postName in sorted([d for d in os.listdir(artistDirPath) if os.path.isdir(os.path.join(artistDirPath, d))]):
+            postDirPath = os.path.join(artistDirPath, postName)
+            sorted([f for f in os.listdir(postDirPath) if f.endswith('.json') and os.path.isfile(os.path.join(postDirPath, f))])
+
+
+def walkByScandir(rootPath: str):
+    """ 新实现：每个目录只列举一次 """
+    for artistName in Util.scanDirectory(rootPath).subdirectoriesName:
+        artistDirPath = os.path.join(rootPath, artistName)
+        artistDirListing = Util.scanDirectory(artistDirPath)
+        for stem in ('avatar', 'background'):
+            artistDirListing.filesNameWithStem(stem)
+        for postName in artistDirListing.subdirectoriesName:
+            Util.scanDirectory(os.path.join(artistDirPath, postName)).filesNameWithExtension('.json')
+
+
+def countCalls(walker, rootPath: str):
+    """ 替换 os 模块中的相关函数以统计调用次数（os.path.isdir/isfile 内部调用的就是 os.stat） """
+    counter = Counter()
+    originals = {name: getattr(os, name) for name in ('stat', 'lstat', 'listdir', 'scandir')}
+
+    def wrap(name):
+        def wrapper(*args, **kwargs):
+            counter[name] += 1
+            return originals[name](*args, **kwargs)
+        return wrapper
+
+    for name in originals:
+        setattr(os, name, wrap(name))
+    try:
+        start = time.perf_counter()
+        walker(rootPath)
+        elapsed = time.perf_counter() - start
+    finally:
+        for name, func in originals.items():
+            setattr(os, name, func)
+    return counter, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='目录列举方式的系统调用次数对比')
+    parser.add_argument('--artists', type=int, default=20, help='艺术家数量')
+    parser.add_argument('--posts', type=int, default=50, help='每位艺术家的帖子数量')
+    parser.add_argument('--files', type=int, default=5, help='每个帖子的图片数量')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        buildSyntheticTree(tempDir, args.artists, args.posts, args.files)
+        for label, walker in (('listdir + isdir/isfile', walkByListdir), ('scandir', walkByScandir)):
+            counter, elapsed = countCalls(walker, tempDir)
+            detail = ', '.join(f"{name}={counter[name]}" for name in ('listdir', 'scandir', 'stat', 'lstat'))
+            print(f"{label}: 共 {sum(counter.values())} 次 ({detail}), {elapsed:.3f}s")
@@ -0,0 +1,151 @@
+""" 此文件用于在模拟下载目录上测量各同步脚本与 PostRenamer 的冷启动、增量与无变化三种运行的耗时 """
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic_archive import SyntheticArchive
+
+TARGETS = ('kemono', 'pixiv', 'twitter', 'renamer')
+# 每个目标对应的下载目录名与数据库中的帖子表
+TARGET_DIR_NAMES = {'kemono': 'kemono', 'pixiv': 'pixiv', 'twitter': 'twitter', 'renamer': 'kemono'}
+TARGET_POST_TABLES = {'kemono': 'kemonoPost', 'pixiv': 'pixivPost', 'twitter': 'twitterImage'}
+
+
+def runTarget(target: str, rootPath: str, dbDirPath: str, workerNumber: int = None):
+    """ 在子进程中执行：把 Config 指向模拟目录后运行一次同步（或重命名），返回耗时与帖子表行数 """
+    from filePathConfig import Config
+    Config.KEMONO_BASEPATH = os.path.join(rootPath, 'kemono')
+    Config.PIXIV_BASEPATH = os.path.join(rootPath, 'pixiv')
+    Config.TWITTER_BASEPATH = os.path.join(rootPath, 'twitter')
+    Config.KEMONO_DB_PATH = os.path.join(dbDirPath, 'kemono.sqlite3')
+    Config.PIXIV_DB_PATH = os.path.join(dbDirPath, 'pixiv.sqlite3')
+    Config.TWITTER_DB_PATH = os.path.join(dbDirPath, 'twitter.sqlite3')
+
+    # 同步过程中的输出不计入结果
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        startTime = time.perf_counter()
+        if target == 'kemono':
+            import kemono_sync
+            kemono_sync.KemonoSyncer().writeKemonoDataToDatabase(fullScan=False, workerNumber=workerNumber)
+        elif target == 'pixiv':
+            import pixiv_sync
+            pixiv_sync.PixivSyncer().writePixivDataToDatabase(fullScan=False, workerNumber=workerNumber)
+        elif target == 'twitter':
+            import twitter_sync
+            twitter_sync.TwitterSyncer().startSync(fullScan=False)
+        else:
+            import KemonoPostRenamer
+            KemonoPostRenamer.PostRenamer().doRename()
+        elapsed = time.perf_counter() - startTime
+
+    result = {'seconds': round(elapsed, 4)}
+    if target in TARGET_POST_TABLES:
+        with contextlib.closing(sqlite3.connect(getattr(Config, f'{target.upper()}_DB_PATH'))) as conn:
+            result['posts'] = conn.execute(f'SELECT COUNT(*) FROM {TARGET_POST_TABLES[target]}').fetchone()[0]
+    return result
+
+
+def measure(target: str, phase: str, rootPath: str, dbDirPath: str, workerNumber: int = None):
+    """ 每次测量使用新的 Python 进程，避免模块级数据库连接与单例在各次运行之间共享状态 """
+    command = [sys.executable, os.path.abspath(__file__), '--child', target, rootPath, dbDirPath]
+    if workerNumber:
+        command += ['--workers', str(workerNumber)]
+    completed = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='replace')
+
+    record = {'target': target, 'phase': phase}
+    if completed.returncode != 0:
+        record['error'] = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f'退出码 {completed.returncode}'
+        return record
+    record.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return record
+
+
+def benchmarkTarget(target: str, workDirPath: str, args):
+    """ 依次测量 cold（空数据库）、noop（目录未变化）、incremental（追加帖子后）三种运行 """
+    rootPath = os.path.join(workDirPath, target, 'archive')
+    dbDirPath = os.path.join(workDirPath, target, 'db')
+    os.makedirs(dbDirPath)
+
+    sources = (TARGET_DIR_NAMES[target],)
+    # PostRenamer 只处理未规范化的目录，默认让一半的帖子需要重命名
+    unnormalizedRatio = args.unnormalized_ratio if target == 'renamer' else 0.0
+    archive = SyntheticArchive(rootPath, seed=args.seed, imageBytes=args.image_bytes)
+    archive.generate(args.artists, args.posts, args.attachments, unnormalizedRatio=unnormalizedRatio, sources=sources)
+
+    records = [measure(target, 'cold', rootPath, dbDirPath, args.workers)]
+    records.append(measure(target, 'noop', rootPath, dbDirPath, args.workers))
+    # 目录的 mtime 精度可能只有秒级，等待后再追加，保证扫描清单能发现变化
+    time.sleep(args.mtime_delay)
+    archive.appendPosts(args.new_posts, args.attachments, unnormalizedRatio=unnormalizedRatio, sources=sources)
+    records.append(measure(target, 'incremental', rootPath, dbDirPath, args.workers))
+    return records
+
+
+def getEnvironment(args):
+    return {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'artists': args.artists,
+        'posts': args.posts,
+        'attachments': args.attachments,
+        'new_posts': args.new_posts,
+        'workers': args.workers,
+        'seed': args.seed,
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        childParser = argparse.ArgumentParser()
+        childParser.add_argument('--child', choices=TARGETS)
+        childParser.add_argument('rootPath')
+        childParser.add_argument('dbDirPath')
+        childParser.add_argument('--workers', type=int, default=None)
+        childArgs = childParser.parse_args()
+        print(json.dumps(runTarget(childArgs.child, childArgs.rootPath, childArgs.dbDirPath, childArgs.workers)))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='在模拟下载目录上测量同步与重命名的耗时，结果以 JSON 输出')
+    parser.add_argument('targets', nargs='*', metavar='TARGET', help=f'要测量的对象（{", ".join(TARGETS)}），默认全部')
+    parser.add_argument('--artists', type=int, default=20, help='艺术家数量')
+    parser.add_argument('--posts', type=int, default=50, help='每位艺术家的帖子（推文）数量')
+    parser.add_argument('--attachments', type=int, default=5, help='每个帖子的最大附件（页）数')
+    parser.add_argument('--new-posts', type=int, default=5, help='增量运行前为每位艺术家追加的帖子数')
+    parser.add_argument('--unnormalized-ratio', type=float, default=0.5, help='PostRenamer 测试中未规范化目录名的比例')
+    parser.add_argument('--image-bytes', type=int, default=0, help='每个图片文件的大小（字节）')
+    parser.add_argument('--workers', type=int, default=None, help='Kemono/Pixiv 并行解析 JSON 的进程数')
+    parser.add_argument('--mtime-delay', type=float, default=1.1, help='追加帖子前的等待秒数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help='生成模拟目录的位置，默认使用临时目录并在结束后删除')
+    parser.add_argument('--output', default=None, help='将全部结果写入该 JSON 文件')
+    args = parser.parse_args()
+
+    unknownTargets = [target for target in args.targets if target not in TARGETS]
+    if unknownTargets:
+        parser.error(f'未知的测量对象: {", ".join(unknownTargets)}')
+
+    workDirPath = args.work_dir or tempfile.mkdtemp(prefix='kemono_viewer_bench_')
+    results = []
+    try:
+        for target in dict.fromkeys(args.targets or TARGETS):
+            for record in benchmarkTarget(target, workDirPath, args):
+                # 每条结果一行 JSON，便于逐行收集
+                print(json.dumps(record, ensure_ascii=False), flush=True)
+                results.append(record)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(workDirPath, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': getEnvironment(args), 'results': results}, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if any('error' in record for record in results) else 0)
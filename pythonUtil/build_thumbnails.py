@@ -0,0 +1,251 @@
+""" 此文件用于在同步之后为新入库的图片预先生成缩略图，缩略图按原图内容的哈希保存在缓存目录中 """
+import argparse
+import importlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Util import Util
+from filePathConfig import Config
+from SyncMetrics import SyncMetrics, metrics
+
+# Pillow 为可选依赖，只有生成缩略图时需要
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 来源名 -> (模块名, 图片模型名, 缩略图键的字段名)
+SOURCES = {
+    'kemono': ('kemono_sync', 'KemonoImage', 'thumb_key'),
+    'pixiv': ('pixiv_sync', 'PixivImage', 'thumbKey'),
+    'twitter': ('twitter_sync', 'TwitterPost', 'thumb_key'),
+}
+
+# 可以生成缩略图的原图扩展名；视频、ugoira 压缩包等直接记为无法生成
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+THUMBNAIL_EXTENSION = '.jpg'
+THUMBNAIL_QUALITY = 85
+# 淘汰时删除到上限的该比例以下，避免每次运行都只淘汰几个文件
+EVICT_TARGET_RATIO = 0.9
+
+
+def getThumbnailPath(cacheDirPath: str, key: str):
+    """ 缩略图路径为 {缓存目录}/{键的前两位}/{键}.jpg，避免单个目录中文件过多 """
+    return os.path.join(cacheDirPath, key[:2], key + THUMBNAIL_EXTENSION)
+
+
+def renderThumbnail(filePath: str, cacheDirPath: str, size: int):
+    """
+    在进程池中执行：计算原图内容的哈希作为键，缓存中没有该键时生成缩略图。
+    返回 (键, 新生成的缩略图字节数, 错误信息)；无法生成时键为空字符串。
+    """
+    try:
+        key = Util.computeFileSha1(filePath)
+    except (OSError, ValueError) as e:
+        return '', 0, str(e)
+    thumbnailPath = getThumbnailPath(cacheDirPath, key)
+
+    # 内容相同的图片（包括不同来源之间）共用一个缩略图；更新 mtime 作为最近使用的时间
+    try:
+        os.utime(thumbnailPath)
+        return key, 0, None
+    except FileNotFoundError:
+        pass
+
+    tempPath = f"{thumbnailPath}.{os.getpid()}.tmp"
+    try:
+        with Image.open(filePath) as image:
+            # JPEG 在解码时直接按 1/2 ~ 1/8 缩小，不解码完整分辨率
+            image.draft('RGB', (size, size))
+            image.thumbnail((size, size))
+            if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            os.makedirs(os.path.dirname(thumbnailPath), exist_ok=True)
+            image.save(tempPath, 'JPEG', quality=THUMBNAIL_QUALITY)
+        # 先写临时文件再替换，中断时缓存中不会留下不完整的缩略图
+        os.replace(tempPath, thumbnailPath)
+        return key, os.path.getsize(thumbnailPath), None
+    except Exception as e:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        return '', 0, f"{type(e).__name__}: {e}"
+
+
+class ThumbnailBuilder:
+    """
+    为各来源中缩略图键为 NULL 的图片行生成缩略图并记录键，因此每次运行只处理上次之后新入库的图片。
+    键为空字符串的行（无法生成或已被淘汰）只在 retry 为 True 时重新处理。
+
+    缓存目录按缩略图尺寸分子目录，修改 THUMBNAIL_SIZE 后旧尺寸的缩略图不会被误用（需 --retry 或清空键后重新生成）。
+    缓存总大小超过上限时按 mtime 淘汰最久未使用的缩略图，并将引用它们的行的键改为空字符串。
+    """
+    BATCH_SIZE = 5000
+    CHUNK_SIZE = 16
+    UPDATE_BATCH_SIZE = 500
+
+    def __init__(self, workerNumber: int = None, size: int = None, cacheDirPath: str = None, maxBytes: int = None):
+        self.workerNumber = workerNumber or Config.THUMBNAIL_WORKER_NUMBER
+        self.size = size or Config.THUMBNAIL_SIZE
+        self.cacheDirPath = os.path.join(cacheDirPath or Config.THUMBNAIL_CACHE_PATH, str(self.size))
+        self.maxBytes = maxBytes or Config.THUMBNAIL_CACHE_MAX_BYTES
+        self.executor = None
+
+    def run(self, sources, retry: bool = False):
+        """ 返回 {来源: (生成数, 复用数, 失败数)} """
+        os.makedirs(self.cacheDirPath, exist_ok=True)
+        results = {}
+        if self.workerNumber > 1:
+            self.executor = ProcessPoolExecutor(max_workers=self.workerNumber)
+        try:
+            for source in sources:
+                print(f"[{source}] 生成缩略图")
+                results[source] = self.buildSource(source, retry)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+        self.evict()
+        return results
+
+    @staticmethod
+    def getSource(source: str):
+        """
+        返回 (数据库, iterImageFiles, 图片模型, 缩略图键字段)；数据库尚未创建或需要升级时返回 None。
+        直接使用同步模块的 db 与模型，不构造同步类，因此不会创建数据库文件或执行迁移
+        """
+        moduleName, modelName, keyFieldName = SOURCES[source]
+        module = importlib.import_module(moduleName)
+        model = getattr(module, modelName)
+        if not Util.isSchemaReady(module.db, [model]):
+            return None
+        return module.db, module.iterImageFiles, model, getattr(model, keyFieldName)
+
+    def buildSource(self, source: str, retry: bool):
+        createdNumber = reusedNumber = failedNumber = 0
+        sourceInfo = self.getSource(source)
+        if sourceInfo is None:
+            print(f"[{source}] 数据库尚未创建或需要升级，请先执行同步脚本")
+            return createdNumber, reusedNumber, failedNumber
+        db, iterImageFiles, model, keyField = sourceInfo
+        condition = keyField.is_null() | (keyField == '') if retry else keyField.is_null()
+        processedNumber = 0
+        for batch in iterImageFiles(condition, self.BATCH_SIZE):
+            keys = []
+            renderPaths = []
+            for imageId, filePath in batch:
+                if os.path.splitext(filePath)[1].lower() in IMAGE_EXTENSIONS:
+                    renderPaths.append((imageId, filePath))
+                else:
+                    keys.append(('', imageId))
+            with metrics.stage('render'):
+                for (imageId, filePath), (key, thumbnailBytes, error) in zip(renderPaths, self.renderAll(renderPaths)):
+                    keys.append((key, imageId))
+                    if error is not None:
+                        failedNumber += 1
+                        print(f"生成缩略图失败: {filePath} - {error}")
+                    elif thumbnailBytes:
+                        createdNumber += 1
+                    else:
+                        reusedNumber += 1
+            self.updateKeys(db, keyField, keys)
+            processedNumber += len(batch)
+            print(f"[{source}] 已处理 {processedNumber} 张")
+
+        metrics.count('thumbnails_created', createdNumber)
+        metrics.count('thumbnails_reused', reusedNumber)
+        metrics.count('thumbnails_failed', failedNumber)
+        return createdNumber, reusedNumber, failedNumber
+
+    def renderAll(self, renderPaths):
+        filePaths = [filePath for _, filePath in renderPaths]
+        arguments = ([self.cacheDirPath] * len(filePaths), [self.size] * len(filePaths))
+        if self.executor is None:
+            return map(renderThumbnail, filePaths, *arguments)
+        return self.executor.map(renderThumbnail, filePaths, *arguments, chunksize=self.CHUNK_SIZE)
+
+    @staticmethod
+    def updateKeys(db, keyField, keys):
+        """ keys 为 [(键, 主键)]，一批在一个事务中写入 """
+        model = keyField.model
+        with metrics.stage('write'), db.atomic():
+            db.cursor().executemany(
+                f'UPDATE "{model._meta.table_name}" SET "{keyField.column_name}" = ? '
+                f'WHERE "{model._meta.primary_key.column_name}" = ?', keys
+            )
+
+    def evict(self):
+        """ 缓存超过上限时删除最久未使用的缩略图，返回删除的个数 """
+        with metrics.stage('evict'):
+            thumbnails = []
+            totalBytes = 0
+            for dirPath, _, filesName in os.walk(self.cacheDirPath):
+                for fileName in filesName:
+                    if not fileName.endswith(THUMBNAIL_EXTENSION):
+                        continue
+                    filePath = os.path.join(dirPath, fileName)
+                    try:
+                        stat = os.stat(filePath)
+                    except OSError:
+                        continue
+                    thumbnails.append((stat.st_mtime, stat.st_size, filePath))
+                    totalBytes += stat.st_size
+            if totalBytes <= self.maxBytes:
+                return 0
+
+            thumbnails.sort()
+            targetBytes = self.maxBytes * EVICT_TARGET_RATIO
+            evictedKeys = []
+            for _, fileSize, filePath in thumbnails:
+                if totalBytes <= targetBytes:
+                    break
+                try:
+                    os.remove(filePath)
+                except OSError:
+                    continue
+                totalBytes -= fileSize
+                evictedKeys.append(os.path.basename(filePath)[:-len(THUMBNAIL_EXTENSION)])
+
+            # 缓存由所有来源共用，每个来源中引用被淘汰缩略图的行都要清除键
+            for source in SOURCES:
+                sourceInfo = self.getSource(source)
+                if sourceInfo is None:
+                    continue
+                db, _, model, keyField = sourceInfo
+                with db.atomic():
+                    for i in range(0, len(evictedKeys), self.UPDATE_BATCH_SIZE):
+                        model.update({keyField: ''}).where(keyField.in_(evictedKeys[i:i + self.UPDATE_BATCH_SIZE])).execute()
+        metrics.count('thumbnails_evicted', len(evictedKeys))
+        print(f"缩略图缓存超过上限，已淘汰 {len(evictedKeys)} 个")
+        return len(evictedKeys)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='为同步后新入库的图片生成缩略图（需要安装 Pillow）')
+    parser.add_argument('sources', nargs='*', metavar='SOURCE', help=f'要处理的来源（{", ".join(SOURCES)}），默认全部')
+    parser.add_argument('--retry', action='store_true', help='同时重新处理上次无法生成或已被淘汰的图片')
+    parser.add_argument('--workers', type=int, default=None, help='生成缩略图的进程数，默认为 THUMBNAIL_WORKER_NUMBER')
+    parser.add_argument('--size', type=int, default=None, help='缩略图长边的像素数，默认为 THUMBNAIL_SIZE')
+    SyncMetrics.addArguments(parser)
+    args = parser.parse_args()
+
+    unknownSources = [source for source in args.sources if source not in SOURCES]
+    if unknownSources:
+        parser.error(f'未知的来源: {", ".join(unknownSources)}')
+    if Image is None:
+        parser.exit(1, "未安装 Pillow，请先执行 pip install Pillow\n")
+
+    startTime = time.monotonic()
+    metrics.startFromArgs('thumbnails', args)
+    builder = ThumbnailBuilder(args.workers, args.size)
+    results = builder.run(dict.fromkeys(args.sources or SOURCES), args.retry)
+    metrics.finish()
+
+    print(f"全部结束，总耗时 {time.monotonic() - startTime:.1f}s，缓存目录: {builder.cacheDirPath}")
+    for source, (createdNumber, reusedNumber, failedNumber) in results.items():
+        print(f"[{source}] 新生成 {createdNumber}, 复用 {reusedNumber}, 失败 {failedNumber}")
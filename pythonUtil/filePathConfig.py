@@ -19,3 +19,71 @@ class Config:
 
     # 您可以根据需要添加其他配置项
     LOG_LEVEL = "INFO"
+
+    # 批量写入时每次 insert_many 的最大行数（还会受 SQLite 参数个数上限约束）
+    BULK_INSERT_BATCH_SIZE = 500
+
+    # 并行解析 JSON 的进程数，1 表示在写入数据库的同一进程中串行解析
+    PARSE_WORKER_NUMBER = 1
+
+    # 一次同步中缓存的帖子元数据解析结果的上限（按 JSON 文件大小估算，字节）
+    PARSED_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+    # Twitter CSV 检查点中用于识别文件被重写的尾部字节数
+    CSV_CHECKPOINT_TAIL_BYTES = 4096
+
+    # 判断帖子是否已入库的方式：
+    # 'set'  一次查询取出艺术家已入库的帖子 ID 与目录名，与目录列表求差集（补下载的旧帖子也能被发现）
+    # 'date' 旧的按最新入库日期判断的方式
+    INGESTED_DETECTION_MODE = 'set'
+
+    # 同步脚本打开数据库时使用的 SQLite 参数组，由 SQLITE_PROFILE 选择
+    # 'default' 与旧版本相同的回滚日志模式；上面默认的数据库路径位于网络卷，因此默认使用此项
+    # 'sync'    WAL 模式：同步期间 viewer 仍可读取，写入只追加到 -wal 文件；
+    #           WAL 需要各进程共享内存，数据库位于网络卷（SMB/NFS）时不可使用，只有数据库在本地磁盘时才改为此项
+    SQLITE_PROFILE = 'default'
+    SQLITE_PROFILES = {
+        'default': {
+            'foreign_keys': 1,
+            'journal_mode': 'delete',  # journal_mode 保存在数据库文件中，曾以 'sync' 打开过的数据库需要改回
+        },
+        'sync': {
+            'foreign_keys': 1,
+            'journal_mode': 'wal',
+            'synchronous': 'normal',  # WAL 下只在检查点时 fsync，断电最多丢失最后几次提交
+            'cache_size': -64 * 1024,  # 负数表示 KiB，即 64 MiB 页缓存
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'memory',
+        },
+    }
+
+    # 单个事务的上限：写入行数或持续秒数超过任意一项时提交并开始新事务，避免大艺术家长时间持有写锁、WAL 无限增长
+    TRANSACTION_MAX_ROWS = 20000
+    TRANSACTION_MAX_SECONDS = 5.0
+
+    # 监视模式：艺术家目录最后一次变化后等待多少秒再同步（下载器通常先创建目录，再陆续写入文件）
+    WATCH_DEBOUNCE_SECONDS = 10
+    # 监视模式下轮询目录 mtime 的间隔（秒），在未安装 watchdog 或指定 --polling（如网络卷）时使用
+    WATCH_POLL_INTERVAL_SECONDS = 30
+
+    # 重命名帖子目录时读取 post.json 与执行重命名的线程数（网络卷上并发可以掩盖延迟）
+    RENAME_WORKER_NUMBER = 8
+
+    # 全文索引（FTS5）的分词器：'trigram' 适用于中日文（需要 SQLite 3.34.0 以上），'unicode61' 只按空格与标点分词
+    FTS_TOKENIZER = 'trigram'
+
+    # 缩略图缓存目录（默认位于数据库目录下），按原图内容的哈希保存，多个来源共用
+    THUMBNAIL_CACHE_PATH = os.path.join(os.path.dirname(KEMONO_DB_PATH), 'thumbnails')
+    # 缩略图长边的像素数
+    THUMBNAIL_SIZE = 320
+    # 缩略图缓存的总大小上限（字节），超过后淘汰最久未使用的缩略图
+    THUMBNAIL_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+    # 生成缩略图的进程数
+    THUMBNAIL_WORKER_NUMBER = 4
+
+    # 同步时读取图片文件头（宽高、格式）的线程数，1 表示在写入数据库的线程中串行读取
+    IMAGE_PROBE_THREAD_NUMBER = 8
+
+    # 查找重复文件时使用的哈希表数据库（三个来源共用）与计算哈希的进程数
+    DEDUP_DB_PATH = os.path.join(os.path.dirname(KEMONO_DB_PATH), 'dedup.sqlite3')
+    DEDUP_WORKER_NUMBER = 4
@@ -0,0 +1,59 @@
+""" 此文件用于查找 Kemono、Pixiv、Twitter 之间内容相同（或相似）的文件 """
+import argparse
+
+from DuplicateIndex import DuplicateIndex, SOURCES, Image
+from SyncMetrics import SyncMetrics, metrics
+
+
+def formatSize(byteSize: int):
+    for unit in ('B', 'KB', 'MB'):
+        if byteSize < 1024:
+            return f"{byteSize:.0f}{unit}"
+        byteSize /= 1024
+    return f"{byteSize:.1f}GB"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='计算各来源文件的哈希（只计算新增或修改过的文件），并列出内容相同的文件')
+    parser.add_argument('sources', nargs='*', metavar='SOURCE', help=f'要比较的来源（{", ".join(SOURCES)}），默认全部')
+    parser.add_argument('--no-update', action='store_true', help='不计算哈希，只查询已有的哈希表')
+    parser.add_argument('--within-source', action='store_true', help='同时列出同一来源内部的重复文件，默认只列出跨来源的')
+    parser.add_argument('--phash', action='store_true', help='同时计算感知哈希并列出相似的图片（需要安装 Pillow，需解码图片，较慢）')
+    parser.add_argument('--phash-distance', type=int, default=4, help='感知哈希的最大汉明距离，默认 4')
+    parser.add_argument('--workers', type=int, default=None, help='计算哈希的进程数，默认为 DEDUP_WORKER_NUMBER')
+    parser.add_argument('--limit', type=int, default=50, help='最多显示的组数，0 表示全部')
+    SyncMetrics.addArguments(parser)
+    args = parser.parse_args()
+
+    unknownSources = [source for source in args.sources if source not in SOURCES]
+    if unknownSources:
+        parser.error(f'未知的来源: {", ".join(unknownSources)}')
+    if args.phash and Image is None:
+        parser.exit(1, "未安装 Pillow，请先执行 pip install Pillow\n")
+    if not 0 <= args.phash_distance < 16:
+        parser.error('--phash-distance 应在 0 到 15 之间')
+
+    sources = list(dict.fromkeys(args.sources or SOURCES))
+    duplicateIndex = DuplicateIndex(args.workers, args.phash)
+    if not args.no_update:
+        metrics.startFromArgs('dedup', args)
+        counters = duplicateIndex.update(sources)
+        metrics.finish()
+        print(f"新计算 {counters['hashed']}, 未变化 {counters['unchanged']}, 文件不存在 {counters['missing']}, "
+              f"移除 {counters['removed']}")
+
+    groups = duplicateIndex.findDuplicates(sources, crossSourceOnly=not args.within_source)
+    wastedBytes = sum(files[0][2] * (len(files) - 1) for _, files in groups)
+    print(f"内容相同的文件 {len(groups)} 组，可节省 {formatSize(wastedBytes)}")
+    for sha1, files in groups[:args.limit or None]:
+        print(f"{sha1} ({formatSize(files[0][2])})")
+        for source, path, _ in files:
+            print(f"  [{source}] {path}")
+
+    if args.phash:
+        nearGroups = duplicateIndex.findNearDuplicates(sources, args.phash_distance)
+        print(f"相似的图片 {len(nearGroups)} 组")
+        for files in nearGroups[:args.limit or None]:
+            print('-')
+            for source, path in files:
+                print(f"  [{source}] {path}")
@@ -1,14 +1,24 @@
-
 import sys
+import argparse
 from peewee import *
 import json
 import datetime
 import os
+from collections import namedtuple
 
 from Util import Util
 from filePathConfig import Config
-
-db = SqliteDatabase(Config.KEMONO_DB_PATH, pragmas={'foreign_keys': 1})
+from BatchInserter import BatchInserter
+from BoundedTransaction import BoundedTransaction
+from ScanManifest import ScanManifestBase, ScanManifest
+from ParsePipeline import ParsePipeline
+from ParsedPostCache import ParsedPostCache
+from Reconciler import Reconciler
+from FullTextIndex import FullTextIndex
+from ImageProbe import ImageProber
+from SyncMetrics import SyncMetrics, metrics
+
+db = SqliteDatabase(Config.KEMONO_DB_PATH, pragmas=Util.getSqlitePragmas())
 
 # 单例装饰器
 def singleton(cls):
@@ -34,11 +44,14 @@ class KemonoArtist(BaseModel):
 
     class Meta:
         table_name = 'kemonoArtist'
+        indexes = (
+            (('kemono_artist_id', 'service'), False),
+        )
 
 
 class KemonoPost(BaseModel):
     id = AutoField(column_name='id')
-    kemono_post_id = TextField(column_name='kemono_post_id')
+    kemono_post_id = TextField(column_name='kemono_post_id', index=True)
     artist = ForeignKeyField(KemonoArtist, column_name='artist_id', backref='posts', on_delete='CASCADE')
     name = TextField(column_name='name')
     post_date = TextField(column_name='post_date')
@@ -49,15 +62,119 @@ class KemonoPost(BaseModel):
 
     class Meta:
         table_name = 'kemonoPost'
+        indexes = (
+            (('artist', 'post_date'), False),
+            (('artist', 'viewed'), False),
+            # 帖子 ID 只在同一平台内唯一，艺术家按 (kemono_artist_id, service) 区分
+            (('artist', 'kemono_post_id'), True),
+        )
 
 
 class KemonoImage(BaseModel):
     id = AutoField(column_name='id')
     post = ForeignKeyField(KemonoPost, column_name='post_id', backref='images', on_delete='CASCADE')
     image_name = TextField(column_name='name')
+    thumb_key = TextField(column_name='thumb_key', null=True, index=True)  # 缩略图缓存的键（原图内容的哈希）；NULL 为尚未生成，空字符串为无法生成或已被淘汰
+    # 由文件头读取，不解码图片；byte_size 为 NULL 表示尚未探测（文件不存在），无法识别的格式（视频等）只有 byte_size
+    width = IntegerField(column_name='width', null=True)
+    height = IntegerField(column_name='height', null=True)
+    byte_size = IntegerField(column_name='byte_size', null=True)
+    format = TextField(column_name='format', null=True)
 
     class Meta:
         table_name = 'kemonoImage'
+        indexes = (
+            (('post', 'image_name'), True),
+        )
+
+
+class KemonoScanManifest(ScanManifestBase):
+    class Meta:
+        database = db
+        table_name = 'kemonoScanManifest'
+
+# 解析 post.json 得到的普通数据，可在进程间传递；postRow 中不含 artist 外键
+KemonoParsedPost = namedtuple('KemonoParsedPost', ['artistKemonoId', 'kemonoPostId', 'postRow', 'imageRows', 'rowError',
+                                                   'service', 'published', 'title'])
+
+
+def parseKemonoPost(postDirPath: str):
+    """ 读取帖子目录下的 post.json 并转换为待写入的行，串行路径与解析进程共用 """
+    postJsonFilePath = os.path.join(postDirPath, "post.json")
+    with metrics.stage('read'):
+        with open(postJsonFilePath, 'r', encoding='utf-8') as f:
+            jsonText = f.read()
+
+    with metrics.stage('parse'):
+        return buildKemonoParsedPost(postDirPath, json.loads(jsonText))
+
+
+def buildKemonoParsedPost(postDirPath: str, jsonData: dict):
+    try:
+        # post_date = self.parseDate(jsonData["published"])
+        post_date = jsonData["published"].split('.')[0] + '.000'
+
+        postRow = dict(
+            kemono_post_id=jsonData['id'],
+            name=jsonData.get("title", "Untitled"),
+            post_date=post_date,
+            cover_img_file_name=f"{jsonData['id']}_{jsonData['file']['name']}" if jsonData['file']['name'] else "",
+            post_folder_name=os.path.basename(postDirPath),
+            attachment_number=len(jsonData.get("attachments", []))
+        )
+
+        # 处理附件数据
+        imageRows = []
+        for i, attachment in enumerate(jsonData.get("attachments", [])):
+            file_name = attachment['name']
+            file_ext = os.path.splitext(file_name)[1]
+
+            imageRows.append(dict(image_name=f"{i + 1}{file_ext}"))
+        rowError = None
+    except Exception as e:
+        postRow, imageRows, rowError = None, None, str(e)
+
+    return KemonoParsedPost(jsonData.get('user'), jsonData.get('id'), postRow, imageRows, rowError,
+                            jsonData.get('service'), jsonData.get('published'), jsonData.get('title'))
+
+
+def scanKemonoArtist(artistDirPath: str, knownPostsName=frozenset()):
+    """
+    解析进程的任务：列出艺术家目录并解析其中的 post.json，失败的帖子以错误信息字符串表示。
+    knownPostsName 中的帖子目录已入库，不读取其 post.json（需要时由写入进程自行读取）。
+    """
+    postsName = Util.getSubdirectoryNames(artistDirPath)
+    parsedPosts = {}
+    for postName in postsName or []:
+        if postName in knownPostsName:
+            continue
+        postDirPath = os.path.join(artistDirPath, postName)
+        try:
+            parsedPosts[postDirPath] = parseKemonoPost(postDirPath)
+        except Exception as e:
+            parsedPosts[postDirPath] = str(e)
+    return postsName, parsedPosts
+
+
+# 帖子文本的全文索引，同步类与只读的工具（search_posts.py）共用
+fullTextIndex = FullTextIndex(db, KemonoPost, ['name'])
+
+
+def iterImageFiles(condition, batchSize: int = 5000):
+    """ 按主键顺序分批返回满足 condition 的图片行的 [(主键, 文件路径)]，每批一次查询 """
+    lastImageId = 0
+    while True:
+        rows = list(KemonoImage.select(
+            KemonoImage.id, KemonoArtist.name, KemonoPost.post_folder_name, KemonoImage.image_name
+        ).join(KemonoPost).join(KemonoArtist).where(
+            condition & (KemonoImage.id > lastImageId)
+        ).order_by(KemonoImage.id).limit(batchSize).tuples())
+        if not rows:
+            return
+        yield [(imageId, os.path.join(Config.KEMONO_BASEPATH, artistName, postFolderName, imageName))
+               for imageId, artistName, postFolderName, imageName in rows]
+        lastImageId = rows[-1][0]
+
 
 @singleton  # 应用单例装饰器
 class KemonoSyncer:
@@ -65,7 +182,17 @@ class KemonoSyncer:
         # connect to the database
         # if the database does not exist, it will be created
         db.connect()
+        self.fullTextIndex = fullTextIndex
         self.create_tables_if_not_exist()
+        self.imageProber = ImageProber([KemonoImage.width, KemonoImage.height, KemonoImage.byte_size, KemonoImage.format])
+        self.batchInserter = BatchInserter(KemonoPost, KemonoImage, postsInsertedCallbacks=[self.fullTextIndex],
+                                           imageProber=self.imageProber, postKeyFieldNames=['artist', 'kemono_post_id'])
+        self.scanManifest = ScanManifest(KemonoScanManifest)
+        # 并行解析模式下当前艺术家的 (帖子目录名列表, {帖子目录路径: 解析结果})
+        self.prescan = None
+        self.parsedPostCache = ParsedPostCache()
+        # 当前艺术家中因 post.json 缺失、未写完或解析失败而未能入库的帖子目录，非空时不记录扫描清单
+        self.skippedPostPaths = set()
 
     def checkIfTablesExist(self):
         with db:
@@ -80,6 +207,27 @@ class KemonoSyncer:
             if not self.checkIfTablesExist():
                 db.create_tables([KemonoArtist, KemonoPost, KemonoImage])
                 print("所有表创建成功")
+            else:
+                Util.addMissingColumns(db, [KemonoArtist, KemonoPost, KemonoImage])
+                self.mergeDuplicateRows()
+                Util.createMissingIndexes(db, [KemonoArtist, KemonoPost, KemonoImage])
+            # 辅助表，旧数据库中按需补建
+            db.create_tables([KemonoScanManifest], safe=True)
+            if self.fullTextIndex.createIfNotExists():
+                print("已创建全文索引")
+
+    def mergeDuplicateRows(self):
+        """ 建立唯一约束之前合并旧数据库中重复的帖子与图片行 """
+        Util.mergeDuplicateRows(db, KemonoPost, ['artist', 'kemono_post_id'], self.deletePosts, ['viewed'])
+        Util.mergeDuplicateRows(db, KemonoImage, ['post', 'image_name'],
+                                lambda imageIds: KemonoImage.delete().where(KemonoImage.id.in_(imageIds)).execute())
+
+    def deletePosts(self, postIds):
+        KemonoImage.delete().where(KemonoImage.post.in_(postIds)).execute()
+        # 全文索引不存在时随后由帖子表建立
+        if self.fullTextIndex.exists():
+            self.fullTextIndex.deleteRows(postIds)
+        KemonoPost.delete().where(KemonoPost.id.in_(postIds)).execute()
 
     def parseDate(self, date_str):
         # 原始格式示例: "2023-10-05T14:48:00.000Z"
@@ -91,7 +239,11 @@ class KemonoSyncer:
             date_str = date_str.rstrip('Z')
             return datetime.datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S.%f')
 
-    def writeKemonoDataToDatabase(self):
+    def writeKemonoDataToDatabase(self, fullScan: bool = False, workerNumber: int = None):
+        """
+        fullScan 为 True 时忽略扫描清单，重新检查所有艺术家目录。
+        workerNumber 大于 1 时由进程池并行解析 post.json，本进程只负责写入数据库。
+        """
         if db is None:
             print("数据库初始化失败")
             return
@@ -103,18 +255,90 @@ class KemonoSyncer:
 
         print(f"发现 {len(artistNames)} 位艺术家")
 
-        for i, artistName in enumerate(artistNames):
-            print(f'{artistName}: ', flush=True, end='')
-            with db.atomic() as transaction:
-                self.handleOneArtist(artistName)
-            print('', flush=True)
-
+        # 每次同步使用新的解析缓存
+        self.parsedPostCache = ParsedPostCache()
+
+        skippedArtistNumber = 0
+        artistsToSync = []
+        with metrics.stage('scan'):
+            for i, artistName in enumerate(artistNames):
+                artistDirPath = os.path.join(Config.KEMONO_BASEPATH, artistName)
+                if fullScan:
+                    dirSnapshot = self.scanManifest.takeSnapshot(artistDirPath)
+                else:
+                    unchanged, dirSnapshot = self.scanManifest.check(artistName, artistDirPath)
+                    if unchanged:
+                        skippedArtistNumber += 1
+                        continue
+                artistsToSync.append((artistName, dirSnapshot))
+        metrics.count('skipped_artists', skippedArtistNumber)
+
+        pipeline = ParsePipeline(scanKemonoArtist, workerNumber or Config.PARSE_WORKER_NUMBER)
+        # 串行时不预先解析，无需查询
+        tasks = ((os.path.join(Config.KEMONO_BASEPATH, artistName),
+                  self.getKnownPostsName(artistName) if pipeline.workerNumber > 1 else frozenset())
+                 for artistName, _ in artistsToSync)
+        for (artistName, dirSnapshot), (_, prescan, workerMetrics) in zip(artistsToSync, pipeline.run(tasks)):
+            self.syncOneArtist(artistName, dirSnapshot, prescan, workerMetrics)
+
+        if skippedArtistNumber:
+            print(f"跳过 {skippedArtistNumber} 位目录未变化的艺术家")
+        print(self.parsedPostCache.summary())
+        Util.checkpointDatabase(db)
         print("数据处理完成")
 
 
+    def getKnownPostsName(self, artistName: str):
+        """ 一次查询取出该艺术家目录（各平台）已入库的帖子目录名，交给解析进程跳过 """
+        with metrics.stage('query'):
+            return {postFolderName for postFolderName, in KemonoPost.select(KemonoPost.post_folder_name).join(KemonoArtist).where(
+                KemonoArtist.name == artistName
+            ).tuples()}
+
+    def reconcile(self, dryRun: bool = False, checkFiles: bool = False, reportFile=None):
+        """ 删除磁盘上已不存在的艺术家目录、帖子目录与附件对应的行，返回各表清理的行数 """
+        reconciler = Reconciler(db, Config.KEMONO_BASEPATH, KemonoArtist.name, KemonoPost.post_folder_name,
+                                KemonoImage.image_name, KemonoScanManifest, self.fullTextIndex)
+        return reconciler.run(dryRun, checkFiles, reportFile)
+
+    def syncOneArtist(self, artistName: str, dirSnapshot=None, prescan=None, workerMetrics=None):
+        """
+        在有界事务中同步一位艺术家，完成后记录扫描清单；dirSnapshot 为 None 时现在读取目录快照。
+        prescan 与 workerMetrics 为解析进程返回的结果及其阶段耗时与计数
+        """
+        if dirSnapshot is None:
+            dirSnapshot = self.scanManifest.takeSnapshot(os.path.join(Config.KEMONO_BASEPATH, artistName))
+
+        print(f'{artistName}: ', flush=True, end='')
+        self.prescan = prescan
+        self.skippedPostPaths = set()
+        try:
+            with metrics.artist(artistName), BoundedTransaction(db) as transaction:
+                metrics.merge(workerMetrics)
+                self.batchInserter.transaction = transaction
+                self.handleOneArtist(artistName)
+                self.batchInserter.flush()
+                # 之后写入帖子目录的 post.json 不会改变艺术家目录的指纹，有帖子被跳过时不记录，下次同步仍检查该目录
+                if self.skippedPostPaths:
+                    print(f' ({len(self.skippedPostPaths)} 个帖子未能入库，下次同步重新检查)', flush=True, end='')
+                else:
+                    self.scanManifest.record(artistName, dirSnapshot)
+        finally:
+            self.batchInserter.transaction = None
+            self.batchInserter.discard()
+            self.prescan = None
+        print('', flush=True)
+
     def handleOneArtist(self, artistName: str):
         artistDirPath = os.path.join(Config.KEMONO_BASEPATH, artistName)
-        postsName = Util.getSubdirectoryNames(artistDirPath)
+        if self.prescan is not None:
+            postsName = self.prescan[0]
+        else:
+            with metrics.stage('scan'):
+                postsName = Util.getSubdirectoryNames(artistDirPath)
+        # 列举失败时同样不记录扫描清单
+        if postsName is None:
+            self.skippedPostPaths.add(artistDirPath)
         # 没有帖子时跳过
         if not postsName:
             return
@@ -124,6 +348,8 @@ class KemonoSyncer:
             refPostJsonFilePath = self.findRefPostJsonFilePath(artistName, postService, postsName)
             if not refPostJsonFilePath:
                 print(f"未找到符合条件的 post.json 文件: {artistName}, {postService}")
+                self.skippedPostPaths.update(os.path.join(artistDirPath, postName)
+                                             for postName in self.getPostsNameOfService(postsName, postService))
                 continue
             artistKemonoId = self.getArtistKemonoId(refPostJsonFilePath)
 
@@ -140,18 +366,21 @@ class KemonoSyncer:
                 self.handleNewArtist(artistKemonoId, artistName, postService, postsName)
 
     def handleExistedArtist(self, artist_SQLObj, postsName):
-        posts_SQLObj = KemonoPost.select().where(
-            KemonoPost.artist == artist_SQLObj
-        ).order_by(KemonoPost.post_date.desc())
+        postsName_currentService = self.getPostsNameOfService(postsName, artist_SQLObj.service)
 
-        if not posts_SQLObj:
-            print(f"艺术家 {artist_SQLObj.name} 没有帖子，跳过")
-            return
+        if Config.INGESTED_DETECTION_MODE == 'set':
+            postsName_notProcessed = self.getNotProcessedPostsNameBySet(artist_SQLObj, postsName_currentService)
+        else:
+            posts_SQLObj = KemonoPost.select().where(
+                KemonoPost.artist == artist_SQLObj
+            ).order_by(KemonoPost.post_date.desc())
 
-        latestDateTimeInDb = datetime.datetime.strptime(posts_SQLObj.first().post_date.split('.')[0], '%Y-%m-%dT%H:%M:%S')
+            if not posts_SQLObj:
+                print(f"艺术家 {artist_SQLObj.name} 没有帖子，跳过")
+                return
 
-        postsName_currentService = self.getPostsNameOfService(postsName, artist_SQLObj.service)
-        postsName_notProcessed = self.getNotProcessedPostsName(artist_SQLObj.name, postsName_currentService, latestDateTimeInDb)
+            latestDateTimeInDb = datetime.datetime.strptime(posts_SQLObj.first().post_date.split('.')[0], '%Y-%m-%dT%H:%M:%S')
+            postsName_notProcessed = self.getNotProcessedPostsName(artist_SQLObj.name, postsName_currentService, latestDateTimeInDb)
 
         for postName in postsName_notProcessed:
             postDirPath = os.path.join(Config.KEMONO_BASEPATH, artist_SQLObj.name, postName)
@@ -161,29 +390,41 @@ class KemonoSyncer:
         if not postsName_notProcessed:
             print('(No new posts)', flush=True, end='')
 
-    def getNotProcessedPostsName(self, artistName: str, postsName_currentService, latestDateTimeInDb):
-        notProcessedPostsName = []
+    def getNotProcessedPostsNameBySet(self, artist_SQLObj, postsName_currentService):
+        """
+        一次查询取出该艺术家已入库的帖子 ID 与目录名，与目录列表求差集。
+
+        目录名已入库的帖子不再读取 JSON；只有目录名未知的帖子才解析 post.json，
+        并用帖子 ID 排除被重命名过的目录。不依赖日期，补下载的旧帖子也能被发现。
+        """
+        knownPostIds = set()
+        knownPostsName = set()
+        for kemonoPostId, postFolderName in KemonoPost.select(KemonoPost.kemono_post_id, KemonoPost.post_folder_name).where(
+            KemonoPost.artist == artist_SQLObj
+        ).tuples():
+            knownPostIds.add(kemonoPostId)
+            knownPostsName.add(postFolderName)
 
+        notProcessedPostsName = []
         for currentPostName in postsName_currentService:
-            currentPostDateTime = datetime.datetime.strptime(currentPostName.split(']')[1].strip('['), '%Y-%m-%d')
+            if currentPostName in knownPostsName:
+                continue
 
-            if Util.checkYMDSmall(currentPostDateTime, latestDateTimeInDb):
+            parsedPost = self.loadParsedPost(os.path.join(Config.KEMONO_BASEPATH, artist_SQLObj.name, currentPostName))
+            if parsedPost is None or parsedPost.kemonoPostId in knownPostIds:
                 continue
+            notProcessedPostsName.append(currentPostName)
 
-            if Util.checkYMDEqual(currentPostDateTime, latestDateTimeInDb):
-                currentPostJsonFilePath = os.path.join(Config.KEMONO_BASEPATH, artistName, currentPostName, "post.json")
-                try:
-                    with open(currentPostJsonFilePath, 'r', encoding='utf-8') as f:
-                        jsonData = json.load(f)
-                except Exception as e:
-                    print(f"打开或解析 JSON 文件失败: {currentPostJsonFilePath} - {e}")
-                    continue
+        return notProcessedPostsName
 
-                post_SQLObj = KemonoPost.select().where(KemonoPost.kemono_post_id == jsonData['id'])
-                if not post_SQLObj:
-                    notProcessedPostsName.append(currentPostName)
+    def getNotProcessedPostsName(self, artistName: str, postsName_currentService, latestDateTimeInDb):
+        notProcessedPostsName = []
 
-            else:
+        for currentPostName in postsName_currentService:
+            currentPostDateTime = datetime.datetime.strptime(currentPostName.split(']')[1].strip('['), '%Y-%m-%d')
+
+            # 与最新入库日期同一天的帖子可能已入库，写入时由唯一约束跳过
+            if not Util.checkYMDSmall(currentPostDateTime, latestDateTimeInDb):
                 notProcessedPostsName.append(currentPostName)
 
         return notProcessedPostsName
@@ -213,53 +454,53 @@ class KemonoSyncer:
     def findRefPostJsonFilePath(self, artistName: str, service: str, postsName):
         for postName in postsName:
             if postName.startswith(f"[{service}]"):
-                postJsonFilePath = os.path.join(Config.KEMONO_BASEPATH, artistName, postName, "post.json")
-                if os.path.exists(postJsonFilePath) and os.path.isfile(postJsonFilePath):
-                    return postJsonFilePath
+                postDirPath = os.path.join(Config.KEMONO_BASEPATH, artistName, postName)
+                if self.hasPostJson(postDirPath):
+                    return os.path.join(postDirPath, "post.json")
         print(f"未找到符合条件的 post.json 文件: {artistName}, {service}")
         return None
 
+    def hasPostJson(self, postDirPath: str):
+        """ 解析进程已读取过时直接判断，否则在帖子目录的列举结果中查找 post.json """
+        if self.prescan is not None and isinstance(self.prescan[1].get(postDirPath), KemonoParsedPost):
+            return True
+        try:
+            with metrics.stage('scan'):
+                return 'post.json' in Util.scanDirectory(postDirPath).filesName
+        except OSError:
+            return False
+
 
     def handleOnePost(self, postDirPath: str, artist_SQLObj):
         """ 处理单个帖子目录 """
-        postJsonFilePath = os.path.join(postDirPath, "post.json")
-
-        # 读取并解析 JSON 文件
-        try:
-            with open(postJsonFilePath, 'r', encoding='utf-8') as f:
-                jsonData = json.load(f)
-        except Exception as e:
-            print(f"打开或解析 JSON 文件失败: {postJsonFilePath} - {e}")
+        parsedPost = self.loadParsedPost(postDirPath)
+        if parsedPost is None:
             return None
 
-        try:
-            # 处理帖子数据
-            # post_date = self.parseDate(jsonData["published"])
-            post_date = jsonData["published"].split('.')[0] + '.000'
-
-            # 创建帖子记录
-            post = KemonoPost.create(
-                kemono_post_id=jsonData['id'],
-                artist=artist_SQLObj,
-                name=jsonData.get("title", "Untitled"),
-                post_date=post_date,
-                cover_img_file_name=f"{jsonData['id']}_{jsonData['file']['name']}" if jsonData['file']['name'] else "",
-                post_folder_name=os.path.basename(postDirPath),
-                attachment_number=len(jsonData.get("attachments", []))
-            )
-
-            # 处理附件数据
-            for i, attachment in enumerate(jsonData.get("attachments", [])):
-                file_name = attachment['name']
-                file_ext = os.path.splitext(file_name)[1]
+        if parsedPost.rowError is not None:
+            print(f"处理帖子失败: {postDirPath} - {parsedPost.rowError}")
+            metrics.count('errors')
+            self.skippedPostPaths.add(postDirPath)
+            return None
 
-                # 创建图片记录
-                KemonoImage.create(
-                    post=post,
-                    image_name=f"{i + 1}{file_ext}"
-                )
-        except Exception as e:
-            print(f"处理帖子失败: {postDirPath} - {e}")
+        # 收集帖子记录，随艺术家一起批量写入
+        imageRows = [self.imageProber.submit(dict(imageRow), os.path.join(postDirPath, imageRow['image_name']))
+                     for imageRow in parsedPost.imageRows]
+        self.batchInserter.addPost({**parsedPost.postRow, 'artist': artist_SQLObj.id}, imageRows)
+
+    def loadParsedPost(self, postDirPath: str):
+        """ 优先使用解析进程的结果，否则经解析缓存读取 post.json；失败时返回 None """
+        if self.prescan is not None and postDirPath in self.prescan[1]:
+            parsedPost = self.prescan[1][postDirPath]
+        else:
+            parsedPost = self.parsedPostCache.get(os.path.join(postDirPath, 'post.json'), parseKemonoPost, postDirPath)
+
+        if isinstance(parsedPost, str):
+            print(f"打开或解析 JSON 文件失败: {os.path.join(postDirPath, 'post.json')} - {parsedPost}")
+            metrics.count('errors')
+            self.skippedPostPaths.add(postDirPath)
+            return None
+        return parsedPost
 
 
     def getPostServices(self, postsName: str):
@@ -268,15 +509,26 @@ class KemonoSyncer:
 
     def getArtistKemonoId(self, postJsonFilePath: str):
         """ 获取艺术家的 kemono_id """
-        try:
-            with open(postJsonFilePath, 'r', encoding='utf-8') as f:
-                jsonData = json.load(f)
-        except Exception as e:
-            print(f"读取 JSON 文件失败: {postJsonFilePath} - {e}")
+        parsedPost = self.loadParsedPost(os.path.dirname(postJsonFilePath))
+        if parsedPost is None:
             return None
-        artistKemonoId = jsonData['user']
-        return artistKemonoId
+        return parsedPost.artistKemonoId
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='将 Kemono 下载目录同步到数据库')
+    parser.add_argument('--full', action='store_true', help='忽略扫描清单，重新检查所有艺术家目录')
+    parser.add_argument('--workers', type=int, default=None, help='并行解析 JSON 的进程数，默认使用 Config 中的设置')
+    parser.add_argument('--rebuild-fts', action='store_true', help='不同步，只由帖子表重建全文索引')
+    parser.add_argument('--backfill-image-info', action='store_true', help='不同步，只为尚未记录尺寸的图片读取文件头并写入')
+    SyncMetrics.addArguments(parser)
+    args = parser.parse_args()
+
+    metrics.startFromArgs('kemono', args)
     dbManager = KemonoSyncer()
-    dbManager.writeKemonoDataToDatabase()
+    if args.rebuild_fts:
+        print(f"已重建全文索引，共 {dbManager.fullTextIndex.rebuild()} 条")
+    elif args.backfill_image_info:
+        dbManager.imageProber.backfill(db, iterImageFiles)
+    else:
+        dbManager.writeKemonoDataToDatabase(fullScan=args.full, workerNumber=args.workers)
+    metrics.finish()
@@ -1,18 +1,30 @@
 """_"""
 
 import sys
+import argparse
 from zoneinfo import available_timezones
 
 from peewee import *
 import json
 import datetime
 import os
+import re
+from collections import defaultdict, namedtuple
 from pathlib import Path
 
 from Util import Util
 from filePathConfig import Config
-
-db = SqliteDatabase(Config.PIXIV_DB_PATH, pragmas={'foreign_keys': 1})
+from BatchInserter import BatchInserter
+from BoundedTransaction import BoundedTransaction
+from ScanManifest import ScanManifestBase, ScanManifest
+from ParsePipeline import ParsePipeline
+from ParsedPostCache import ParsedPostCache
+from Reconciler import Reconciler
+from FullTextIndex import FullTextIndex
+from ImageProbe import ImageProber
+from SyncMetrics import SyncMetrics, metrics
+
+db = SqliteDatabase(Config.PIXIV_DB_PATH, pragmas=Util.getSqlitePragmas())
 
 # 单例装饰器
 def singleton(cls):
@@ -30,7 +42,7 @@ class BaseModel(Model):
 
 class PixivArtist(BaseModel):
     id = AutoField(column_name='id')  # 自动递增主键
-    pixiv_artist_id = TextField(column_name='pixiv_artist_id')
+    pixiv_artist_id = TextField(column_name='pixiv_artist_id', index=True)
     name = TextField(column_name='name')
     userAccount = TextField(column_name='user_account')
     artistFolderName = TextField(column_name='artist_folder_name')
@@ -42,7 +54,7 @@ class PixivArtist(BaseModel):
 
 class PixivPost(BaseModel):
     id = AutoField(column_name='id')
-    pixiv_post_id = TextField(column_name='pixiv_post_id')
+    pixiv_post_id = TextField(column_name='pixiv_post_id', unique=True)
     artist = ForeignKeyField(PixivArtist, column_name='artist_id', backref='posts', on_delete='CASCADE')
     name = TextField(column_name='name')
     comment = TextField(column_name='comment')
@@ -63,31 +75,350 @@ class PixivPost(BaseModel):
     aiType = IntegerField(column_name='ai_type')
 
     viewed = BooleanField(column_name='viewed', default=False)
+    # 入库或上次刷新计数时 JSON 文件的 mtime（纳秒），NULL 表示之前的版本入库、尚未记录
+    metaMtime = IntegerField(column_name='meta_mtime', null=True)
 
     class Meta:
         table_name = 'pixivPost'
+        indexes = (
+            (('artist', 'post_date'), False),
+            (('artist', 'viewed'), False),
+        )
 
 
 class PixivImage(BaseModel):
     id = AutoField(column_name='id')
     post = ForeignKeyField(PixivPost, column_name='post_id', backref='images', on_delete='CASCADE')
     imageName = TextField(column_name='name')
+    thumbKey = TextField(column_name='thumb_key', null=True, index=True)  # 缩略图缓存的键（原图内容的哈希）；NULL 为尚未生成，空字符串为无法生成或已被淘汰
+    # 由文件头读取，不解码图片；byteSize 为 NULL 表示尚未探测（文件不存在），无法识别的格式（ugoira 等）只有 byteSize
+    width = IntegerField(column_name='width', null=True)
+    height = IntegerField(column_name='height', null=True)
+    byteSize = IntegerField(column_name='byte_size', null=True)
+    format = TextField(column_name='format', null=True)
 
     class Meta:
         table_name = 'pixivImage'
+        indexes = (
+            (('post', 'imageName'), True),
+        )
+
+class PixivScanManifest(ScanManifestBase):
+    class Meta:
+        database = db
+        table_name = 'pixivScanManifest'
 
 class PixivTag(BaseModel):
     id = AutoField(column_name='id')
-    
+    name = TextField(column_name='name', unique=True)
+    translation = TextField(column_name='translation', default='')  # 英文翻译，没有时为空字符串
+
+    class Meta:
+        table_name = 'pixivTag'
+
+class PixivPostTag(BaseModel):
+    id = AutoField(column_name='id')
+    post = ForeignKeyField(PixivPost, column_name='post_id', backref='postTags', on_delete='CASCADE', index=False)
+    tag = ForeignKeyField(PixivTag, column_name='tag_id', backref='postTags', on_delete='CASCADE', index=False)
+
+    class Meta:
+        table_name = 'pixivPostTag'
+        indexes = (
+            (('post', 'tag'), True),
+            # 按标签查找帖子
+            (('tag', 'post'), False),
+        )
+
+# 解析 JSON 得到的普通数据，可在进程间传递；postRow 中不含 artist 外键
+# tags 为去重后的 [(标签名, 英文翻译)]
+PixivParsedPost = namedtuple('PixivParsedPost', ['userId', 'userName', 'userAccount', 'illustId', 'postRow', 'imageRows', 'rowError',
+                                                 'tags'])
+
+
+def getPlusOrMinus(date_str):
+    if '+' in date_str:
+        return '+'
+    elif '-' in date_str:
+        return '-'
+    else:
+        raise ValueError("日期字符串格式错误，必须包含 '+' 或 '-' 符号")
+
+
+def parseDate(date_str):
+    plusOrMinus = getPlusOrMinus(date_str)
+
+    timeDeltaInHour = int(date_str.split(plusOrMinus)[1].split(':')[0])
+    datetimeStr = date_str.split(plusOrMinus)[0]
+    datetimeObj = datetime.datetime.strptime(datetimeStr, '%Y-%m-%dT%H:%M:%S')
+    if plusOrMinus == '+':
+        datetimeObj -= datetime.timedelta(hours=timeDeltaInHour)
+    else:
+        datetimeObj += datetime.timedelta(hours=timeDeltaInHour)
+    return datetimeObj.strftime('%Y-%m-%dT%H:%M:%S') + '.000'
+
+
+def parsePixivPost(jsonFilePath: str):
+    """ 读取帖子的 JSON 并转换为待写入的行，串行路径与解析进程共用 """
+    with metrics.stage('read'):
+        with open(jsonFilePath, 'r', encoding='utf-8') as f:
+            metaMtime = os.fstat(f.fileno()).st_mtime_ns
+            jsonText = f.read()
+
+    with metrics.stage('parse'):
+        return buildPixivParsedPost(jsonFilePath, json.loads(jsonText), metaMtime)
+
+
+def buildPixivParsedPost(jsonFilePath: str, jsonData: dict, metaMtime: int = None):
+    postFolderName = os.path.basename(os.path.dirname(jsonFilePath))
+    try:
+        imageNumber = jsonData['pageCount']
+
+        firstFileURL = jsonData['urls']['original']
+        if not firstFileURL:
+            raise ValueError("帖子缺少原始图片 URL")
+        firstFileName = os.path.basename(firstFileURL)
+
+        if jsonData['illustType'] == 2:
+            # Ugoira file
+            firstFileName_forPost = firstFileName.split("_ugoira0")[0] + '_ugoira1920x1080.ugoira'
+        else:
+            firstFileName_forPost = firstFileName
+
+        postRow = dict(
+            pixiv_post_id=jsonData['illustId'],
+            name=jsonData['illustTitle'],
+            comment=jsonData['illustComment'],
+            post_date=parseDate(jsonData['uploadDate']),
+            postFolderName=postFolderName,
+            coverName=firstFileName_forPost,
+            imageNumber=imageNumber,
+            bookmarkCount=jsonData['bookmarkCount'],
+            likeCount=jsonData['likeCount'],
+            commentCount=jsonData['commentCount'],
+            viewCount=jsonData['viewCount'],
+            xRestrict=jsonData['xRestrict'],
+            illustType=jsonData['illustType'],
+            isHowto=jsonData['isHowto'],
+            isOriginal=jsonData['isOriginal'],
+            aiType=jsonData['aiType'],
+            metaMtime=metaMtime
+        )
+
+        if jsonData['illustType'] == 2:
+            # Ugoira file
+            imageFileName = firstFileName.split("_ugoira0")[0] + '_ugoira1920x1080.ugoira'
+            imageRows = [dict(imageName=imageFileName)]
+        else:
+            imageRows = [
+                dict(imageName=firstFileName.replace('_p0', '_p{}'.format(i)))
+                for i in range(imageNumber)
+            ]
+        tags = parsePixivTags(jsonData)
+        rowError = None
+    except Exception as e:
+        postRow, imageRows, tags, rowError = None, None, None, str(e)
+
+    return PixivParsedPost(jsonData.get('userId'), jsonData.get('userName'), jsonData.get('userAccount'),
+                           jsonData.get('illustId'), postRow, imageRows, rowError, tags)
+
+
+def parsePixivTags(jsonData: dict):
+    tags = {}
+    for tagObj in (jsonData.get('tags') or {}).get('tags') or []:
+        tagName = tagObj.get('tag')
+        if tagName and tagName not in tags:
+            tags[tagName] = (tagObj.get('translation') or {}).get('en') or ''
+    return list(tags.items())
+
+
+class PixivTagWriter:
+    """
+    把帖子的标签写入 pixivTag 与 pixivPostTag，作为 BatchInserter 的 postsInsertedCallbacks 之一与帖子在同一事务中写入。
+
+    标签名 -> 主键的缓存在首次使用时从数据库一次载入；新标签按批 INSERT OR IGNORE 后再查询其主键，
+    此后同一标签不再访问数据库。事务回滚后需调用 reset()，丢弃可能已不存在的新标签主键。
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self):
+        self.tagIds = None
+
+    def reset(self):
+        self.tagIds = None
+
+    def ensureTagIds(self, tags):
+        if self.tagIds is None:
+            self.tagIds = dict(PixivTag.select(PixivTag.name, PixivTag.id).tuples())
+
+        newTags = {}
+        for tagName, translation in tags:
+            if tagName not in self.tagIds:
+                newTags.setdefault(tagName, translation)
+        newTagsName = list(newTags)
+        for i in range(0, len(newTagsName), self.BATCH_SIZE):
+            chunk = newTagsName[i:i + self.BATCH_SIZE]
+            PixivTag.insert_many([dict(name=tagName, translation=newTags[tagName]) for tagName in chunk]).on_conflict_ignore().execute()
+            self.tagIds.update(PixivTag.select(PixivTag.name, PixivTag.id).where(PixivTag.name.in_(chunk)).tuples())
+
+    def __call__(self, postIds, postRows, tagsOfPosts):
+        """ tagsOfPosts 与 postIds 一一对应，返回写入的 pixivPostTag 行数 """
+        with metrics.stage('tags'):
+            self.ensureTagIds(tag for tags in tagsOfPosts for tag in tags or [])
+            postTagRows = [
+                dict(post=postId, tag=self.tagIds[tagName])
+                for postId, tags in zip(postIds, tagsOfPosts) for tagName, _ in tags or []
+            ]
+            for i in range(0, len(postTagRows), self.BATCH_SIZE):
+                PixivPostTag.insert_many(postTagRows[i:i + self.BATCH_SIZE]).on_conflict_ignore().execute()
+        metrics.count('tags', len(postTagRows))
+        return len(postTagRows)
+
+
+class PixivArtistIndex:
+    """
+    一位艺术家目录的列举索引：艺术家目录只列举一次，每个帖子目录最多列举一次（首次用到时）。
+
+    帖子目录名、各帖子的 JSON 与图片文件名、avatar/background 以及实际存在的 _pN 页都从这里查找，
+    同一位艺术家的处理过程中不会重复列举同一个目录。只包含普通数据，可由解析进程构建后传回。
+    """
+    PAGE_FILE_NAME_PATTERN = re.compile(r'^(\d+)_p(\d+)\.')
+
+    def __init__(self, artistDirPath: str):
+        self.artistDirPath = artistDirPath
+        with metrics.stage('scan'):
+            self.artistListing = Util.scanDirectory(artistDirPath)
+        self.postListings = {}  # 帖子目录名 -> DirListing
+
+    @property
+    def postsFolderName(self):
+        return self.artistListing.subdirectoriesName
+
+    def getPostListing(self, postFolderName: str):
+        postListing = self.postListings.get(postFolderName)
+        if postListing is None:
+            with metrics.stage('scan'):
+                postListing = Util.scanDirectory(os.path.join(self.artistDirPath, postFolderName))
+            self.postListings[postFolderName] = postListing
+        return postListing
+
+    def getJsonFilesName(self, postFolderName: str):
+        return self.getPostListing(postFolderName).filesNameWithExtension('.json')
+
+    def getArtistFilesName(self, stem: str):
+        """ 艺术家目录中的 avatar、background 等文件 """
+        return self.artistListing.filesNameWithStem(stem)
+
+    def getPageNumbers(self, postFolderName: str, illustId: str):
+        """ 帖子目录中实际存在的 {illustId}_pN.* 的页码集合 """
+        pageNumbers = set()
+        for fileName in self.getPostListing(postFolderName).filesName:
+            match = self.PAGE_FILE_NAME_PATTERN.match(fileName)
+            if match and match.group(1) == illustId:
+                pageNumbers.add(int(match.group(2)))
+        return pageNumbers
+
+
+def scanPixivArtist(artistDirPath: str, knownPostsFolderName=frozenset()):
+    """
+    解析进程的任务：构建艺术家目录的列举索引并解析各帖子的 JSON，失败的帖子以错误信息字符串表示。
+    knownPostsFolderName 中的帖子目录已入库，不列举、不读取其 JSON（需要时由写入进程自行读取）。
+    """
+    try:
+        artistIndex = PixivArtistIndex(artistDirPath)
+        newPostsFolderName = [postFolderName for postFolderName in artistIndex.postsFolderName
+                              if postFolderName not in knownPostsFolderName]
+        for postFolderName in newPostsFolderName:
+            artistIndex.getPostListing(postFolderName)
+    except OSError as e:
+        print(f"获取子目录失败: {e}")
+        return None, {}
+
+    parsedPosts = {}
+    for postFolderName in newPostsFolderName:
+        jsonFilesName = artistIndex.getJsonFilesName(postFolderName)
+        if len(jsonFilesName) != 1:
+            continue
+        jsonFilePath = os.path.join(artistDirPath, postFolderName, jsonFilesName[0])
+        try:
+            parsedPosts[jsonFilePath] = parsePixivPost(jsonFilePath)
+        except Exception as e:
+            parsedPosts[jsonFilePath] = str(e)
+    return artistIndex, parsedPosts
+
+
+def readChangedPixivPosts(artistDirPath: str, knownMetaMtimes: dict):
+    """
+    刷新计数时解析进程的任务：knownMetaMtimes 为 {帖子目录名: 数据库中记录的 JSON mtime}，
+    只解析 mtime 与记录不同的 JSON，返回 {帖子目录名: 解析结果或错误信息字符串}
+    """
+    try:
+        artistIndex = PixivArtistIndex(artistDirPath)
+    except OSError as e:
+        print(f"获取子目录失败: {e}")
+        return {}
+
+    parsedPosts = {}
+    for postFolderName in artistIndex.postsFolderName:
+        if postFolderName not in knownMetaMtimes:
+            continue
+        try:
+            jsonFilesName = artistIndex.getJsonFilesName(postFolderName)
+            if len(jsonFilesName) != 1:
+                continue
+            jsonFilePath = os.path.join(artistDirPath, postFolderName, jsonFilesName[0])
+            with metrics.stage('scan'):
+                metaMtime = os.stat(jsonFilePath).st_mtime_ns
+            if metaMtime == knownMetaMtimes[postFolderName]:
+                continue
+            parsedPosts[postFolderName] = parsePixivPost(jsonFilePath)
+        except Exception as e:
+            parsedPosts[postFolderName] = str(e)
+    return parsedPosts
+
+
+# 帖子文本的全文索引，同步类与只读的工具（search_posts.py）共用
+fullTextIndex = FullTextIndex(db, PixivPost, ['name', 'comment'])
+
+
+def iterImageFiles(condition, batchSize: int = 5000):
+    """ 按主键顺序分批返回满足 condition 的图片行的 [(主键, 文件路径)]，每批一次查询 """
+    lastImageId = 0
+    while True:
+        rows = list(PixivImage.select(
+            PixivImage.id, PixivArtist.artistFolderName, PixivPost.postFolderName, PixivImage.imageName
+        ).join(PixivPost).join(PixivArtist).where(
+            condition & (PixivImage.id > lastImageId)
+        ).order_by(PixivImage.id).limit(batchSize).tuples())
+        if not rows:
+            return
+        yield [(imageId, os.path.join(Config.PIXIV_BASEPATH, artistFolderName, postFolderName, imageName))
+               for imageId, artistFolderName, postFolderName, imageName in rows]
+        lastImageId = rows[-1][0]
+
 
 @singleton  # 应用单例装饰器
 class PixivSyncer:
+    # 刷新计数时覆盖的列，其余列（包括 viewed）保持入库时的值
+    REFRESHED_FIELDS = ['bookmarkCount', 'likeCount', 'commentCount', 'viewCount', 'metaMtime']
 
     def __init__(self):
         # connect to the database
         # if the database does not exist, it will be created
         db.connect()
+        self.fullTextIndex = fullTextIndex
         self.create_tables_if_not_exist()
+        self.tagWriter = PixivTagWriter()
+        self.imageProber = ImageProber([PixivImage.width, PixivImage.height, PixivImage.byteSize, PixivImage.format])
+        self.batchInserter = BatchInserter(PixivPost, PixivImage, postsInsertedCallbacks=[self.tagWriter, self.fullTextIndex],
+                                           imageProber=self.imageProber, postKeyFieldNames=['pixiv_post_id'])
+        self.scanManifest = ScanManifest(PixivScanManifest)
+        # 并行解析模式下当前艺术家的 (PixivArtistIndex, {JSON 路径: 解析结果})
+        self.prescan = None
+        # 当前艺术家目录的列举索引
+        self.artistIndex = None
+        self.parsedPostCache = ParsedPostCache()
+        # 当前艺术家中因 JSON 缺失、未写完或解析失败而未能入库的帖子目录，非空时不记录扫描清单
+        self.skippedPostPaths = set()
 
     def checkIfTablesExist(self):
         with db:
@@ -102,9 +433,35 @@ class PixivSyncer:
             if not self.checkIfTablesExist():
                 db.create_tables([PixivArtist, PixivPost, PixivImage])
                 print("所有表创建成功")
-
-
-    def writePixivDataToDatabase(self):
+            else:
+                Util.addMissingColumns(db, [PixivArtist, PixivPost, PixivImage])
+                self.mergeDuplicateRows()
+                Util.createMissingIndexes(db, [PixivArtist, PixivPost, PixivImage])
+            # 辅助表，旧数据库中按需补建
+            db.create_tables([PixivScanManifest, PixivTag, PixivPostTag], safe=True)
+            if self.fullTextIndex.createIfNotExists():
+                print("已创建全文索引")
+
+    def mergeDuplicateRows(self):
+        """ 建立唯一约束之前合并旧数据库中重复的帖子与图片行 """
+        Util.mergeDuplicateRows(db, PixivPost, ['pixiv_post_id'], self.deletePosts, ['viewed'])
+        Util.mergeDuplicateRows(db, PixivImage, ['post', 'imageName'],
+                                lambda imageIds: PixivImage.delete().where(PixivImage.id.in_(imageIds)).execute())
+
+    def deletePosts(self, postIds):
+        PixivImage.delete().where(PixivImage.post.in_(postIds)).execute()
+        # 标签表与全文索引不存在时随后创建
+        if PixivPostTag.table_exists():
+            PixivPostTag.delete().where(PixivPostTag.post.in_(postIds)).execute()
+        if self.fullTextIndex.exists():
+            self.fullTextIndex.deleteRows(postIds)
+        PixivPost.delete().where(PixivPost.id.in_(postIds)).execute()
+
+    def writePixivDataToDatabase(self, fullScan: bool = False, workerNumber: int = None):
+        """
+        fullScan 为 True 时忽略扫描清单，重新检查所有艺术家目录。
+        workerNumber 大于 1 时由进程池并行解析 JSON，本进程只负责写入数据库。
+        """
         if db is None:
             print("数据库初始化失败")
             return
@@ -115,17 +472,186 @@ class PixivSyncer:
             return
         print(f"发现 {len(artistsFolderName)} 位艺术家")
 
-        for i, artistFolderName in enumerate(artistsFolderName):
-            print(f'{artistFolderName}: ', flush=True, end='')
-            with db.atomic() as transaction:
-                self.handleOneArtist(artistFolderName)
-            print('', flush=True)
-
+        # 每次同步使用新的解析缓存
+        self.parsedPostCache = ParsedPostCache()
+
+        skippedArtistNumber = 0
+        artistsToSync = []
+        with metrics.stage('scan'):
+            for i, artistFolderName in enumerate(artistsFolderName):
+                artistDirPath = os.path.join(Config.PIXIV_BASEPATH, artistFolderName)
+                if fullScan:
+                    dirSnapshot = self.scanManifest.takeSnapshot(artistDirPath)
+                else:
+                    unchanged, dirSnapshot = self.scanManifest.check(artistFolderName, artistDirPath)
+                    if unchanged:
+                        skippedArtistNumber += 1
+                        continue
+                artistsToSync.append((artistFolderName, dirSnapshot))
+        metrics.count('skipped_artists', skippedArtistNumber)
+
+        pipeline = ParsePipeline(scanPixivArtist, workerNumber or Config.PARSE_WORKER_NUMBER)
+        # 串行时不预先解析，无需查询
+        tasks = ((os.path.join(Config.PIXIV_BASEPATH, artistFolderName),
+                  self.getKnownPostsFolderName(artistFolderName) if pipeline.workerNumber > 1 else frozenset())
+                 for artistFolderName, _ in artistsToSync)
+        for (artistFolderName, dirSnapshot), (_, prescan, workerMetrics) in zip(artistsToSync, pipeline.run(tasks)):
+            self.syncOneArtist(artistFolderName, dirSnapshot, prescan, workerMetrics)
+
+        if skippedArtistNumber:
+            print(f"跳过 {skippedArtistNumber} 位目录未变化的艺术家")
+        print(self.parsedPostCache.summary())
+        Util.checkpointDatabase(db)
         print("数据处理完成")
 
+    def getKnownPostsFolderName(self, artistFolderName: str):
+        """ 一次查询取出该艺术家目录已入库的帖子目录名，交给解析进程跳过 """
+        with metrics.stage('query'):
+            return {postFolderName for postFolderName, in PixivPost.select(PixivPost.postFolderName).join(PixivArtist).where(
+                PixivArtist.artistFolderName == artistFolderName
+            ).tuples()}
+
+    def reconcile(self, dryRun: bool = False, checkFiles: bool = False, reportFile=None):
+        """ 删除磁盘上已不存在的艺术家目录、帖子目录与图片对应的行，返回各表清理的行数 """
+        reconciler = Reconciler(db, Config.PIXIV_BASEPATH, PixivArtist.artistFolderName, PixivPost.postFolderName,
+                                PixivImage.imageName, PixivScanManifest, self.fullTextIndex)
+        return reconciler.run(dryRun, checkFiles, reportFile)
+
+    def backfillTags(self):
+        """ 为标签表加入之前入库的帖子补写标签：只读取还没有标签行的帖子的 JSON """
+        with metrics.stage('query'):
+            posts = list(PixivPost.select(PixivPost.id, PixivArtist.artistFolderName, PixivPost.postFolderName).join(
+                PixivArtist
+            ).where(
+                PixivPost.id.not_in(PixivPostTag.select(PixivPostTag.post))
+            ).order_by(PixivArtist.artistFolderName).tuples())
+        print(f"{len(posts)} 个帖子没有标签")
+
+        postIds = []
+        tagsOfPosts = []
+        try:
+            with BoundedTransaction(db) as transaction:
+                for postId, artistFolderName, postFolderName in posts:
+                    postDirPath = os.path.join(Config.PIXIV_BASEPATH, artistFolderName, postFolderName)
+                    try:
+                        with metrics.stage('scan'):
+                            jsonFilesName = Util.scanDirectory(postDirPath).filesNameWithExtension('.json')
+                        if len(jsonFilesName) != 1:
+                            print(f"跳过没有或有多个json文件的帖子: {postDirPath}")
+                            continue
+                        parsedPost = parsePixivPost(os.path.join(postDirPath, jsonFilesName[0]))
+                    except Exception as e:
+                        print(f"打开或解析 JSON 文件失败: {postDirPath} - {e}")
+                        metrics.count('errors')
+                        continue
+                    if not parsedPost.tags:
+                        continue
+
+                    postIds.append(postId)
+                    tagsOfPosts.append(parsedPost.tags)
+                    if len(postIds) >= PixivTagWriter.BATCH_SIZE:
+                        transaction.addRows(self.tagWriter(postIds, None, tagsOfPosts))
+                        postIds, tagsOfPosts = [], []
+                if postIds:
+                    transaction.addRows(self.tagWriter(postIds, None, tagsOfPosts))
+        except BaseException:
+            self.tagWriter.reset()
+            raise
+        Util.checkpointDatabase(db)
+
+    def refreshCounts(self, workerNumber: int = None):
+        """
+        下载器重写 JSON 后，更新已入库帖子的收藏数、点赞数、评论数与浏览数。
+
+        只解析 mtime 与 metaMtime 不同的 JSON（之前的版本入库的帖子第一次全部解析），以
+        INSERT ... ON CONFLICT(pixiv_post_id) DO UPDATE 分批写入，只覆盖 REFRESHED_FIELDS，viewed 等其他列保持不变。
+        只处理已入库的帖子，新帖子仍由同步写入（需要同时写入图片与标签）。
+        """
+        with metrics.stage('query'):
+            postsOfArtist = defaultdict(dict)
+            for pixivPostId, artistId, artistFolderName, postFolderName, metaMtime in PixivPost.select(
+                PixivPost.pixiv_post_id, PixivPost.artist, PixivArtist.artistFolderName, PixivPost.postFolderName, PixivPost.metaMtime
+            ).join(PixivArtist).tuples():
+                postsOfArtist[artistFolderName][postFolderName] = (pixivPostId, artistId, metaMtime)
+        print(f"检查 {len(postsOfArtist)} 位艺术家的帖子")
+
+        refreshFields = [getattr(PixivPost, fieldName) for fieldName in self.REFRESHED_FIELDS]
+        chunkSize = max(1, min(Config.BULK_INSERT_BATCH_SIZE,
+                               BatchInserter.getMaxVariableNumber() // len(PixivPost._meta.sorted_fields)))
+        refreshedNumber = 0
+        pipeline = ParsePipeline(readChangedPixivPosts, workerNumber or Config.PARSE_WORKER_NUMBER)
+        tasks = ((os.path.join(Config.PIXIV_BASEPATH, artistFolderName),
+                  {postFolderName: post[2] for postFolderName, post in posts.items()})
+                 for artistFolderName, posts in postsOfArtist.items())
+        with BoundedTransaction(db) as transaction:
+            for (artistFolderName, posts), (task, parsedPosts, workerMetrics) in zip(postsOfArtist.items(), pipeline.run(tasks)):
+                metrics.merge(workerMetrics)
+                if parsedPosts is None:
+                    parsedPosts = readChangedPixivPosts(*task)
+                rows = []
+                for postFolderName, parsedPost in parsedPosts.items():
+                    if isinstance(parsedPost, str) or parsedPost.rowError is not None:
+                        print(f"解析 JSON 文件失败: {artistFolderName}/{postFolderName} - "
+                              f"{parsedPost if isinstance(parsedPost, str) else parsedPost.rowError}")
+                        metrics.count('errors')
+                        continue
+                    pixivPostId, artistId, _ = posts[postFolderName]
+                    # 目录被另一帖子占用时不更新，避免 ON CONFLICT 未命中而插入没有图片的帖子
+                    if str(parsedPost.illustId) != pixivPostId:
+                        continue
+                    rows.append({**parsedPost.postRow, 'artist': artistId})
+
+                with metrics.stage('insert'):
+                    for start in range(0, len(rows), chunkSize):
+                        PixivPost.insert_many(rows[start:start + chunkSize]).on_conflict(
+                            conflict_target=[PixivPost.pixiv_post_id], preserve=refreshFields
+                        ).execute()
+                transaction.addRows(len(rows))
+                refreshedNumber += len(rows)
+        metrics.count('refreshed_posts', refreshedNumber)
+        Util.checkpointDatabase(db)
+        print(f"已刷新 {refreshedNumber} 个帖子的计数")
+        return refreshedNumber
+
+    def syncOneArtist(self, artistFolderName: str, dirSnapshot=None, prescan=None, workerMetrics=None):
+        """
+        在有界事务中同步一位艺术家，完成后记录扫描清单；dirSnapshot 为 None 时现在读取目录快照。
+        prescan 与 workerMetrics 为解析进程返回的结果及其阶段耗时与计数
+        """
+        if dirSnapshot is None:
+            dirSnapshot = self.scanManifest.takeSnapshot(os.path.join(Config.PIXIV_BASEPATH, artistFolderName))
+
+        print(f'{artistFolderName}: ', flush=True, end='')
+        self.prescan = prescan
+        self.artistIndex = prescan[0] if prescan is not None else None
+        self.skippedPostPaths = set()
+        try:
+            with metrics.artist(artistFolderName), BoundedTransaction(db) as transaction:
+                metrics.merge(workerMetrics)
+                self.batchInserter.transaction = transaction
+                self.handleOneArtist(artistFolderName)
+                self.batchInserter.flush()
+                # 之后写入帖子目录的 JSON 不会改变艺术家目录的指纹，有帖子被跳过时不记录，下次同步仍检查该目录
+                if self.skippedPostPaths:
+                    print(f' ({len(self.skippedPostPaths)} 个帖子未能入库，下次同步重新检查)', flush=True, end='')
+                else:
+                    self.scanManifest.record(artistFolderName, dirSnapshot)
+        except BaseException:
+            self.tagWriter.reset()
+            raise
+        finally:
+            self.batchInserter.transaction = None
+            self.batchInserter.discard()
+            self.prescan = None
+            self.artistIndex = None
+        print('', flush=True)
+
     def handleOneArtist(self, artistFolderName: str):
         artistDirPath = os.path.join(Config.PIXIV_BASEPATH, artistFolderName)
-        postsFolderName = Util.getSubdirectoryNames(artistDirPath)
+        postsFolderName = self.listPostsFolderName(artistDirPath)
+        # 列举失败时同样不记录扫描清单
+        if postsFolderName is None:
+            self.skippedPostPaths.add(artistDirPath)
         # 没有帖子时跳过
         if not postsFolderName:
             return
@@ -133,10 +659,12 @@ class PixivSyncer:
         refPostJsonFilePath = self.findRefPostJsonFilePath(artistDirPath, postsFolderName)
         if not refPostJsonFilePath:
             print(f"未找到参考的 post.json 文件: {artistDirPath}")
+            self.skippedPostPaths.update(os.path.join(artistDirPath, postFolderName) for postFolderName in postsFolderName)
             return
         artistPixivId = self.getArtistPixivId(refPostJsonFilePath)
         if not artistPixivId:
             print(f"获取艺术家 Pixiv ID 失败: {refPostJsonFilePath}")
+            self.skippedPostPaths.add(os.path.dirname(refPostJsonFilePath))
             return
 
         artists_SQLObj = PixivArtist.select(PixivArtist).where(
@@ -150,21 +678,27 @@ class PixivSyncer:
         else:
             self.handleNewArtist(artistDirPath, refPostJsonFilePath)
 
+    def listPostsFolderName(self, artistDirPath: str):
+        if self.artistIndex is None:
+            try:
+                self.artistIndex = PixivArtistIndex(artistDirPath)
+            except OSError as e:
+                print(f"获取子目录失败: {e}")
+                return None
+        return self.artistIndex.postsFolderName
+
     def writeArtistDataToDatabase(self, refPostJsonFilePath: str):
-        try:
-            with open(refPostJsonFilePath, 'r', encoding='utf-8') as f:
-                jsonData = json.load(f)
-        except Exception as e:
-            print(f"打开 JSON 文件失败: {refPostJsonFilePath} - {e}")
+        parsedPost = self.loadParsedPost(refPostJsonFilePath)
+        if parsedPost is None:
             return None
 
         artistFolderName = os.path.basename(Path(refPostJsonFilePath).parent.parent.absolute())
         artistFolderPath = os.path.join(Config.PIXIV_BASEPATH, artistFolderName)
 
         artist_SQLObj = PixivArtist.create(
-            pixiv_artist_id=jsonData['userId'],
-            name=jsonData['userName'],
-            userAccount=jsonData['userAccount'],
+            pixiv_artist_id=parsedPost.userId,
+            name=parsedPost.userName,
+            userAccount=parsedPost.userAccount,
             artistFolderName=artistFolderName,
             avatarName=self.findFileName(artistFolderPath, 'avatar'),
             backgroundName=self.findFileName(artistFolderPath, 'background')
@@ -172,7 +706,8 @@ class PixivSyncer:
         return artist_SQLObj
 
     def findFileName(self, inputFolderPath: str, fileNameWithoutExt: str) -> str:
-        targetFilesName = sorted([f for f in os.listdir(inputFolderPath) if os.path.isfile(os.path.join(inputFolderPath, f)) and Path(f).stem == fileNameWithoutExt])
+        """ 在当前艺术家的列举索引中按文件名（不含扩展名）查找 """
+        targetFilesName = self.artistIndex.getArtistFilesName(fileNameWithoutExt)
         if len(targetFilesName) == 0:
             # print(f"WARNING: 在 {inputFolderPath} 中未找到名为 {fileNameWithoutExt} 的文件")
             return ""
@@ -184,13 +719,14 @@ class PixivSyncer:
 
     def handleNewArtist(self, artistDirPath: str, refPostJsonFilePath: str):
         newArtist_SQLObj = self.writeArtistDataToDatabase(refPostJsonFilePath)
-        postsFolderName = Util.getSubdirectoryNames(artistDirPath)
+        postsFolderName = self.listPostsFolderName(artistDirPath)
 
         for postFolderName in postsFolderName:
             postDirPath = os.path.join(artistDirPath, postFolderName)
             jsonFileName = self.getJsonFileName(postDirPath, '.json')
             if not jsonFileName:
                 print(f"跳过没有或有多个json文件的帖子: {postDirPath}")
+                self.skippedPostPaths.add(postDirPath)
                 continue
             jsonFilePath = os.path.join(postDirPath, jsonFileName)
 
@@ -198,23 +734,26 @@ class PixivSyncer:
             print('.', flush=True, end='')
 
     def handleExistedArtist(self, artist_SQLObj, artistDirPath: str):
-        posts_SQLObj = PixivPost.select().where(
-            PixivPost.artist == artist_SQLObj
-        ).order_by(PixivPost.post_date.desc())
-
-        if not posts_SQLObj:
-            print(f"艺术家 {artist_SQLObj.name} 没有帖子，跳过")
-            return
+        if Config.INGESTED_DETECTION_MODE == 'set':
+            postsFolderName_notProcessed = self.getNotProcessedPostsFolderNameBySet(artist_SQLObj, artistDirPath)
+        else:
+            posts_SQLObj = PixivPost.select().where(
+                PixivPost.artist == artist_SQLObj
+            ).order_by(PixivPost.post_date.desc())
 
-        latestDateTimeInDb = datetime.datetime.strptime(posts_SQLObj.first().post_date.split('.')[0], '%Y-%m-%dT%H:%M:%S')
+            if not posts_SQLObj:
+                print(f"艺术家 {artist_SQLObj.name} 没有帖子，跳过")
+                return
 
-        postsFolderName_notProcessed = self.getNotProcessedPostsFolderName(artistDirPath, latestDateTimeInDb)
+            latestDateTimeInDb = datetime.datetime.strptime(posts_SQLObj.first().post_date.split('.')[0], '%Y-%m-%dT%H:%M:%S')
+            postsFolderName_notProcessed = self.getNotProcessedPostsFolderName(artistDirPath, latestDateTimeInDb)
 
         for postFolderName in postsFolderName_notProcessed:
             postDirPath = os.path.join(artistDirPath, postFolderName)
             jsonFileName = self.getJsonFileName(postDirPath, '.json')
             if not jsonFileName:
                 print(f"跳过没有或有多个json文件的帖子: {postDirPath}")
+                self.skippedPostPaths.add(postDirPath)
                 continue
             jsonFilePath = os.path.join(postDirPath, jsonFileName)
 
@@ -224,131 +763,99 @@ class PixivSyncer:
         if not postsFolderName_notProcessed:
             print('(No new posts)', flush=True, end='')
 
-    def getNotProcessedPostsFolderName(self, artistDirPath: str, latestDateTimeInDb):
+    def getNotProcessedPostsFolderNameBySet(self, artist_SQLObj, artistDirPath: str):
+        """
+        一次查询取出该艺术家已入库的作品 ID 与目录名，与目录列表求差集。
+
+        目录名已入库的帖子不再读取 JSON；只有目录名未知的帖子才解析 JSON，
+        并用作品 ID 排除被重命名过的目录。不依赖日期，补下载的旧作品也能被发现。
+        """
+        knownIllustIds = set()
+        knownPostsFolderName = set()
+        for pixivPostId, postFolderName in PixivPost.select(PixivPost.pixiv_post_id, PixivPost.postFolderName).where(
+            PixivPost.artist == artist_SQLObj
+        ).tuples():
+            knownIllustIds.add(pixivPostId)
+            knownPostsFolderName.add(postFolderName)
+
         notProcessedPostsFolderName = []
+        for currentPostFolderName in self.listPostsFolderName(artistDirPath):
+            if currentPostFolderName in knownPostsFolderName:
+                continue
 
-        postsFolderName = Util.getSubdirectoryNames(artistDirPath)
-        for currentPostFolderName in postsFolderName:
-            currentPostDateTime = datetime.datetime.strptime(currentPostFolderName.split(']')[0].strip('['), '%Y-%m-%d')
+            postDirPath = os.path.join(artistDirPath, currentPostFolderName)
+            currentPostJsonFileName = self.getJsonFileName(postDirPath, '.json')
+            if not currentPostJsonFileName:
+                print(f"跳过没有或有多个json文件的帖子: {postDirPath}")
+                self.skippedPostPaths.add(postDirPath)
+                continue
 
-            if Util.checkYMDSmall(currentPostDateTime, latestDateTimeInDb):
+            parsedPost = self.loadParsedPost(os.path.join(postDirPath, currentPostJsonFileName))
+            if parsedPost is None or parsedPost.illustId in knownIllustIds:
                 continue
+            notProcessedPostsFolderName.append(currentPostFolderName)
 
-            if Util.checkYMDEqual(currentPostDateTime, latestDateTimeInDb):
-                postDirPath = os.path.join(artistDirPath, currentPostFolderName)
-                currentPostJsonFileName = self.getJsonFileName(postDirPath, '.json')
-                if not currentPostJsonFileName:
-                    print(f"跳过没有或有多个json文件的帖子: {postDirPath}")
-                    continue
-                currentPostJsonFilePath = os.path.join(postDirPath, currentPostJsonFileName)
-                try:
-                    with open(currentPostJsonFilePath, 'r', encoding='utf-8') as f:
-                        jsonData = json.load(f)
-                except Exception as e:
-                    print(f"打开或解析 JSON 文件失败: {currentPostJsonFilePath} - {e}")
-                    continue
-
-                post_SQLObj = PixivPost.select().where(PixivPost.pixiv_post_id == jsonData['illustId'])
-                if not post_SQLObj:
-                    notProcessedPostsFolderName.append(currentPostFolderName)
+        return notProcessedPostsFolderName
 
-            else:
+    def getNotProcessedPostsFolderName(self, artistDirPath: str, latestDateTimeInDb):
+        notProcessedPostsFolderName = []
+
+        postsFolderName = self.listPostsFolderName(artistDirPath)
+        for currentPostFolderName in postsFolderName:
+            currentPostDateTime = datetime.datetime.strptime(currentPostFolderName.split(']')[0].strip('['), '%Y-%m-%d')
+
+            # 与最新入库日期同一天的帖子可能已入库，写入时由唯一约束跳过
+            if not Util.checkYMDSmall(currentPostDateTime, latestDateTimeInDb):
                 notProcessedPostsFolderName.append(currentPostFolderName)
 
         return notProcessedPostsFolderName
 
     def handleOnePost(self, postFolderName: str, jsonFilePath: str, artist_SQLObj):
-        try:
-            with open(jsonFilePath, 'r', encoding='utf-8') as f:
-                jsonData = json.load(f)
-        except Exception as e:
-            print(f"打开或解析 JSON 文件失败: {jsonFilePath} - {e}")
+        parsedPost = self.loadParsedPost(jsonFilePath)
+        if parsedPost is None:
             return None
 
-        try:
-            imageNumber = jsonData['pageCount']
-
-            firstFileURL = jsonData['urls']['original']
-            if not firstFileURL:
-                raise ValueError("帖子缺少原始图片 URL")
-            firstFileName = os.path.basename(firstFileURL)
-
-            if jsonData['illustType'] == 2:
-                # Ugoira file
-                firstFileName_forPost = firstFileName.split("_ugoira0")[0] + '_ugoira1920x1080.ugoira'
-            else:
-                firstFileName_forPost = firstFileName
-
-
-            post = PixivPost.create(
-                pixiv_post_id=jsonData['illustId'],
-                artist=artist_SQLObj,
-                name=jsonData['illustTitle'],
-                comment=jsonData['illustComment'],
-                post_date=self.parseDate(jsonData['uploadDate']),
-                postFolderName=postFolderName,
-                coverName=firstFileName_forPost,
-                imageNumber=imageNumber,
-                bookmarkCount=jsonData['bookmarkCount'],
-                likeCount=jsonData['likeCount'],
-                commentCount=jsonData['commentCount'],
-                viewCount=jsonData['viewCount'],
-                xRestrict=jsonData['xRestrict'],
-                illustType=jsonData['illustType'],
-                isHowto=jsonData['isHowto'],
-                isOriginal=jsonData['isOriginal'],
-                aiType=jsonData['aiType']
-            )
-
-
-            if jsonData['illustType'] == 2:
-                # Ugoira file
-                imageFileName = firstFileName.split("_ugoira0")[0] + '_ugoira1920x1080.ugoira'
-                PixivImage.create(
-                    post=post,
-                    imageName=imageFileName
-                )
-            else:
-                for i in range(imageNumber):
-                    imageFileName = firstFileName.replace('_p0', '_p{}'.format(i))
-                    PixivImage.create(
-                        post=post,
-                        imageName=imageFileName
-                    )
-        except Exception as e:
-            print(f"处理帖子失败: {postFolderName} - {e}")
+        if parsedPost.rowError is not None:
+            print(f"处理帖子失败: {postFolderName} - {parsedPost.rowError}")
+            metrics.count('errors')
+            self.skippedPostPaths.add(os.path.dirname(jsonFilePath))
+            return None
 
-    def getPlusOrMinus(self, date_str):
-        if '+' in date_str:
-            return '+'
-        elif '-' in date_str:
-            return '-'
+        # 只记录缺页数，图片行仍按 pageCount 写入，下载补全后无需重新同步
+        if parsedPost.postRow['illustType'] != 2:
+            pageNumbers = self.artistIndex.getPageNumbers(postFolderName, str(parsedPost.illustId))
+            missingPageNumber = sum(1 for i in range(parsedPost.postRow['imageNumber']) if i not in pageNumbers)
+            if missingPageNumber:
+                metrics.count('missing_pages', missingPageNumber)
+
+        postDirPath = os.path.join(self.artistIndex.artistDirPath, postFolderName)
+        imageRows = [self.imageProber.submit(dict(imageRow), os.path.join(postDirPath, imageRow['imageName']))
+                     for imageRow in parsedPost.imageRows]
+        self.batchInserter.addPost({**parsedPost.postRow, 'artist': artist_SQLObj.id}, imageRows, parsedPost.tags)
+
+    def loadParsedPost(self, jsonFilePath: str):
+        """ 优先使用解析进程的结果，否则经解析缓存读取 JSON；失败时返回 None """
+        if self.prescan is not None and jsonFilePath in self.prescan[1]:
+            parsedPost = self.prescan[1][jsonFilePath]
         else:
-            raise ValueError("日期字符串格式错误，必须包含 '+' 或 '-' 符号")
-
-    def parseDate(self, date_str):
-        plusOrMinus = self.getPlusOrMinus(date_str)
+            parsedPost = self.parsedPostCache.get(jsonFilePath, parsePixivPost, jsonFilePath)
 
-        timeDeltaInHour = int(date_str.split(plusOrMinus)[1].split(':')[0])
-        datetimeStr = date_str.split(plusOrMinus)[0]
-        datetimeObj = datetime.datetime.strptime(datetimeStr, '%Y-%m-%dT%H:%M:%S')
-        if plusOrMinus == '+':
-            datetimeObj -= datetime.timedelta(hours=timeDeltaInHour)
-        else:
-            datetimeObj += datetime.timedelta(hours=timeDeltaInHour)
-        return datetimeObj.strftime('%Y-%m-%dT%H:%M:%S') + '.000'
+        if isinstance(parsedPost, str):
+            print(f"打开或解析 JSON 文件失败: {jsonFilePath} - {parsedPost}")
+            metrics.count('errors')
+            self.skippedPostPaths.add(os.path.dirname(jsonFilePath))
+            return None
+        return parsedPost
 
     def getArtistPixivId(self, refPostJsonFilePath: str):
-        try:
-            with open(refPostJsonFilePath, 'r', encoding='utf-8') as f:
-                jsonData = json.load(f)
-            return jsonData['userId']
-        except Exception as e:
-            print(f"打开或解析 JSON 文件失败: {refPostJsonFilePath} - {e}")
+        parsedPost = self.loadParsedPost(refPostJsonFilePath)
+        if parsedPost is None:
             return None
+        return parsedPost.userId
 
     def getJsonFileName(self, inputDirPath: str, extension: str):
-        jsonFilesName = sorted([f for f in os.listdir(inputDirPath) if f.endswith(extension) and os.path.isfile(os.path.join(inputDirPath, f))])
+        """ inputDirPath 为当前艺术家的帖子目录，从列举索引中查找 """
+        jsonFilesName = self.artistIndex.getPostListing(os.path.basename(inputDirPath)).filesNameWithExtension(extension)
         if len(jsonFilesName) != 1:
             print(f"ERROR: 在 {inputDirPath} 中找到多个 JSON 文件: {jsonFilesName}")
             return None
@@ -367,8 +874,29 @@ class PixivSyncer:
         return None
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='将 Pixiv 下载目录同步到数据库')
+    parser.add_argument('--full', action='store_true', help='忽略扫描清单，重新检查所有艺术家目录')
+    parser.add_argument('--workers', type=int, default=None, help='并行解析 JSON 的进程数，默认使用 Config 中的设置')
+    parser.add_argument('--backfill-tags', action='store_true', help='不同步，只为已入库但没有标签的帖子补写标签')
+    parser.add_argument('--refresh-counts', action='store_true', help='不同步，只为 JSON 被重写的已入库帖子更新收藏数等计数')
+    parser.add_argument('--rebuild-fts', action='store_true', help='不同步，只由帖子表重建全文索引')
+    parser.add_argument('--backfill-image-info', action='store_true', help='不同步，只为尚未记录尺寸的图片读取文件头并写入')
+    SyncMetrics.addArguments(parser)
+    args = parser.parse_args()
+
+    metrics.startFromArgs('pixiv', args)
     syncer = PixivSyncer()
-    syncer.writePixivDataToDatabase()
+    if args.backfill_tags:
+        syncer.backfillTags()
+    elif args.refresh_counts:
+        syncer.refreshCounts(workerNumber=args.workers)
+    elif args.rebuild_fts:
+        print(f"已重建全文索引，共 {syncer.fullTextIndex.rebuild()} 条")
+    elif args.backfill_image_info:
+        syncer.imageProber.backfill(db, iterImageFiles)
+    else:
+        syncer.writePixivDataToDatabase(fullScan=args.full, workerNumber=args.workers)
+    metrics.finish()
     db.close()
     print("Pixiv 数据同步完成")
 
@@ -0,0 +1,49 @@
+""" 此文件用于清理数据库中磁盘上已被删除或移走的内容 """
+import argparse
+import contextlib
+import importlib
+
+from SyncMetrics import SyncMetrics, metrics
+
+# 来源名 -> (模块名, 同步类名)
+SOURCES = {
+    'kemono': ('kemono_sync', 'KemonoSyncer'),
+    'pixiv': ('pixiv_sync', 'PixivSyncer'),
+    'twitter': ('twitter_sync', 'TwitterSyncer'),
+}
+
+
+def reconcileSources(sources, dryRun: bool = False, checkFiles: bool = False, reportFile=None):
+    """ 依次清理各来源，返回 {来源: Counter}；只导入选中的来源，未选中的来源不会打开数据库 """
+    results = {}
+    for source in sources:
+        moduleName, className = SOURCES[source]
+        print(f"[{source}] 对比数据库与下载目录")
+        syncer = getattr(importlib.import_module(moduleName), className)()
+        results[source] = syncer.reconcile(dryRun, checkFiles, reportFile)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='删除数据库中磁盘上已不存在的艺术家、帖子与图片对应的行')
+    parser.add_argument('sources', nargs='*', metavar='SOURCE', help=f'要清理的来源（{", ".join(SOURCES)}），默认全部')
+    parser.add_argument('--dry-run', action='store_true', help='只报告将被删除的行数，不修改数据库')
+    parser.add_argument('--check-files', action='store_true',
+                        help='同时列举帖子目录，删除磁盘上不存在的图片文件对应的行（包括未下载的附件，同步不会重新写入，建议先 --dry-run）')
+    parser.add_argument('--report', default=None, metavar='PATH', help='将每个被清理的艺术家、帖子与图片的路径写入该文件')
+    SyncMetrics.addArguments(parser)
+    args = parser.parse_args()
+
+    unknownSources = [source for source in args.sources if source not in SOURCES]
+    if unknownSources:
+        parser.error(f'未知的来源: {", ".join(unknownSources)}')
+
+    metrics.startFromArgs('reconcile', args)
+    with contextlib.ExitStack() as stack:
+        reportFile = stack.enter_context(open(args.report, 'w', encoding='utf-8')) if args.report else None
+        results = reconcileSources(dict.fromkeys(args.sources or SOURCES), args.dry_run, args.check_files, reportFile)
+    metrics.finish()
+
+    verb = '将删除' if args.dry_run else '已删除'
+    for source, counters in results.items():
+        print(f"[{source}] {verb} 艺术家 {counters['artists']}, 帖子 {counters['posts']}, 图片 {counters['images']}")
@@ -0,0 +1,54 @@
+""" 此文件用于在各来源的全文索引中搜索帖子标题、正文与推文内容 """
+import argparse
+import importlib
+import time
+
+from Util import Util
+
+# 来源名 -> (模块名, 帖子模型名, 显示的字段名)
+SOURCES = {
+    'kemono': ('kemono_sync', 'KemonoPost', 'name'),
+    'pixiv': ('pixiv_sync', 'PixivPost', 'name'),
+    'twitter': ('twitter_sync', 'TwitterPost', 'content'),
+}
+
+
+def searchSource(source: str, keyword: str, limit: int):
+    """
+    返回 (耗时秒数, [(帖子主键, 显示文本)])，结果保持索引返回的顺序；数据库或全文索引尚未建立时返回 None。
+    直接使用同步模块的 db 与全文索引，不构造同步类，因此不会创建数据库文件或执行迁移
+    """
+    moduleName, modelName, fieldName = SOURCES[source]
+    module = importlib.import_module(moduleName)
+    model = getattr(module, modelName)
+    if not Util.isSchemaReady(module.db, [model]) or not module.fullTextIndex.exists():
+        return None
+
+    startTime = time.perf_counter()
+    postIds = module.fullTextIndex.search(keyword, limit)
+    elapsed = time.perf_counter() - startTime
+
+    texts = dict(model.select(model.id, getattr(model, fieldName)).where(model.id.in_(postIds)).tuples()) if postIds else {}
+    return elapsed, [(postId, texts.get(postId, '')) for postId in postIds]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='在全文索引中搜索帖子（旧数据库请先执行同步脚本的 --rebuild-fts）')
+    parser.add_argument('keyword', help='关键词；少于 3 个字符时无法使用 trigram 索引，会扫描整个索引表')
+    parser.add_argument('sources', nargs='*', metavar='SOURCE', help=f'要搜索的来源（{", ".join(SOURCES)}），默认全部')
+    parser.add_argument('--limit', type=int, default=20, help='每个来源最多显示的结果数')
+    args = parser.parse_args()
+
+    unknownSources = [source for source in args.sources if source not in SOURCES]
+    if unknownSources:
+        parser.error(f'未知的来源: {", ".join(unknownSources)}')
+
+    for source in dict.fromkeys(args.sources or SOURCES):
+        searchResult = searchSource(source, args.keyword, args.limit)
+        if searchResult is None:
+            print(f"[{source}] 数据库或全文索引尚未建立，请先执行同步脚本")
+            continue
+        elapsed, results = searchResult
+        print(f"[{source}] {len(results)} 条结果，耗时 {elapsed * 1000:.1f}ms")
+        for postId, text in results:
+            print(f"  {postId}\t{' '.join(text.split())[:80]}")
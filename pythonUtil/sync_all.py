@@ -0,0 +1,141 @@
+""" 此文件用于同时运行 Kemono、Pixiv、Twitter 的同步脚本（每个来源一个子进程，各自写入自己的数据库） """
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 来源名 -> 同步脚本文件名、是否支持 --workers
+SOURCES = {
+    'kemono': ('kemono_sync.py', True),
+    'pixiv': ('pixiv_sync.py', True),
+    'twitter': ('twitter_sync.py', False),
+}
+
+
+class SyncRunner:
+    """ 以子进程运行各来源的同步脚本，输出按行加上来源前缀后汇总到当前终端 """
+
+    def __init__(self, fullScan: bool = False, workerNumbers: dict = None, statusInterval: float = 30):
+        self.fullScan = fullScan
+        self.workerNumbers = workerNumbers or {}
+        self.statusInterval = statusInterval
+        self.printLock = threading.Lock()
+        # 来源名 -> [状态, 开始时间, 已输出的行数]；同步脚本大致每处理完一位艺术家输出一行
+        self.progress = {}
+
+    def buildCommand(self, source: str):
+        scriptName, supportsWorkers = SOURCES[source]
+        command = [sys.executable, '-u', os.path.join(os.path.dirname(os.path.abspath(__file__)), scriptName)]
+        if self.fullScan:
+            command.append('--full')
+        if supportsWorkers and self.workerNumbers.get(source):
+            command += ['--workers', str(self.workerNumbers[source])]
+        return command
+
+    def log(self, source: str, message: str):
+        with self.printLock:
+            print(f'[{source}] {message}', flush=True)
+
+    def runOne(self, source: str):
+        """ 运行一个来源，返回 (退出码, 耗时秒数) """
+        startTime = time.monotonic()
+        self.progress[source] = ['运行中', startTime, 0]
+        self.log(source, '开始同步')
+        try:
+            process = subprocess.Popen(
+                self.buildCommand(source),
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding='utf-8',
+                errors='replace',
+                env={**os.environ, 'PYTHONIOENCODING': 'utf-8'},
+            )
+        except OSError as e:
+            self.log(source, f'启动失败: {e}')
+            self.progress[source][0] = '失败'
+            return 1, time.monotonic() - startTime
+
+        for line in process.stdout:
+            self.progress[source][2] += 1
+            self.log(source, line.rstrip('\n'))
+        returnCode = process.wait()
+        self.progress[source][0] = '完成' if returnCode == 0 else '失败'
+
+        elapsed = time.monotonic() - startTime
+        self.log(source, f'结束，退出码 {returnCode}，耗时 {elapsed:.1f}s')
+        return returnCode, elapsed
+
+    def run(self, sources, jobNumber: int = None):
+        """ 最多同时运行 jobNumber 个来源，返回 {来源名: (退出码, 耗时秒数)} """
+        jobNumber = jobNumber or len(sources)
+        finished = threading.Event()
+        statusThread = threading.Thread(target=self.reportStatus, args=(sources, finished), daemon=True)
+        statusThread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, jobNumber)) as executor:
+                futures = {source: executor.submit(self.runOne, source) for source in sources}
+                return {source: future.result() for source, future in futures.items()}
+        finally:
+            finished.set()
+            statusThread.join()
+
+    def reportStatus(self, sources, finished):
+        """ 每隔 statusInterval 秒输出一行所有来源的汇总进度 """
+        if self.statusInterval <= 0:
+            return
+        while not finished.wait(self.statusInterval):
+            now = time.monotonic()
+            parts = []
+            for source in sources:
+                if source not in self.progress:
+                    parts.append(f'{source} 等待中')
+                    continue
+                state, startTime, lineNumber = self.progress[source]
+                parts.append(f'{source} {state} {lineNumber} 行 {now - startTime:.0f}s')
+            self.log('状态', ', '.join(parts))
+
+
+def parseWorkerNumbers(values):
+    """ 解析形如 kemono=4 的参数 """
+    workerNumbers = {}
+    for value in values or []:
+        source, _, number = value.partition('=')
+        if source not in SOURCES or not SOURCES[source][1] or not number.isdigit():
+            raise argparse.ArgumentTypeError(f'无效的 --workers 参数: {value}')
+        workerNumbers[source] = int(number)
+    return workerNumbers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='并行同步 Kemono、Pixiv、Twitter 下载目录到各自的数据库')
+    parser.add_argument('sources', nargs='*', metavar='SOURCE', help=f'要同步的来源（{", ".join(SOURCES)}），默认全部')
+    parser.add_argument('--full', action='store_true', help='忽略扫描清单，重新检查所有艺术家目录')
+    parser.add_argument('--jobs', type=int, default=None, help='最多同时运行的来源数，默认全部同时运行')
+    parser.add_argument('--workers', action='append', metavar='SOURCE=N',
+                        help='某个来源并行解析 JSON 的进程数，例如 --workers kemono=4 --workers pixiv=2')
+    parser.add_argument('--status-interval', type=float, default=30, help='汇总进度的输出间隔（秒），0 表示不输出')
+    args = parser.parse_args()
+
+    unknownSources = [source for source in args.sources if source not in SOURCES]
+    if unknownSources:
+        parser.error(f'未知的来源: {", ".join(unknownSources)}')
+
+    try:
+        workerNumbers = parseWorkerNumbers(args.workers)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    sources = list(dict.fromkeys(args.sources or SOURCES))
+    startTime = time.monotonic()
+    runner = SyncRunner(fullScan=args.full, workerNumbers=workerNumbers, statusInterval=args.status_interval)
+    results = runner.run(sources, args.jobs)
+
+    print(f'全部结束，总耗时 {time.monotonic() - startTime:.1f}s')
+    for source, (returnCode, elapsed) in results.items():
+        print(f'  {source}: {"成功" if returnCode == 0 else f"失败 (退出码 {returnCode})"}, {elapsed:.1f}s')
+    sys.exit(0 if all(returnCode == 0 for returnCode, _ in results.values()) else 1)
@@ -0,0 +1,228 @@
+""" 此文件用于持续监视下载目录，在新内容写入后只同步发生变化的艺术家 """
+import argparse
+import importlib
+import os
+import threading
+import time
+
+from filePathConfig import Config
+from Util import Util
+
+# watchdog 为可选依赖：macOS 上使用 FSEvents，Linux 上使用 inotify，Windows 上使用 ReadDirectoryChangesW
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# 来源名 -> (Config 中的下载目录属性, 模块名, 同步类名, 完整同步的方法名)
+SOURCES = {
+    'kemono': ('KEMONO_BASEPATH', 'kemono_sync', 'KemonoSyncer', 'writeKemonoDataToDatabase'),
+    'pixiv': ('PIXIV_BASEPATH', 'pixiv_sync', 'PixivSyncer', 'writePixivDataToDatabase'),
+    'twitter': ('TWITTER_BASEPATH', 'twitter_sync', 'TwitterSyncer', 'startSync'),
+}
+
+
+class ChangedArtists:
+    """ 记录发生变化的 (来源, 艺术家目录名) 及其最后一次变化的时间，供去抖动使用；可在多个线程中调用 """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lastChangeTimes = {}
+
+    def mark(self, source: str, artistName: str):
+        with self.lock:
+            self.lastChangeTimes[(source, artistName)] = time.monotonic()
+
+    def popSettled(self, debounceSeconds: float):
+        """ 取出最后一次变化已超过 debounceSeconds 秒的艺术家 """
+        now = time.monotonic()
+        with self.lock:
+            settled = [key for key, changeTime in self.lastChangeTimes.items() if now - changeTime >= debounceSeconds]
+            for key in settled:
+                del self.lastChangeTimes[key]
+        return sorted(settled)
+
+
+class ArchiveEventHandler(FileSystemEventHandler):
+    """ 把文件系统事件的路径映射为所属的艺术家目录 """
+
+    def __init__(self, source: str, basePath: str, changedArtists: ChangedArtists):
+        super().__init__()
+        self.source = source
+        self.basePath = os.path.abspath(basePath)
+        self.changedArtists = changedArtists
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            artistName = self.getArtistName(path)
+            if artistName:
+                self.changedArtists.mark(self.source, artistName)
+
+    def getArtistName(self, path):
+        if not path:
+            return None
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        relativePath = os.path.relpath(os.path.abspath(path), self.basePath)
+        if relativePath == '.' or relativePath.startswith('..'):
+            return None
+        return relativePath.split(os.sep)[0]
+
+
+class SyncWatcher:
+    """
+    监视各来源的下载目录，把变化的艺术家交给对应同步类的 syncOneArtist()。
+
+    有 watchdog 时使用系统的文件变化通知；否则（或指定 polling 时）定期列举下载目录，
+    比较每位艺术家目录及其中各帖子目录的 mtime（Twitter 比较艺术家目录的 mtime 与其中 CSV 文件的大小与 mtime），
+    每次轮询每位艺术家列举一次目录，并为每个帖子目录 stat 一次。
+    向已有帖子目录写入新文件（例如帖子目录先于 post.json 创建）或以改名方式替换文件会改变帖子目录的 mtime，可以被发现；
+    原地改写已有文件不会改变任何目录的 mtime，轮询无法发现，需要文件系统通知或下次完整同步。
+
+    每轮同步结束后清空各同步类的解析缓存，长期运行时缓存不会跨轮累积。
+    """
+
+    def __init__(self, sources, polling: bool = False, debounceSeconds: float = None, pollIntervalSeconds: float = None):
+        self.sources = list(sources)
+        self.polling = polling or Observer is None
+        self.debounceSeconds = Config.WATCH_DEBOUNCE_SECONDS if debounceSeconds is None else debounceSeconds
+        self.pollIntervalSeconds = pollIntervalSeconds or Config.WATCH_POLL_INTERVAL_SECONDS
+
+        self.changedArtists = ChangedArtists()
+        self.syncers = {}
+        self.databases = {}
+        self.signatures = {}  # 轮询模式下 来源 -> {艺术家目录名: 签名}
+
+    def getBasePath(self, source: str):
+        return getattr(Config, SOURCES[source][0])
+
+    def loadSyncers(self):
+        """ 只导入选中的来源，未选中的来源不会打开数据库 """
+        for source in self.sources:
+            _, moduleName, className, _ = SOURCES[source]
+            module = importlib.import_module(moduleName)
+            self.syncers[source] = getattr(module, className)()
+            self.databases[source] = module.db
+
+    def syncAll(self):
+        """ 开始监视前先按扫描清单补齐上次运行之后的变化 """
+        for source in self.sources:
+            print(f"[{source}] 同步上次运行之后的变化")
+            getattr(self.syncers[source], SOURCES[source][3])()
+
+    def syncArtist(self, source: str, artistName: str):
+        artistDirPath = os.path.join(self.getBasePath(source), artistName)
+        if not os.path.isdir(artistDirPath):
+            return
+        print(f"[{source}] ", flush=True, end='')
+        try:
+            self.syncers[source].syncOneArtist(artistName)
+        except Exception as e:
+            # 监视模式需要长期运行，单位艺术家失败时只报告错误
+            print(f"\n[{source}] 同步 {artistName} 失败: {e}")
+
+    def clearParsedPostCaches(self):
+        """ 完整同步每次新建解析缓存，监视模式只调用 syncOneArtist()，需要在每轮之后自行清空 """
+        for syncer in self.syncers.values():
+            parsedPostCache = getattr(syncer, 'parsedPostCache', None)
+            if parsedPostCache is not None:
+                parsedPostCache.clear()
+
+    def getSignature(self, source: str, entry):
+        childStats = []
+        with os.scandir(entry.path) as childEntries:
+            for childEntry in childEntries:
+                if source == 'twitter':
+                    # Twitter 的 CSV 是原地追加的，艺术家目录的 mtime 不会变化
+                    if childEntry.name.endswith('.csv'):
+                        stat = childEntry.stat()
+                        childStats.append((childEntry.name, stat.st_size, stat.st_mtime_ns))
+                elif childEntry.is_dir():
+                    # 帖子目录中新写入的文件只改变帖子目录的 mtime
+                    childStats.append((childEntry.name, childEntry.stat().st_mtime_ns))
+        return entry.stat().st_mtime_ns, tuple(sorted(childStats))
+
+    def poll(self):
+        for source in self.sources:
+            previousSignatures = self.signatures.get(source)
+            currentSignatures = {}
+            try:
+                with os.scandir(self.getBasePath(source)) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            currentSignatures[entry.name] = self.getSignature(source, entry)
+            except OSError as e:
+                print(f"[{source}] 列举目录失败: {e}")
+                continue
+
+            self.signatures[source] = currentSignatures
+            if previousSignatures is None:
+                continue
+            for artistName, signature in currentSignatures.items():
+                if previousSignatures.get(artistName) != signature:
+                    self.changedArtists.mark(source, artistName)
+
+    def startObserver(self):
+        observer = Observer()
+        for source in self.sources:
+            handler = ArchiveEventHandler(source, self.getBasePath(source), self.changedArtists)
+            observer.schedule(handler, self.getBasePath(source), recursive=True)
+        observer.start()
+        return observer
+
+    def run(self, initialSync: bool = True):
+        self.loadSyncers()
+        if initialSync:
+            self.syncAll()
+
+        observer = None
+        if self.polling:
+            print(f"使用轮询监视下载目录，间隔 {self.pollIntervalSeconds}s")
+            self.poll()
+        else:
+            observer = self.startObserver()
+            print("使用文件系统通知监视下载目录")
+
+        lastPollTime = time.monotonic()
+        try:
+            while True:
+                time.sleep(min(1.0, max(0.1, self.debounceSeconds)))
+                if self.polling and time.monotonic() - lastPollTime >= self.pollIntervalSeconds:
+                    self.poll()
+                    lastPollTime = time.monotonic()
+                settledArtists = self.changedArtists.popSettled(self.debounceSeconds)
+                for source, artistName in settledArtists:
+                    self.syncArtist(source, artistName)
+                if settledArtists:
+                    self.clearParsedPostCaches()
+        except KeyboardInterrupt:
+            print("停止监视")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            for db in self.databases.values():
+                Util.checkpointDatabase(db)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='监视下载目录，新内容写入后自动同步到数据库')
+    parser.add_argument('sources', nargs='*', metavar='SOURCE', help=f'要监视的来源（{", ".join(SOURCES)}），默认全部')
+    parser.add_argument('--polling', action='store_true', help='强制使用轮询（下载目录位于网络卷时使用）')
+    parser.add_argument('--debounce', type=float, default=None, help='目录最后一次变化后等待的秒数，默认使用 Config 中的设置')
+    parser.add_argument('--interval', type=float, default=None, help='轮询间隔（秒），默认使用 Config 中的设置')
+    parser.add_argument('--no-initial-sync', action='store_true', help='启动时不先同步上次运行之后的变化')
+    args = parser.parse_args()
+
+    unknownSources = [source for source in args.sources if source not in SOURCES]
+    if unknownSources:
+        parser.error(f'未知的来源: {", ".join(unknownSources)}')
+    if Observer is None and not args.polling:
+        print("未安装 watchdog，改用轮询监视（pip install watchdog 可启用文件系统通知）")
+
+    watcher = SyncWatcher(dict.fromkeys(args.sources or SOURCES), args.polling, args.debounce, args.interval)
+    watcher.run(initialSync=not args.no_initial_sync)
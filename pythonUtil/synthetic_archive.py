@@ -0,0 +1,195 @@
+""" 此文件用于生成与各下载器输出结构相同的模拟下载目录，供性能测试使用 """
+import argparse
+import csv
+import json
+import os
+import random
+
+SOURCES = ('kemono', 'pixiv', 'twitter')
+KEMONO_SERVICES = ('fanbox', 'patreon', 'fantia')
+TWITTER_HEADER = ['Tweet Date', 'Display Name', 'User Name', 'Tweet URL', 'Media Type', 'Media URL',
+                  'Saved Path', 'Tweet Content', 'Favorite Count', 'Retweet Count', 'Reply Count']
+
+
+class SyntheticArchive:
+    """
+    在 rootPath 下生成 kemono/、pixiv/、twitter/ 三个目录。
+
+    同一 seed 生成的内容完全相同；appendPosts() 模拟下载器的一次增量下载（新帖子与 CSV 追加行），
+    可多次调用。图片文件默认为空文件，imageBytes 大于 0 时写入指定大小的内容。
+    """
+
+    def __init__(self, rootPath: str, seed: int = 0, imageBytes: int = 0):
+        self.rootPath = rootPath
+        self.kemonoPath = os.path.join(rootPath, 'kemono')
+        self.pixivPath = os.path.join(rootPath, 'pixiv')
+        self.twitterPath = os.path.join(rootPath, 'twitter')
+        self.random = random.Random(seed)
+        self.imageContent = b'\0' * imageBytes
+
+        self.nextPostId = 100000
+        self.nextTweetId = 1700000000000000000
+
+    def writeImage(self, filePath: str):
+        with open(filePath, 'wb') as f:
+            f.write(self.imageContent)
+
+    def randomDate(self):
+        return f"20{self.random.randint(15, 24)}-{self.random.randint(1, 12):02d}-{self.random.randint(1, 28):02d}"
+
+    def generate(self, artistNumber: int, postNumber: int, attachmentNumber: int,
+                 ugoiraEvery: int = 10, unnormalizedRatio: float = 0.0, sources=SOURCES):
+        """ artistNumber 为每个来源的艺术家数，postNumber 为每位艺术家的帖子（推文）数，attachmentNumber 为每个帖子的最大附件数 """
+        for a in range(artistNumber):
+            if 'kemono' in sources:
+                artistDirPath = os.path.join(self.kemonoPath, f"kemono artist {a}")
+                os.makedirs(artistDirPath, exist_ok=True)
+                for _ in range(postNumber):
+                    self.addKemonoPost(artistDirPath, a, attachmentNumber, unnormalizedRatio)
+
+            if 'pixiv' in sources:
+                artistDirPath = os.path.join(self.pixivPath, f"pixiv artist {a} ({10000 + a})")
+                os.makedirs(artistDirPath, exist_ok=True)
+                self.writeImage(os.path.join(artistDirPath, 'avatar.jpg'))
+                if a % 2 == 0:
+                    self.writeImage(os.path.join(artistDirPath, 'background.png'))
+                for p in range(postNumber):
+                    self.addPixivPost(artistDirPath, a, attachmentNumber, ugoira=ugoiraEvery > 0 and p % ugoiraEvery == 0)
+
+            if 'twitter' in sources:
+                screenName = f"twitter_artist_{a}"
+                os.makedirs(os.path.join(self.twitterPath, screenName), exist_ok=True)
+                self.writeTweets(self.getTwitterCsvPath(screenName, 0), a, postNumber)
+
+    def appendPosts(self, postNumber: int, attachmentNumber: int, unnormalizedRatio: float = 0.0, sources=SOURCES):
+        """ 为已有的每位艺术家追加 postNumber 个帖子，并在每位 Twitter 艺术家的 CSV 末尾追加同样数量的推文 """
+        if 'kemono' in sources:
+            for a, artistName in enumerate(sorted(os.listdir(self.kemonoPath))):
+                artistDirPath = os.path.join(self.kemonoPath, artistName)
+                for _ in range(postNumber):
+                    self.addKemonoPost(artistDirPath, a, attachmentNumber, unnormalizedRatio)
+
+        if 'pixiv' in sources:
+            for a, artistFolderName in enumerate(sorted(os.listdir(self.pixivPath))):
+                artistDirPath = os.path.join(self.pixivPath, artistFolderName)
+                for _ in range(postNumber):
+                    self.addPixivPost(artistDirPath, a, attachmentNumber, ugoira=False)
+
+        if 'twitter' in sources:
+            for a, screenName in enumerate(sorted(os.listdir(self.twitterPath))):
+                self.writeTweets(self.getTwitterCsvPath(screenName, 0), a, postNumber)
+
+    def addKemonoPost(self, artistDirPath: str, artistIndex: int, attachmentNumber: int, unnormalizedRatio: float):
+        self.nextPostId += 1
+        postId = str(self.nextPostId)
+        service = KEMONO_SERVICES[artistIndex % len(KEMONO_SERVICES)]
+        published = self.randomDate()
+        title = f"post {postId} 作品"
+        attachments = [{"name": f"{postId}_{i}.png", "path": f"/data/{postId}/{i}.png"}
+                       for i in range(self.random.randint(0, attachmentNumber))]
+
+        # 未规范化的目录名用于测试 PostRenamer
+        if self.random.random() < unnormalizedRatio:
+            postFolderName = postId
+        else:
+            postFolderName = f"[{service}][{published}]{title}"
+        postDirPath = os.path.join(artistDirPath, postFolderName)
+        os.makedirs(postDirPath, exist_ok=True)
+
+        jsonData = {
+            "id": postId,
+            "user": f"user{artistIndex}",
+            "service": service,
+            "title": title,
+            "content": "<p>" + "内容 " * self.random.randint(5, 50) + "</p>",
+            "published": f"{published}T12:00:00",
+            "file": {"name": f"{postId}_cover.jpg", "path": f"/data/{postId}/cover.jpg"},
+            "attachments": attachments,
+        }
+        with open(os.path.join(postDirPath, 'post.json'), 'w', encoding='utf-8') as f:
+            json.dump(jsonData, f, ensure_ascii=False)
+        for i in range(len(attachments)):
+            self.writeImage(os.path.join(postDirPath, f"{i + 1}.png"))
+
+    def addPixivPost(self, artistDirPath: str, artistIndex: int, pageNumber: int, ugoira: bool):
+        self.nextPostId += 1
+        illustId = str(self.nextPostId)
+        uploadDate = self.randomDate()
+        pageCount = 1 if ugoira else self.random.randint(1, max(1, pageNumber))
+        firstFileName = f"{illustId}_ugoira0.jpg" if ugoira else f"{illustId}_p0.png"
+
+        postDirPath = os.path.join(artistDirPath, f"[{uploadDate}]illust {illustId}")
+        os.makedirs(postDirPath, exist_ok=True)
+
+        jsonData = {
+            "illustId": illustId,
+            "illustTitle": f"illust {illustId}",
+            "illustComment": "コメント " * self.random.randint(0, 20),
+            "illustType": 2 if ugoira else 0,
+            "uploadDate": f"{uploadDate}T10:00:00+00:00",
+            "userId": str(10000 + artistIndex),
+            "userName": f"pixiv artist {artistIndex}",
+            "userAccount": f"account{artistIndex}",
+            "pageCount": pageCount,
+            "urls": {"original": f"https://i.pximg.net/img-original/img/{firstFileName}"},
+            "bookmarkCount": self.random.randint(0, 10000),
+            "likeCount": self.random.randint(0, 10000),
+            "commentCount": self.random.randint(0, 100),
+            "viewCount": self.random.randint(0, 100000),
+            "xRestrict": 0,
+            "isHowto": False,
+            "isOriginal": True,
+            "aiType": 1,
+            "tags": {"tags": [{"tag": f"tag{self.random.randint(0, 50)}"} for _ in range(self.random.randint(1, 8))]},
+        }
+        with open(os.path.join(postDirPath, f"{illustId}.json"), 'w', encoding='utf-8') as f:
+            json.dump(jsonData, f, ensure_ascii=False)
+
+        if ugoira:
+            self.writeImage(os.path.join(postDirPath, f"{illustId}_ugoira1920x1080.ugoira"))
+        else:
+            for i in range(pageCount):
+                self.writeImage(os.path.join(postDirPath, f"{illustId}_p{i}.png"))
+
+    def getTwitterCsvPath(self, screenName: str, index: int):
+        return os.path.join(self.twitterPath, screenName, f"{screenName}-{index}.csv")
+
+    def writeTweets(self, csvFilePath: str, artistIndex: int, tweetNumber: int):
+        """ 文件不存在时先写入 4 行表头，之后追加推文 """
+        screenName = os.path.basename(os.path.dirname(csvFilePath))
+        isNewFile = not os.path.exists(csvFilePath)
+        with open(csvFilePath, 'a', newline='', encoding='utf-8-sig' if isNewFile else 'utf-8') as f:
+            writer = csv.writer(f)
+            if isNewFile:
+                writer.writerow([f"Twitter Artist {artistIndex}", screenName])
+                writer.writerow([f"https://x.com/{screenName}"])
+                writer.writerow([])
+                writer.writerow(TWITTER_HEADER)
+            for _ in range(tweetNumber):
+                self.nextTweetId += 1
+                tweetId = self.nextTweetId
+                # 正文中可能包含换行，csv 模块会为其加上引号
+                content = "tweet 推文\n" * self.random.randint(1, 3) + f" https://t.co/{tweetId}"
+                writer.writerow([
+                    f"{self.randomDate()} 10:00", f"Twitter Artist {artistIndex}", screenName,
+                    f"https://x.com/{screenName}/status/{tweetId}/photo/1", 'Image',
+                    f"https://pbs.twimg.com/media/{tweetId}.jpg", f"{tweetId}_1.jpg", content,
+                    self.random.randint(0, 1000), self.random.randint(0, 100), self.random.randint(0, 10),
+                ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成模拟的 Kemono、Pixiv、Twitter 下载目录')
+    parser.add_argument('rootPath', help='输出目录，将在其中创建 kemono/、pixiv/、twitter/')
+    parser.add_argument('--artists', type=int, default=20, help='每个来源的艺术家数量')
+    parser.add_argument('--posts', type=int, default=50, help='每位艺术家的帖子（推文）数量')
+    parser.add_argument('--attachments', type=int, default=5, help='每个帖子的最大附件（页）数')
+    parser.add_argument('--ugoira-every', type=int, default=10, help='每隔多少个 Pixiv 帖子生成一个 ugoira，0 表示不生成')
+    parser.add_argument('--unnormalized-ratio', type=float, default=0.0, help='Kemono 帖子目录名未规范化的比例')
+    parser.add_argument('--image-bytes', type=int, default=0, help='每个图片文件的大小（字节）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    archive = SyntheticArchive(args.rootPath, seed=args.seed, imageBytes=args.image_bytes)
+    archive.generate(args.artists, args.posts, args.attachments, args.ugoira_every, args.unnormalized_ratio)
+    print(f"已生成模拟下载目录: {args.rootPath}")
@@ -0,0 +1,39 @@
+""" twitter_sync 中按字节偏移读取 CSV 的测试，执行 python -m unittest test_twitter_csv """
+import os
+import tempfile
+import unittest
+
+from twitter_sync import iterCsvRows, iterCsvRowsWithOffset
+
+
+class IterCsvRowsWithOffsetTest(unittest.TestCase):
+    def writeCsv(self, content: bytes):
+        fd, csvFilePath = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        self.addCleanup(os.remove, csvFilePath)
+        return csvFilePath
+
+    def test_fullReadIncludesLastRowWithoutTrailingNewline(self):
+        csvFilePath = self.writeCsv(b'\xef\xbb\xbfa,1\r\nb,2\r\nc,3')
+        rows = list(iterCsvRowsWithOffset(csvFilePath))
+        self.assertEqual([row for row, _ in rows], [row for row in iterCsvRows(csvFilePath)])
+        self.assertEqual([row for row, _ in rows], [['a', '1'], ['b', '2'], ['c', '3']])
+        # 最后一行的偏移不越过其开头，续读时重新读取该行
+        self.assertEqual([offset for _, offset in rows], [8, 13, 13])
+
+    def test_resumeReadHoldsBackUnterminatedTail(self):
+        csvFilePath = self.writeCsv(b'a,1\nb,2\nc,')
+        self.assertEqual(list(iterCsvRowsWithOffset(csvFilePath, 4)), [(['b', '2'], 8)])
+
+        with open(csvFilePath, 'ab') as f:
+            f.write(b'3\n')
+        self.assertEqual(list(iterCsvRowsWithOffset(csvFilePath, 8)), [(['c', '3'], 12)])
+
+    def test_fullReadOfUnterminatedMultilineRowKeepsRowStartOffset(self):
+        csvFilePath = self.writeCsv(b'a,1\nb,"x\ny"')
+        self.assertEqual(list(iterCsvRowsWithOffset(csvFilePath)), [(['a', '1'], 4), (['b', 'x\ny'], 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
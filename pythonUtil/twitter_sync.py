@@ -1,12 +1,77 @@
 """_"""
 from peewee import *
+import argparse
 import os
 import csv
+import codecs
+import hashlib
+import itertools
 from datetime import datetime
 
+from Util import Util
 from filePathConfig import Config
+from BatchInserter import BatchInserter
+from BoundedTransaction import BoundedTransaction
+from ScanManifest import ScanManifestBase, ScanManifest
+from Reconciler import Reconciler
+from FullTextIndex import FullTextIndex
+from ImageProbe import ImageProber
+from SyncMetrics import SyncMetrics, metrics
+
+db = SqliteDatabase(Config.TWITTER_DB_PATH, pragmas=Util.getSqlitePragmas())
+
+# CSV 开头的表头行数，第 0 行为 [艺术家名, twitter_artist_id, ...]，之后每行一条推文
+CSV_HEADER_ROW_NUMBER = 4
+
+
+def iterCsvRows(csvFilePath: str, skipRowNumber: int = 0):
+    """ 逐行读取 CSV，内存占用与文件大小无关 """
+    with open(csvFilePath, 'r', newline='', encoding='utf-8-sig') as f:
+        yield from itertools.islice(csv.reader(f), skipRowNumber, None)
+
+
+def iterCsvRowsWithOffset(csvFilePath: str, startOffset: int = 0):
+    """
+    从字节偏移 startOffset 开始逐行读取 CSV，产出 (row, rowEndOffset)。
+
+    rowEndOffset 为该行（可能因引号内换行跨越多个物理行）结束处的字节偏移，可作为下次续读的起点。
+    末尾没有换行符的行可能是下载器尚未写完的内容，也可能是写完后没有换行的最后一行：
+    从头读取（startOffset 为 0）时与 iterCsvRows 一样读取该行，但 rowEndOffset 仍为该行开始处的偏移，
+    下次续读时重新读取（已入库的推文由唯一约束跳过）；续读时不读取该行。
+    """
+    position = startOffset
+    readsUnterminatedTail = startOffset == 0
+    reachedUnterminatedTail = False
+
+    def iterLines(f):
+        nonlocal position, reachedUnterminatedTail
+        for rawLine in f:
+            lineStartOffset = position
+            if rawLine.endswith(b'\n'):
+                position += len(rawLine)
+            elif readsUnterminatedTail:
+                reachedUnterminatedTail = True
+            else:
+                return
+            if lineStartOffset == 0 and rawLine.startswith(codecs.BOM_UTF8):
+                rawLine = rawLine[len(codecs.BOM_UTF8):]
+            yield rawLine.decode('utf-8')
+
+    with open(csvFilePath, 'rb') as f:
+        f.seek(startOffset)
+        rowEndOffset = startOffset
+        try:
+            for row in csv.reader(iterLines(f)):
+                if reachedUnterminatedTail:
+                    # 不推进偏移：该行可能尚未写完，且可能跨越多个物理行
+                    yield row, rowEndOffset
+                    return
+                rowEndOffset = position
+                yield row, rowEndOffset
+        except csv.Error:
+            # 跨行的引号字段未写完
+            return
 
-db = SqliteDatabase(Config.TWITTER_DB_PATH, pragmas={'foreign_keys': 1})
 
 # 单例装饰器
 def singleton(cls):
@@ -25,14 +90,14 @@ class BaseModel(Model):
 class TwitterArtist(BaseModel):
     id = AutoField(column_name='id')  # 自动递增主键
     name = TextField(column_name='name')
-    twitter_artist_id = TextField(column_name='twitter_artist_id')
+    twitter_artist_id = TextField(column_name='twitter_artist_id', index=True)
 
     class Meta:
         table_name = 'twitterArtist'
 
 class TwitterPost(BaseModel):
     id = AutoField(column_name='id')
-    tweet_id = TextField(column_name='tweet_id')
+    tweet_id = TextField(column_name='tweet_id', index=True)
     artist = ForeignKeyField(TwitterArtist, column_name='artist_id', backref='posts', on_delete='CASCADE')
     content = TextField(column_name='content')
     tweet_date = TextField(column_name='tweet_date')
@@ -42,9 +107,69 @@ class TwitterPost(BaseModel):
     retweet_count = IntegerField(column_name='retweet_count')
     reply_count = IntegerField(column_name='reply_count')
     viewed = BooleanField(column_name='viewed', default=False)
+    thumb_key = TextField(column_name='thumb_key', null=True, index=True)  # 缩略图缓存的键（原图内容的哈希）；NULL 为尚未生成，空字符串为无法生成或已被淘汰
+    # 由文件头读取，不解码图片；byte_size 为 NULL 表示尚未探测（文件不存在），无法识别的格式（视频等）只有 byte_size
+    width = IntegerField(column_name='width', null=True)
+    height = IntegerField(column_name='height', null=True)
+    byte_size = IntegerField(column_name='byte_size', null=True)
+    format = TextField(column_name='format', null=True)
 
     class Meta:
         table_name = 'twitterImage'
+        indexes = (
+            (('artist', 'tweet_date'), False),
+            (('artist', 'viewed'), False),
+            # 每个媒体文件一行，同一推文的多个文件共用 tweet_id，因此以文件名区分
+            (('artist', 'filename'), True),
+        )
+
+class TwitterScanManifest(ScanManifestBase):
+    class Meta:
+        database = db
+        table_name = 'twitterScanManifest'
+
+class TwitterCsvCheckpoint(BaseModel):
+    """ 每个 CSV 文件已读取到的位置，下次同步从该位置继续读取追加的推文 """
+    id = AutoField(column_name='id')
+    csv_path = TextField(column_name='csv_path', unique=True)  # 相对于 TWITTER_BASEPATH
+    file_size = IntegerField(column_name='file_size')
+    file_mtime = IntegerField(column_name='file_mtime')
+    ingested_offset = IntegerField(column_name='ingested_offset')
+    tail_hash = TextField(column_name='tail_hash')  # 偏移之前若干字节的哈希，用于识别文件被重写
+
+    class Meta:
+        table_name = 'twitterCsvCheckpoint'
+
+class TwitterReconciler(Reconciler):
+    """ 被清理的艺术家目录还需删除其中 CSV 的检查点，否则目录恢复后推文不会被重新读取 """
+
+    def forgetRemovedArtistDirs(self, artistDirsName):
+        super().forgetRemovedArtistDirs(artistDirsName)
+        if self.dryRun:
+            return
+        for artistDirName in artistDirsName:
+            TwitterCsvCheckpoint.delete().where(TwitterCsvCheckpoint.csv_path.startswith(artistDirName + '/')).execute()
+
+
+# 帖子文本的全文索引，同步类与只读的工具（search_posts.py）共用
+fullTextIndex = FullTextIndex(db, TwitterPost, ['content'], groupFieldName='tweet_id')
+
+
+def iterImageFiles(condition, batchSize: int = 5000):
+    """ 按主键顺序分批返回满足 condition 的推文图片行的 [(主键, 文件路径)]，每批一次查询 """
+    lastImageId = 0
+    while True:
+        rows = list(TwitterPost.select(
+            TwitterPost.id, TwitterArtist.twitter_artist_id, TwitterPost.filename
+        ).join(TwitterArtist).where(
+            condition & (TwitterPost.id > lastImageId)
+        ).order_by(TwitterPost.id).limit(batchSize).tuples())
+        if not rows:
+            return
+        yield [(imageId, os.path.join(Config.TWITTER_BASEPATH, artistId, fileName))
+               for imageId, artistId, fileName in rows]
+        lastImageId = rows[-1][0]
+
 
 @singleton
 class TwitterSyncer:
@@ -52,7 +177,15 @@ class TwitterSyncer:
         # connect to the database
         # if the database does not exist, it will be created
         db.connect()
+        self.fullTextIndex = fullTextIndex
         self.create_tables_if_not_exist()
+        self.imageProber = ImageProber([TwitterPost.width, TwitterPost.height, TwitterPost.byte_size, TwitterPost.format])
+        self.batchInserter = BatchInserter(TwitterPost, postsInsertedCallbacks=[self.fullTextIndex], imageProber=self.imageProber,
+                                           postKeyFieldNames=['artist', 'filename'])
+        # CSV 文件是原地追加的，目录 mtime 不会变化，因此指纹需要包含文件大小与 mtime
+        self.scanManifest = ScanManifest(TwitterScanManifest, trustDirMtime=False, includeFileStats=True)
+        # 当前艺术家已处理的 (CSV 路径, 已读取到的偏移)，与推文在同一事务中写入
+        self.pendingCheckpoints = []
 
     def checkIfTablesExist(self):
         with db:
@@ -66,23 +199,78 @@ class TwitterSyncer:
             if not self.checkIfTablesExist():
                 db.create_tables([TwitterArtist, TwitterPost])
                 print("所有表创建成功")
+            else:
+                Util.addMissingColumns(db, [TwitterArtist, TwitterPost])
+                # 建立唯一约束之前合并旧数据库中重复的推文行
+                Util.mergeDuplicateRows(db, TwitterPost, ['artist', 'filename'], self.deletePosts, ['viewed'])
+                Util.createMissingIndexes(db, [TwitterArtist, TwitterPost])
+            # 辅助表，旧数据库中按需补建
+            db.create_tables([TwitterScanManifest, TwitterCsvCheckpoint], safe=True)
+            if self.fullTextIndex.createIfNotExists():
+                print("已创建全文索引")
+
+    def deletePosts(self, postIds):
+        # 全文索引不存在时随后由推文表建立
+        if self.fullTextIndex.exists():
+            self.fullTextIndex.deleteRows(postIds)
+        TwitterPost.delete().where(TwitterPost.id.in_(postIds)).execute()
 
     def getAllCsvFilePaths(self, inputDirPath: str):
         artistName = os.path.basename(inputDirPath)
-        csvFilesName = sorted([
-            f for f in os.listdir(inputDirPath) if os.path.isfile(os.path.join(inputDirPath, f)) and f.startswith(artistName) and f.endswith('.csv')
-        ])
+        csvFilesName = [
+            f for f in Util.scanDirectory(inputDirPath).filesNameWithExtension('.csv') if f.startswith(artistName)
+        ]
         csvFilesPath = [os.path.join(inputDirPath, f) for f in csvFilesName]
         return csvFilesPath
 
-    def startSync(self):
-        artistsId = sorted([
-            f for f in os.listdir(Config.TWITTER_BASEPATH) if os.path.isdir(os.path.join(Config.TWITTER_BASEPATH, f))
-        ])
+    def startSync(self, fullScan: bool = False):
+        """ fullScan 为 True 时忽略扫描清单，重新检查所有艺术家目录 """
+        with metrics.stage('scan'):
+            artistsId = Util.scanDirectory(Config.TWITTER_BASEPATH).subdirectoriesName
+        skippedArtistNumber = 0
         for artistId in artistsId:
-            with db.atomic() as transaction:
-                self.handleOneArtist(artistId)
+            artistDirPath = os.path.join(Config.TWITTER_BASEPATH, artistId)
+            with metrics.stage('scan'):
+                if fullScan:
+                    dirSnapshot = self.scanManifest.takeSnapshot(artistDirPath)
+                else:
+                    unchanged, dirSnapshot = self.scanManifest.check(artistId, artistDirPath)
+            if not fullScan and unchanged:
+                skippedArtistNumber += 1
+                continue
+
+            self.syncOneArtist(artistId, dirSnapshot)
+
+        metrics.count('skipped_artists', skippedArtistNumber)
+        if skippedArtistNumber:
+            print(f"跳过 {skippedArtistNumber} 位目录未变化的艺术家")
+        Util.checkpointDatabase(db)
+
+
+    def reconcile(self, dryRun: bool = False, checkFiles: bool = False, reportFile=None):
+        """ 删除磁盘上已不存在的艺术家目录对应的行，checkFiles 为 True 时同时删除不存在的图片文件对应的推文行；返回各表清理的行数 """
+        reconciler = TwitterReconciler(db, Config.TWITTER_BASEPATH, TwitterArtist.twitter_artist_id, TwitterPost.filename,
+                                       manifestModel=TwitterScanManifest, fullTextIndex=self.fullTextIndex)
+        return reconciler.run(dryRun, checkFiles, reportFile)
 
+    def syncOneArtist(self, artistId: str, dirSnapshot=None):
+        """ 在有界事务中同步一位艺术家，完成后记录 CSV 检查点与扫描清单；dirSnapshot 为 None 时现在读取目录快照 """
+        if dirSnapshot is None:
+            dirSnapshot = self.scanManifest.takeSnapshot(os.path.join(Config.TWITTER_BASEPATH, artistId))
+
+        print(f'{artistId}: ', flush=True, end='')
+        try:
+            with metrics.artist(artistId), BoundedTransaction(db) as transaction:
+                self.batchInserter.transaction = transaction
+                self.handleOneArtist(artistId)
+                self.batchInserter.flush()
+                self.recordCsvCheckpoints()
+                self.scanManifest.record(artistId, dirSnapshot)
+        finally:
+            self.batchInserter.transaction = None
+            self.batchInserter.discard()
+            self.pendingCheckpoints = []
+        print('', flush=True)
 
     def handleNewArtist(self, artistId):
         artistDirPath = os.path.join(Config.TWITTER_BASEPATH, artistId)
@@ -91,19 +279,57 @@ class TwitterSyncer:
         artist_SQLObj = self.writeArtistDataToDatabase(csvFilePaths)
 
         for csvFilePath in csvFilePaths:
-            self.handleOneCsvFile(csvFilePath, artist_SQLObj)
+            endOffset = self.handleOneCsvFile(csvFilePath, artist_SQLObj)
+            self.pendingCheckpoints.append((csvFilePath, endOffset))
 
     def handleExistedArtist(self, artist_SQLObj, artistId):
-        all_tweet_ids_SQLObj = TwitterPost.select(TwitterPost.tweet_id).where(
-            TwitterPost.artist == artist_SQLObj.id
-        )
-        allExistedTweetIds = set(map(lambda x: x.tweet_id, all_tweet_ids_SQLObj))
-
         artistDirPath = os.path.join(Config.TWITTER_BASEPATH, artistId)
         csvFilePaths = self.getAllCsvFilePaths(artistDirPath)
 
+        # 没有检查点的文件从头读取，已入库的推文由唯一约束跳过
         for csvFilePath in csvFilePaths:
-            self.handleOneCsvFile(csvFilePath, artist_SQLObj, existedTweetIds=allExistedTweetIds)
+            endOffset = self.handleOneCsvFile(csvFilePath, artist_SQLObj, startOffset=self.getResumeOffset(csvFilePath) or 0)
+            self.pendingCheckpoints.append((csvFilePath, endOffset))
+
+    def getCsvRelativePath(self, csvFilePath: str):
+        return os.path.relpath(csvFilePath, Config.TWITTER_BASEPATH).replace(os.sep, '/')
+
+    def computeTailHash(self, csvFilePath: str, offset: int):
+        with open(csvFilePath, 'rb') as f:
+            start = max(0, offset - Config.CSV_CHECKPOINT_TAIL_BYTES)
+            f.seek(start)
+            return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+    def getResumeOffset(self, csvFilePath: str):
+        """ 返回可以续读的字节偏移；没有检查点、文件变短或已读部分被改写时返回 None，表示需要从头读取 """
+        checkpoint = TwitterCsvCheckpoint.get_or_none(TwitterCsvCheckpoint.csv_path == self.getCsvRelativePath(csvFilePath))
+        if checkpoint is None or checkpoint.ingested_offset <= 0:
+            return None
+
+        stat = os.stat(csvFilePath)
+        if stat.st_size == checkpoint.file_size and stat.st_mtime_ns == checkpoint.file_mtime:
+            return checkpoint.ingested_offset
+        if stat.st_size < checkpoint.ingested_offset:
+            return None
+        if self.computeTailHash(csvFilePath, checkpoint.ingested_offset) != checkpoint.tail_hash:
+            return None
+        return checkpoint.ingested_offset
+
+    def recordCsvCheckpoints(self):
+        for csvFilePath, endOffset in self.pendingCheckpoints:
+            stat = os.stat(csvFilePath)
+            TwitterCsvCheckpoint.insert(
+                csv_path=self.getCsvRelativePath(csvFilePath),
+                file_size=stat.st_size,
+                file_mtime=stat.st_mtime_ns,
+                ingested_offset=endOffset,
+                tail_hash=self.computeTailHash(csvFilePath, endOffset)
+            ).on_conflict(
+                conflict_target=[TwitterCsvCheckpoint.csv_path],
+                preserve=[TwitterCsvCheckpoint.file_size, TwitterCsvCheckpoint.file_mtime,
+                          TwitterCsvCheckpoint.ingested_offset, TwitterCsvCheckpoint.tail_hash]
+            ).execute()
+        self.pendingCheckpoints = []
 
     def handleOneArtist(self, artistId: str):
         artists_SQLObj = TwitterArtist.select(TwitterArtist).where(
@@ -120,49 +346,70 @@ class TwitterSyncer:
 
     def writeArtistDataToDatabase(self, csvFilesPath: str):
         for csvFilePath in csvFilesPath:
-            with open(csvFilePath, 'r', newline='', encoding='utf-8-sig') as f:
-                reader = csv.reader(f)
-                allData = list(reader)
-            if len(allData) < 5:
+            # 只读取表头与第一条推文，用于确认文件中确实有推文
+            rows = iterCsvRows(csvFilePath)
+            firstRows = list(itertools.islice(rows, CSV_HEADER_ROW_NUMBER + 1))
+            rows.close()
+            if len(firstRows) < CSV_HEADER_ROW_NUMBER + 1:
                 continue
             return TwitterArtist.create(
-                name=allData[0][0],
-                twitter_artist_id=allData[0][1],
+                name=firstRows[0][0],
+                twitter_artist_id=firstRows[0][1],
             )
         return None
 
-    def handleOneCsvFile(self, csvFilePath: str, artist_SQLObj, existedTweetIds: set = None):
-        with open(csvFilePath, 'r', newline='', encoding='utf-8-sig') as f:
-            reader = csv.reader(f)
-            allData = list(reader)
-
-        if len(allData) < 5:
-            return
-
-        allTweet = allData[4:]
-
-        for currentTweet in allTweet:
-            tweet_id = currentTweet[3].split('/')[-3]
-
-            if existedTweetIds and tweet_id in existedTweetIds:
-                continue
-
-            tweetContent = ' '.join(currentTweet[-4].split(' ')[:-1])
-
-            TwitterPost.create(
-                tweet_id=tweet_id,
-                artist=artist_SQLObj,
-                content=tweetContent,
-                tweet_date=currentTweet[0],
-                tweet_url=currentTweet[-4].split(' ')[-1],
-                filename=currentTweet[-5],
-                favorite_count=int(currentTweet[-3]),
-                retweet_count=int(currentTweet[-2]),
-                reply_count=int(currentTweet[-1])
-            )
-
+    def handleOneCsvFile(self, csvFilePath: str, artist_SQLObj, startOffset: int = 0):
+        """
+        从字节偏移 startOffset 处读取 CSV（为 0 时先跳过表头），返回已读取的最后一行结束处的偏移。
+
+        不查询数据库去重：(artist_id, name) 上有唯一约束，已入库的推文在写入时被跳过。
+        """
+        # 表头没有读完整时返回 0，下次仍从头读取
+        endOffset = startOffset
+        artistDirPath = os.path.dirname(csvFilePath)
+
+        # 逐行读取，BatchInserter 按批写入，整个文件不会同时驻留内存
+        with metrics.stage('read'):
+            for rowIndex, (currentTweet, rowEndOffset) in enumerate(iterCsvRowsWithOffset(csvFilePath, startOffset)):
+                if startOffset == 0 and rowIndex < CSV_HEADER_ROW_NUMBER:
+                    if rowIndex == CSV_HEADER_ROW_NUMBER - 1:
+                        endOffset = rowEndOffset
+                    continue
+                endOffset = rowEndOffset
+
+                tweet_id = currentTweet[3].split('/')[-3]
+                tweetContent = ' '.join(currentTweet[-4].split(' ')[:-1])
+
+                tweetRow = dict(
+                    tweet_id=tweet_id,
+                    artist=artist_SQLObj.id,
+                    content=tweetContent,
+                    tweet_date=currentTweet[0],
+                    tweet_url=currentTweet[-4].split(' ')[-1],
+                    filename=currentTweet[-5],
+                    favorite_count=int(currentTweet[-3]),
+                    retweet_count=int(currentTweet[-2]),
+                    reply_count=int(currentTweet[-1])
+                )
+                self.batchInserter.addPost(self.imageProber.submit(tweetRow, os.path.join(artistDirPath, tweetRow['filename'])))
+
+        return endOffset
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='将 Twitter 下载目录同步到数据库')
+    parser.add_argument('--full', action='store_true', help='忽略扫描清单，重新检查所有艺术家目录')
+    parser.add_argument('--rebuild-fts', action='store_true', help='不同步，只由推文表重建全文索引')
+    parser.add_argument('--backfill-image-info', action='store_true', help='不同步，只为尚未记录尺寸的图片读取文件头并写入')
+    SyncMetrics.addArguments(parser)
+    args = parser.parse_args()
+
+    metrics.startFromArgs('twitter', args)
     t = TwitterSyncer()
-    t.startSync()
+    if args.rebuild_fts:
+        print(f"已重建全文索引，共 {t.fullTextIndex.rebuild()} 条")
+    elif args.backfill_image_info:
+        t.imageProber.backfill(db, iterImageFiles)
+    else:
+        t.startSync(fullScan=args.full)
+    metrics.finish()